@@ -0,0 +1,42 @@
+"""
+Запуск сервера без GUI, в несколько процессов:
+
+    WORKERS=4 python -m app --port 8001
+
+При WORKERS > 1 эфемерное состояние (печатает, в сети) и события инвалидации
+идут через Postgres (STATE_BACKEND=postgres), поэтому воркеры видят одно и то же.
+У каждого воркера свой пул: соединений к БД будет до WORKERS * DB_POOL_MAX.
+Альтернатива под gunicorn:
+
+    gunicorn app.main:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8001 \\
+        --keyfile key.pem --certfile cert.pem
+"""
+import argparse
+import logging
+import os
+
+import uvicorn
+
+from app.core.config import Cfg
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the Quant server")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--workers", type=int, default=Cfg.WORKERS)
+    ap.add_argument("--no-ssl", action="store_true")
+    a = ap.parse_args()
+
+    # Воркеры читают Cfg заново при импорте app.main: число воркеров нужно им самим
+    # (лимиты делят скорость корзин на WORKERS)
+    os.environ["WORKERS"] = str(a.workers)
+    if a.workers > 1 and Cfg.STATE_BACKEND != "postgres":
+        # Значение читается в каждом воркере при импорте app.main
+        os.environ["STATE_BACKEND"] = "postgres"
+        logging.getLogger(__name__).warning("STATE_BACKEND forced to postgres for multiple workers")
+
+    ssl = {} if a.no_ssl else {"ssl_keyfile": "key.pem", "ssl_certfile": "cert.pem"}
+    uvicorn.run("app.main:app", host=a.host, port=a.port, workers=a.workers, log_level="info", **ssl)
+
+if __name__ == "__main__":
+    main()
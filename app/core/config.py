@@ -11,5 +11,48 @@ class Cfg:
     DB_PASS = os.getenv('DB_PASSWORD', '')
     DB_HOST = os.getenv('DB_HOST', 'localhost')
     DB_PORT = os.getenv('DB_PORT', '5432')
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+    # Повторные попытки подключения при старте (БД может подниматься дольше сервера)
+    DB_CONNECT_RETRIES = int(os.getenv('DB_CONNECT_RETRIES', '5'))
+    DB_CONNECT_BACKOFF = float(os.getenv('DB_CONNECT_BACKOFF', '1.0'))
     
-    SECRET_KEY = os.getenv('SECRET_KEY', 'default_insecure_key')
\ No newline at end of file
+    SECRET_KEY = os.getenv('SECRET_KEY', 'default_insecure_key')
+
+    # Трассировка SQL: порог медленного запроса и доля запросов, для которых снимается EXPLAIN
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+    EXPLAIN_SAMPLE_RATE = float(os.getenv('EXPLAIN_SAMPLE_RATE', '0.1'))
+    DEBUG_ENDPOINTS = os.getenv('DEBUG_ENDPOINTS', '0') == '1'
+    # Токен для /admin/* (заголовок X-Admin-Token); пусто — эндпоинты выключены
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+    # Несколько воркеров: эфемерное состояние должно жить в общем хранилище (postgres)
+    WORKERS = int(os.getenv('WORKERS', '1'))
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'postgres' if WORKERS > 1 else 'memory')
+
+    # Контроль нагрузки: "скорость:емкость" корзины токенов на пользователя/IP
+    RATE_POLL = os.getenv('RATE_POLL', '5:30')
+    RATE_WRITE = os.getenv('RATE_WRITE', '3:15')
+    RATE_HEAVY = os.getenv('RATE_HEAVY', '0.2:3')
+    RATE_CONTENT = os.getenv('RATE_CONTENT', '50:200')
+    # Сколько пользователей за одним адресом (NAT) получают полную квоту; больше — делят общую
+    RATE_USERS_PER_IP = int(os.getenv('RATE_USERS_PER_IP', '8'))
+    # Сколько ждать соединение из пула и при каком среднем ожидании начинать отбрасывать опросы
+    POOL_WAIT_MS = float(os.getenv('POOL_WAIT_MS', '1000'))
+    SHED_WAIT_MS = float(os.getenv('SHED_WAIT_MS', '250'))
+    # statement_timeout по умолчанию для соединений пула (мс, 0 — без ограничения)
+    STATEMENT_TIMEOUT_MS = int(os.getenv('STATEMENT_TIMEOUT_MS', '5000'))
+
+    # Помесячное секционирование messages (однократный перевод таблицы при старте)
+    MESSAGES_PARTITIONING = os.getenv('MESSAGES_PARTITIONING', '0') == '1'
+    PARTITIONS_AHEAD = int(os.getenv('PARTITIONS_AHEAD', '3'))
+
+    # Сколько часов помнить ключи идемпотентности отправки
+    MESSAGE_KEY_TTL_H = int(os.getenv('MESSAGE_KEY_TTL_H', '24'))
+
+    # Кэш профилей в процессе, секунды (сбрасывается событиями изменения профиля)
+    PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL', '30'))
+
+    # Фоновые массовые удаления: число потоков, размер пачки и пауза между пачками
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '1'))
+    JOB_BATCH = int(os.getenv('JOB_BATCH', '5000'))
+    JOB_PAUSE_MS = float(os.getenv('JOB_PAUSE_MS', '50'))
@@ -0,0 +1,65 @@
+import datetime
+import json
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+# Потоковая выгрузка: записи приходят генератором (постранично из БД),
+# наружу уходят готовые куски байтов — в памяти только текущая пачка.
+
+FLUSH_BYTES = 64 * 1024
+
+def _default(o):
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, (bytes, memoryview)):
+        return None
+    return str(o)
+
+def json_line(rec: dict) -> bytes:
+    return (json.dumps(rec, ensure_ascii=False, default=_default) + "\n").encode("utf-8")
+
+def stream_ndjson(records: Iterable[dict]) -> Iterator[bytes]:
+    buf = []
+    size = 0
+    for rec in records:
+        line = json_line(rec)
+        buf.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+class _Sink:
+    """Неперематываемый файл для zipfile: все записанное забирается через drain()."""
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts = []
+        self.size = 0
+        return out
+
+def stream_zip(files: Iterable[Tuple[str, Iterable[dict]]]) -> Iterator[bytes]:
+    """files — пары (имя внутри архива, записи); каждый файл пишется как NDJSON."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, records in files:
+            # force_zip64: размер заранее неизвестен и может превысить 4 ГБ
+            with zf.open(name, "w", force_zip64=True) as f:
+                for rec in records:
+                    f.write(json_line(rec))
+                    if sink.size >= FLUSH_BYTES:
+                        yield sink.drain()
+    yield sink.drain()
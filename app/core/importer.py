@@ -0,0 +1,179 @@
+"""
+Массовый импорт сообщений через COPY.
+
+    python -m app.core.importer archive.ndjson
+    python -m app.core.importer archive.csv --format csv
+
+NDJSON — строки в формате экспорта: {"from", "to", "created_at", "text", "attachments"}
+(записи с "type", отличным от "message", пропускаются). CSV — заголовок
+from,to,created_at,text[,attachments] (attachments — JSON-массив).
+
+Строки потоком идут COPY во временную таблицу без индексов, затем одним
+INSERT ... SELECT переносятся в messages с разрешением имен через JOIN.
+Отметки прочтения (импортированный архив считается прочитанным) и ANALYZE
+выполняются один раз в конце, а не на каждую строку.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import time
+from typing import Iterable, Iterator
+
+from app.core import payload
+
+logger = logging.getLogger("QuantServer.import")
+
+STAGE_COLS = ("ord", "sender", "receiver", "created_at", "content", "body", "attachments", "preview")
+
+def _esc(v) -> str:
+    if v is None:
+        return r"\N"
+    return str(v).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+class CopyStream:
+    """Файлоподобный источник для copy_expert: строки кодируются по мере чтения."""
+    def __init__(self, rows: Iterator[tuple]):
+        self._rows = rows
+        self._buf = b""
+        self.count = 0
+
+    def read(self, size=-1):
+        parts = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            line = ("\t".join(_esc(v) for v in row) + "\n").encode("utf-8")
+            parts.append(line)
+            have += len(line)
+            self.count += 1
+        data = b"".join(parts)
+        if size < 0:
+            self._buf = b""
+            return data
+        self._buf = data[size:]
+        return data[:size]
+
+    readline = read
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator[dict]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        rec = json.loads(line)
+        if rec.get("type", "message") != "message":
+            continue
+        yield rec
+
+def parse_csv(lines: Iterable[str]) -> Iterator[dict]:
+    for rec in csv.DictReader(lines):
+        atts = rec.get("attachments")
+        rec["attachments"] = json.loads(atts) if atts else []
+        yield rec
+
+def stage_rows(records: Iterable[dict]) -> Iterator[tuple]:
+    for i, rec in enumerate(records):
+        text = rec.get("text") or ""
+        atts = payload.normalize_attachments(rec.get("attachments") or [])
+        yield (i, rec.get("from"), rec.get("to"), rec.get("created_at") or None,
+               payload.to_legacy(text, atts), text, json.dumps(atts, ensure_ascii=False),
+               payload.build_preview(text, atts))
+
+def import_messages(cur, records: Iterable[dict], mark_read: bool = True) -> dict:
+    """Выполняется в транзакции вызывающего; при ошибке ничего не импортируется."""
+    t0 = time.perf_counter()
+    cur.execute("""
+        CREATE TEMP TABLE import_stage (
+            ord BIGINT, sender TEXT, receiver TEXT, created_at TIMESTAMPTZ,
+            content TEXT, body TEXT, attachments JSONB, preview TEXT
+        ) ON COMMIT DROP
+    """)
+    stream = CopyStream(stage_rows(records))
+    cur.copy_expert(f"COPY import_stage ({', '.join(STAGE_COLS)}) FROM STDIN", stream, size=1 << 16)
+    total = stream.count
+    t_copy = time.perf_counter() - t0
+
+    # Имена разрешаются одним JOIN; порядок id повторяет порядок времени в архиве.
+    # Отметка прочтения — одна на переписку, из RETURNING вставки (без повторного JOIN с messages)
+    cur.execute("""
+        WITH ins AS (
+            INSERT INTO messages (sender_id, receiver_id, content, body, attachments, preview, created_at,
+                                  is_read, deleted_for_sender, deleted_for_receiver)
+            SELECT su.id, ru.id, s.content, s.body, s.attachments, s.preview, COALESCE(s.created_at, NOW()),
+                   %(mark)s, FALSE, FALSE
+            FROM import_stage s
+            JOIN users su ON su.username = s.sender AND su.deleted_at IS NULL
+            JOIN users ru ON ru.username = s.receiver AND ru.deleted_at IS NULL
+            ORDER BY COALESCE(s.created_at, NOW()), s.ord
+            RETURNING id, sender_id, receiver_id
+        ),
+        rd AS (
+            INSERT INTO chat_state (user_id, peer_id, last_read_id)
+            SELECT receiver_id, sender_id, MAX(id) FROM ins
+            WHERE %(mark)s
+            GROUP BY 1, 2
+            ON CONFLICT (user_id, peer_id) DO UPDATE SET last_read_id = GREATEST(chat_state.last_read_id, EXCLUDED.last_read_id)
+        )
+        SELECT COUNT(*) AS n FROM ins
+    """, {"mark": mark_read})
+    imported = cur.fetchone()['n']
+
+    cur.execute("""
+        SELECT name FROM (
+            SELECT sender AS name FROM import_stage UNION SELECT receiver FROM import_stage
+        ) n
+        WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.username = n.name AND u.deleted_at IS NULL)
+        ORDER BY name LIMIT 20
+    """)
+    unknown = [r['name'] for r in cur.fetchall()]
+
+    elapsed = time.perf_counter() - t0
+    res = {
+        "rows": total,
+        "imported": imported,
+        "skipped": total - imported,
+        "unknown_users": unknown,
+        "copy_s": round(t_copy, 2),
+        "seconds": round(elapsed, 2),
+        "rows_per_s": int(total / elapsed) if elapsed > 0 else total,
+    }
+    logger.info(f"Imported {imported}/{total} messages in {elapsed:.1f}s ({res['rows_per_s']} rows/s)")
+    return res
+
+def parse(stream: io.TextIOBase, fmt: str) -> Iterator[dict]:
+    if fmt == "csv":
+        return parse_csv(stream)
+    return parse_ndjson(stream)
+
+def main(argv=None):
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    from app.core.config import Cfg
+
+    ap = argparse.ArgumentParser(description="Bulk-import messages into Quant")
+    ap.add_argument("path")
+    ap.add_argument("--format", choices=("ndjson", "csv"), default=None, help="default: by file extension")
+    ap.add_argument("--unread", action="store_true", help="do not mark imported messages as read")
+    a = ap.parse_args(argv)
+
+    fmt = a.format or ("csv" if a.path.lower().endswith(".csv") else "ndjson")
+    conn = psycopg2.connect(dbname=Cfg.DB_NAME, user=Cfg.DB_USER, password=Cfg.DB_PASS,
+                            host=Cfg.DB_HOST, port=Cfg.DB_PORT)
+    try:
+        with open(a.path, encoding="utf-8", newline="") as f, conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            res = import_messages(cur, parse(f, fmt), mark_read=not a.unread)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE messages")
+    finally:
+        conn.close()
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
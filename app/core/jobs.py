@@ -0,0 +1,169 @@
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger("QuantServer.jobs")
+
+# Очередь фоновых задач в Postgres: массовые удаления выполняются пачками вне запроса.
+# Задачу забирает один воркер (FOR UPDATE SKIP LOCKED), прогресс пишется в строку задачи,
+# так что его видно из любого воркера сервера. Зависшие задачи (нет heartbeat) забираются снова.
+
+STALE_AFTER_S = 120
+
+class JobInterrupted(Exception):
+    """Сервер останавливается: задача остается running и будет подобрана после STALE_AFTER_S."""
+
+class JobQueue:
+    def __init__(self, get_cursor, workers: int = 1, batch: int = 5000, pause: float = 0.05, poll: float = 5.0):
+        self._cursor = get_cursor
+        self.workers = workers
+        self.batch = batch
+        self.pause = pause
+        self.poll = poll
+        self._handlers: Dict[str, Callable] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def ensure_schema(self):
+        with self._cursor(statement_timeout=0) as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS bulk_jobs (
+                    id BIGSERIAL PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params JSONB NOT NULL DEFAULT '{}'::jsonb,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    progress BIGINT NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    started_at TIMESTAMPTZ,
+                    heartbeat_at TIMESTAMPTZ,
+                    finished_at TIMESTAMPTZ
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS bulk_jobs_pending_idx ON bulk_jobs (id) WHERE status IN ('queued', 'running')")
+
+    def register(self, kind: str, handler: Callable):
+        """handler(job_id, params) выполняет задачу, вызывая delete_batches/step."""
+        self._handlers[kind] = handler
+
+    @staticmethod
+    def enqueue(cur, kind: str, params: dict) -> int:
+        # Курсор вызывающего — постановка в очередь атомарна с его изменениями
+        cur.execute("INSERT INTO bulk_jobs (kind, params) VALUES (%s, %s) RETURNING id", (kind, json.dumps(params)))
+        return cur.fetchone()['id']
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._cursor() as cur:
+            cur.execute("""
+                SELECT id, kind, status, progress, error, created_at, started_at, finished_at
+                FROM bulk_jobs WHERE id = %s
+            """, (job_id,))
+            return cur.fetchone()
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        self.ensure_schema()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"bulk-jobs-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _claim(self) -> Optional[dict]:
+        with self._cursor() as cur:
+            cur.execute(f"""
+                UPDATE bulk_jobs SET status = 'running', started_at = COALESCE(started_at, NOW()), heartbeat_at = NOW()
+                WHERE id = (
+                    SELECT id FROM bulk_jobs
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND heartbeat_at < NOW() - INTERVAL '{STALE_AFTER_S} seconds')
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, kind, params
+            """)
+            return cur.fetchone()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.warning(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(self.poll)
+                self._wake.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        jid, kind = job['id'], job['kind']
+        handler = self._handlers.get(kind)
+        t0 = time.perf_counter()
+        try:
+            if handler is None:
+                raise RuntimeError(f"no handler for job kind '{kind}'")
+            handler(jid, job['params'] or {})
+            if self._stop.is_set():
+                raise JobInterrupted()
+            with self._cursor() as cur:
+                cur.execute("UPDATE bulk_jobs SET status = 'done', finished_at = NOW() WHERE id = %s", (jid,))
+            logger.info(f"Job {jid} ({kind}) done in {time.perf_counter() - t0:.1f}s")
+        except JobInterrupted:
+            logger.info(f"Job {jid} ({kind}) interrupted by shutdown")
+        except Exception as e:
+            logger.error(f"Job {jid} ({kind}) failed: {e}")
+            try:
+                with self._cursor() as cur:
+                    cur.execute("UPDATE bulk_jobs SET status = 'failed', error = %s, finished_at = NOW() WHERE id = %s",
+                                (str(e)[:500], jid))
+            except Exception as e2:
+                logger.error(f"Job {jid} status update failed: {e2}")
+
+    def delete_batches(self, job_id: int, table: str, where: str, params: tuple) -> int:
+        """Удаляет строки table по условию пачками по self.batch с паузой между ними.
+        У секционированной таблицы ключ (id, created_at) — для отсечения секций; у обычной
+        только id: строка с created_at NULL по равенству не совпала бы и не удалилась никогда."""
+        with self._cursor() as cur:
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+            r = cur.fetchone()
+        if r and r['relkind'] == 'p':
+            cols, match = "id, created_at", "t.id = d.id AND t.created_at = d.created_at"
+        else:
+            cols, match = "id", "t.id = d.id"
+        total = 0
+        while True:
+            if self._stop.is_set():
+                raise JobInterrupted()
+            with self._cursor() as cur:
+                cur.execute(f"""
+                    DELETE FROM {table} t USING (
+                        SELECT {cols} FROM {table} WHERE {where} LIMIT %s
+                    ) d
+                    WHERE {match}
+                """, params + (self.batch,))
+                n = cur.rowcount
+                cur.execute("UPDATE bulk_jobs SET progress = progress + %s, heartbeat_at = NOW() WHERE id = %s", (n, job_id))
+            total += n
+            if n < self.batch:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def step(self, job_id: int, sql: str, params: tuple) -> int:
+        """Одиночный шаг задачи (небольшие таблицы) с обновлением heartbeat."""
+        with self._cursor() as cur:
+            cur.execute(sql, params)
+            n = cur.rowcount if cur.rowcount > 0 else 0
+            cur.execute("UPDATE bulk_jobs SET progress = progress + %s, heartbeat_at = NOW() WHERE id = %s", (n, job_id))
+        return n
@@ -0,0 +1,123 @@
+import contextvars
+import math
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# Контроль нагрузки перед пулом БД:
+#   * корзины токенов по пользователю/IP, отдельно для опроса, записи, тяжелых запросов
+#     и статического содержимого (аватары: список друзей грузит десятки за раз);
+#   * сброс нагрузки (503), когда ожидание соединения из пула растет.
+
+POLL, WRITE, HEAVY, CONTENT = "poll", "write", "heavy", "content"
+
+HEAVY_PREFIXES = ("/bot/", "/admin/")
+HEAVY_ROUTES = {"/user/avatar/upload", "/messages/export"}
+EXEMPT_PREFIXES = ("/metrics", "/debug/")
+# GET без параметра пользователя, ключ — IP: своя корзина, больше, чем у опроса
+CONTENT_PREFIXES = ("/user/content/",)
+
+# Флаги текущего запроса (выставляются из потока обработчика, читаются в middleware)
+request_flags: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_flags", default=None)
+# Таймаут запросов к БД для текущего маршрута, мс (None — значение соединения по умолчанию)
+route_timeout: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("route_timeout", default=None)
+
+def parse_rate(spec: str) -> Tuple[float, float]:
+    """"5:20" -> 5 токенов в секунду, емкость 20."""
+    rate, _, burst = spec.partition(":")
+    rate = float(rate)
+    return rate, float(burst) if burst else max(1.0, rate)
+
+def classify(method: str, route: str) -> Optional[str]:
+    if route.startswith(EXEMPT_PREFIXES):
+        return None
+    if route in HEAVY_ROUTES or route.startswith(HEAVY_PREFIXES):
+        return HEAVY
+    if method in ("GET", "HEAD") and route.startswith(CONTENT_PREFIXES):
+        return CONTENT
+    return POLL if method in ("GET", "HEAD") else WRITE
+
+class RateLimiter:
+    """Корзины живут в процессе: поход в общее хранилище на каждый запрос стоил бы
+    соединения из того же пула, который мы защищаем. При нескольких воркерах
+    скорость делится на их число (балансировщик распределяет клиента примерно поровну).
+    Имя пользователя клиент заявляет сам, поэтому у адреса есть общая корзина на
+    users_per_ip пользователей: за NAT каждый получает свою квоту, но перебор имен
+    с одного адреса не дает квоты сверх общей."""
+    def __init__(self, limits: Dict[str, Tuple[float, float]], workers: int = 1, idle_ttl: float = 300.0,
+                 users_per_ip: int = 8):
+        w = max(1, workers)
+        self.limits = {k: (r / w, max(1.0, b / w)) for k, (r, b) in limits.items()}
+        self.idle_ttl = idle_ttl
+        self.users_per_ip = max(1, users_per_ip)
+        self._buckets: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def take(self, cls: str, key: str, ip: Optional[str] = None) -> float:
+        """0 — запрос пропущен, иначе сколько секунд ждать до следующего токена.
+        ip — адрес клиента, если key — заявленный пользователь: токен берется и из общей корзины адреса."""
+        rate, burst = self.limits[cls]
+        now = time.monotonic()
+        with self._lock:
+            wait = self._take((cls, key), rate, burst, now)
+            if wait == 0.0 and ip is not None:
+                n = self.users_per_ip
+                wait = self._take((cls, f"ip*:{ip}"), rate * n, burst * n, now)
+                if wait > 0.0:
+                    # Запрос не прошел — токен пользователя возвращается
+                    self._buckets[(cls, key)][0] += 1.0
+            if now - self._last_sweep > self.idle_ttl:
+                self._sweep(now)
+        return wait
+
+    def _take(self, k: Tuple[str, str], rate: float, burst: float, now: float) -> float:
+        # Вызывается под self._lock
+        b = self._buckets.get(k)
+        if b is None:
+            b = self._buckets[k] = [burst, now]
+        else:
+            b[0] = min(burst, b[0] + (now - b[1]) * rate)
+            b[1] = now
+        if b[0] >= 1.0:
+            b[0] -= 1.0
+            return 0.0
+        return (1.0 - b[0]) / rate if rate > 0 else 60.0
+
+    def _sweep(self, now: float):
+        self._last_sweep = now
+        for k in [k for k, b in self._buckets.items() if now - b[1] > self.idle_ttl]:
+            del self._buckets[k]
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+class LoadShedder:
+    """Скользящее среднее ожидания соединения из пула.
+    Пока оно выше порога, опросы отбрасываются сразу, не занимая поток."""
+    def __init__(self, threshold_ms: float, alpha: float = 0.2):
+        self.threshold = threshold_ms / 1000.0
+        self.alpha = alpha
+        self.wait = 0.0
+        self.at = time.monotonic()
+
+    def observe(self, wait: float):
+        # Гонки между потоками допустимы — это оценка
+        self.wait += self.alpha * (wait - self.wait)
+        self.at = time.monotonic()
+
+    def overloaded(self) -> bool:
+        # Без новых замеров (все отброшено) оценка затухает, иначе сброс не закончится
+        now = time.monotonic()
+        if now - self.at > 1.0:
+            self.wait *= 0.5
+            self.at = now
+        return self.wait > self.threshold
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.wait * 4))
+
+def mark_shed():
+    flags = request_flags.get()
+    if flags is not None:
+        flags['shed'] = True
@@ -0,0 +1,199 @@
+import bisect
+import functools
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Запись идет в словарь текущего потока без блокировок,
+# сведение всех потоков происходит только при чтении /metrics.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Shards:
+    def __init__(self):
+        self._local = threading.local()
+        self._all: List[dict] = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> dict:
+        d = getattr(self._local, 'd', None)
+        if d is None:
+            d = {}
+            self._local.d = d
+            # Блокировка берется один раз на поток
+            with self._lock:
+                self._all.append(d)
+        return d
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            shards = list(self._all)
+        # dict(d) копируется атомарно под GIL
+        return [dict(d) for d in shards]
+
+    def clear(self):
+        with self._lock:
+            for d in self._all:
+                d.clear()
+
+def _escape(v: str) -> str:
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: Tuple = ()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._shards = _Shards()
+
+    def _key(self, kw) -> Tuple:
+        return tuple(str(kw.get(n, "")) for n in self.labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+    def reset(self):
+        self._shards.clear()
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        d = self._shards.mine()
+        k = self._key(labels)
+        d[k] = d.get(k, 0) + value
+
+    def values(self) -> Dict[Tuple, float]:
+        res: Dict[Tuple, float] = {}
+        for d in self._shards.snapshot():
+            for k, v in d.items():
+                res[k] = res.get(k, 0) + v
+        return res
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, v in sorted(self.values().items()):
+            out.append(f"{self.name}{_fmt_labels(self.labels, k)} {v}")
+        return out
+
+class Gauge(Counter):
+    """Складывает дельты из всех потоков (inc в одном, dec в другом — нормально).
+    Для значений, которые проще посчитать при чтении, передается fn."""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), fn: Optional[Callable[[], object]] = None):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def values(self) -> Dict[Tuple, float]:
+        if self.fn is None:
+            return super().values()
+        try:
+            v = self.fn()
+        except Exception:
+            return {}
+        if isinstance(v, dict):
+            return {tuple(k) if isinstance(k, tuple) else (k,): val for k, val in v.items()}
+        return {(): v}
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        d = self._shards.mine()
+        k = self._key(labels)
+        row = d.get(k)
+        if row is None:
+            # [счетчики по корзинам..., +Inf, сумма, количество]
+            row = [0] * (len(self.buckets) + 3)
+            d[k] = row
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def values(self) -> Dict[Tuple, list]:
+        res: Dict[Tuple, list] = {}
+        for d in self._shards.snapshot():
+            for k, row in d.items():
+                acc = res.get(k)
+                if acc is None:
+                    res[k] = list(row)
+                else:
+                    for i, v in enumerate(row):
+                        acc[i] += v
+        return res
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, row in sorted(self.values().items()):
+            cum = 0
+            for i, b in enumerate(self.buckets):
+                cum += row[i]
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, (('le', repr(b)),))} {cum}")
+            cum += row[len(self.buckets)]
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, (('le', '+Inf'),))} {cum}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {row[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {row[-1]}")
+        return out
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, m: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(m)
+        return m
+
+    def counter(self, name, doc, labels=()) -> Counter:
+        return self.register(Counter(name, doc, labels))
+
+    def gauge(self, name, doc, labels=(), fn=None) -> Gauge:
+        return self.register(Gauge(name, doc, labels, fn))
+
+    def histogram(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, doc, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+_RE_STR = re.compile(r"'(?:[^']|'')*'")
+_RE_NUM = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_VALUES = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+_RE_WS = re.compile(r"\s+")
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql) -> str:
+    """Схлопывает литералы и параметры, чтобы одинаковые запросы попадали в одну группу."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    s = str(sql).replace('%s', '?')
+    s = _RE_STR.sub('?', s)
+    s = _RE_NUM.sub('?', s)
+    s = _RE_LIST.sub('(?)', s)
+    s = _RE_VALUES.sub(r'\1', s)
+    s = _RE_WS.sub(' ', s).strip().rstrip(';')
+    return s[:200]
@@ -0,0 +1,205 @@
+"""
+Помесячное секционирование таблицы messages по created_at.
+
+Перевод существующей таблицы выполняется один раз (MESSAGES_PARTITIONING=1):
+старая таблица становится секцией messages_legacy с диапазоном (MINVALUE, начало
+следующего месяца), поэтому данные не копируются, а id и последовательность
+messages_id_seq остаются прежними. Новые сообщения попадают в помесячные секции
+messages_pYYYYMM, которые создаются заранее. Строки вне созданных месяцев (обслуживание
+отстало, импорт со старыми/будущими датами, сбитые часы) попадают в секцию messages_default,
+а не роняют вставку; при создании месяца они переносятся в его секцию.
+
+Обслуживание вручную:
+
+    python -m app.core.partitions list
+    python -m app.core.partitions ensure --ahead 3
+    python -m app.core.partitions detach messages_p202401
+    python -m app.core.partitions detach messages_legacy
+
+PostgreSQL не разрешает DETACH ... CONCURRENTLY, пока у таблицы есть секция DEFAULT,
+поэтому секция отсоединяется обычным DETACH: он берет ACCESS EXCLUSIVE на messages,
+но только на время правки каталога, без сканирования данных. Чтобы ожидание этой
+блокировки за долгим запросом не остановило все чтения и записи messages, DETACH идет
+с коротким lock_timeout и при неудаче повторяется. Без DEFAULT (таблица создана
+до ее появления и DEFAULT удален вручную) используется CONCURRENTLY.
+Отсоединенная секция остается обычной таблицей, ее можно выгрузить pg_dump и удалить.
+messages_legacy (вся история до перевода) отсоединяется так же; строки с датами из ее
+диапазона, вставленные после этого, попадут в messages_default.
+Проверка на живой БД: python -m bench.partitions
+"""
+import argparse
+import datetime
+import logging
+import re
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("QuantServer.partitions")
+
+PARENT = "messages"
+LEGACY = "messages_legacy"
+DEFAULT = "messages_default"
+_NAME_RE = re.compile(r"^messages_p(\d{4})(\d{2})$")
+_TO_RE = re.compile(r"TO \('([^']+)'\)")
+DETACH_LOCK_TIMEOUT_MS = 2000
+DETACH_RETRIES = 5
+
+def month_start(d: datetime.date) -> datetime.date:
+    return d.replace(day=1)
+
+def add_months(d: datetime.date, n: int) -> datetime.date:
+    m = d.month - 1 + n
+    return datetime.date(d.year + m // 12, m % 12 + 1, 1)
+
+def partition_name(d: datetime.date) -> str:
+    return f"{PARENT}_p{d.year:04d}{d.month:02d}"
+
+def is_partitioned(cur) -> bool:
+    cur.execute("SELECT relkind FROM pg_class WHERE relname = %s AND relnamespace = 'public'::regnamespace", (PARENT,))
+    r = cur.fetchone()
+    return bool(r) and _val(r, 'relkind') == 'p'
+
+def _val(row, key, idx=0):
+    return row[key] if isinstance(row, dict) else row[idx]
+
+def list_partitions(cur) -> List[Tuple[str, str]]:
+    cur.execute("""
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (PARENT,))
+    return [(_val(r, 'name', 0), _val(r, 'bound', 1)) for r in cur.fetchall()]
+
+def _upper_bound(cur) -> Optional[datetime.date]:
+    # Верхняя граница самой поздней секции — с нее продолжаются новые месяцы
+    best = None
+    for _, bound in list_partitions(cur):
+        m = _TO_RE.search(bound or "")
+        if m:
+            d = datetime.date.fromisoformat(m.group(1)[:10])
+            best = d if best is None or d > best else best
+    return best
+
+def _create_month(cur, d: datetime.date, nxt: datetime.date, name: str):
+    cur.execute(f"SELECT 1 FROM {DEFAULT} WHERE created_at >= %s AND created_at < %s LIMIT 1", (d, nxt))
+    if cur.fetchone() is None:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} FOR VALUES FROM (%s) TO (%s)", (d, nxt))
+        return
+    # Строки месяца уже лежат в DEFAULT: с ними новая секция не создастся — переносим и присоединяем
+    cur.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (DELETE FROM {DEFAULT} WHERE created_at >= %s AND created_at < %s RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+    """, (d, nxt))
+    logger.info(f"Moved {cur.rowcount} rows from {DEFAULT} to {name}")
+    cur.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (d, nxt))
+
+def ensure_partitions(cur, ahead: int = 3) -> List[str]:
+    """Создает секции на текущий и следующие `ahead` месяцев (и секцию DEFAULT)."""
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT} PARTITION OF {PARENT} DEFAULT")
+    today = month_start(datetime.date.today())
+    start = _upper_bound(cur) or today
+    last = add_months(today, ahead + 1)
+    created = []
+    d = start
+    while d < last:
+        nxt = add_months(d, 1)
+        name = partition_name(d)
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL AS ok", (name,))
+        if not _val(cur.fetchone(), 'ok'):
+            _create_month(cur, d, nxt, name)
+        created.append(name)
+        d = nxt
+    if created:
+        logger.info(f"Message partitions ensured up to {last}: {', '.join(created)}")
+    return created
+
+def migrate_to_partitioned(cur):
+    """Превращает обычную messages в секционированную. Выполняется в одной транзакции."""
+    boundary = add_months(month_start(datetime.date.today()), 1)
+    logger.info("Converting messages to a partitioned table...")
+    # Ключ секционирования не может быть NULL
+    cur.execute(f"UPDATE {PARENT} SET created_at = NOW() WHERE created_at IS NULL")
+    cur.execute(f"ALTER TABLE {PARENT} RENAME TO {LEGACY}")
+    cur.execute(f"ALTER TABLE {LEGACY} ALTER COLUMN created_at SET NOT NULL")
+    # CHECK совпадает с диапазоном секции — тогда ATTACH не сканирует таблицу повторно
+    cur.execute(f"ALTER TABLE {LEGACY} ADD CONSTRAINT {LEGACY}_range CHECK (created_at < %s)", (boundary,))
+    # LIKE ... INCLUDING DEFAULTS сохраняет DEFAULT nextval('messages_id_seq') для id
+    cur.execute(f"CREATE TABLE {PARENT} (LIKE {LEGACY} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    cur.execute(f"ALTER TABLE {PARENT} ALTER COLUMN created_at SET DEFAULT NOW()")
+    cur.execute(f"ALTER TABLE {PARENT} ADD PRIMARY KEY (id, created_at)")
+    cur.execute(f"ALTER SEQUENCE IF EXISTS {PARENT}_id_seq OWNED BY {PARENT}.id")
+    cur.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {LEGACY} FOR VALUES FROM (MINVALUE) TO (%s)", (boundary,))
+    cur.execute(f"ALTER TABLE {LEGACY} DROP CONSTRAINT {LEGACY}_range")
+    # Индексы для выборок переписки; на каждой секции создаются автоматически
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {PARENT}_pair_idx ON {PARENT} (sender_id, receiver_id, created_at, id)")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {PARENT}_receiver_idx ON {PARENT} (receiver_id, created_at, id)")
+    logger.info("Messages table is now partitioned by month")
+
+def has_default(cur) -> bool:
+    cur.execute("SELECT partdefid <> 0 AS ok FROM pg_partitioned_table WHERE partrelid = %s::regclass", (PARENT,))
+    r = cur.fetchone()
+    return bool(r) and bool(_val(r, 'ok'))
+
+def detach_partition(conn, name: str):
+    """Отсоединяет помесячную секцию или messages_legacy. Выполняется в autocommit:
+    CONCURRENTLY нельзя в транзакции, а обычный DETACH не должен держать блокировку дольше себя."""
+    if name != LEGACY and not _NAME_RE.match(name):
+        raise ValueError(f"Not a message partition: {name}")
+    from psycopg2 import errors
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        if not has_default(cur):
+            cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name} CONCURRENTLY")
+            logger.info(f"Detached {name} concurrently")
+            return
+        cur.execute(f"SET lock_timeout = '{DETACH_LOCK_TIMEOUT_MS}ms'")
+        try:
+            for attempt in range(DETACH_RETRIES):
+                try:
+                    cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+                    break
+                except errors.LockNotAvailable:
+                    if attempt == DETACH_RETRIES - 1:
+                        raise
+                    logger.warning(f"Detach of {name} is waiting for a long lock on {PARENT}, retrying")
+                    time.sleep(1 + attempt)
+        finally:
+            cur.execute("RESET lock_timeout")
+    logger.info(f"Detached {name}")
+
+def main(argv=None):
+    import psycopg2
+    from app.core.config import Cfg
+
+    ap = argparse.ArgumentParser(description="Manage monthly message partitions")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    p = sub.add_parser("ensure")
+    p.add_argument("--ahead", type=int, default=3)
+    p = sub.add_parser("detach")
+    p.add_argument("name")
+    a = ap.parse_args(argv)
+
+    conn = psycopg2.connect(dbname=Cfg.DB_NAME, user=Cfg.DB_USER, password=Cfg.DB_PASS,
+                            host=Cfg.DB_HOST, port=Cfg.DB_PORT)
+    try:
+        if a.cmd == "detach":
+            detach_partition(conn, a.name)
+            return
+        with conn, conn.cursor() as cur:
+            if not is_partitioned(cur):
+                print("messages is not partitioned (set MESSAGES_PARTITIONING=1 and restart the server)")
+                return
+            if a.cmd == "ensure":
+                ensure_partitions(cur, a.ahead)
+            for name, bound in list_partitions(cur):
+                print(f"{name:<24} {bound}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
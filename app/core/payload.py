@@ -0,0 +1,70 @@
+from typing import List, Optional, Tuple
+
+# Старый строковый протокол: "текст<<<SPLIT>>>cmd://type::path<<<SPLIT>>>..."
+ATTACHMENT_SPLITTER = "<<<SPLIT>>>"
+CMD_PREFIX = "cmd://"
+
+PREVIEW_LEN = 120
+ATTACHMENT_KEYS = ('type', 'url', 'name', 'size', 'width', 'height', 'blurhash')
+ATTACHMENT_LABELS = {
+    'image': "🖼️ Изображение",
+    'file': "📄 Документ",
+}
+
+def _parse_cmd(part: str) -> Optional[dict]:
+    if not part.startswith(CMD_PREFIX):
+        return None
+    try:
+        t, u = part[len(CMD_PREFIX):].split("::", 1)
+    except ValueError:
+        return None
+    return {'type': t, 'url': u}
+
+def parse_legacy(content: Optional[str]) -> Tuple[str, List[dict]]:
+    """Разбор старого формата content на текст и список вложений."""
+    rc = content or ""
+    if ATTACHMENT_SPLITTER in rc:
+        parts = rc.split(ATTACHMENT_SPLITTER)
+        atts = [a for a in (_parse_cmd(p) for p in parts[1:]) if a]
+        return parts[0], atts
+    att = _parse_cmd(rc)
+    if att:
+        return "", [att]
+    return rc, []
+
+def has_legacy_markers(text: Optional[str]) -> bool:
+    return bool(text) and (ATTACHMENT_SPLITTER in text or text.startswith(CMD_PREFIX))
+
+def normalize_attachments(items) -> List[dict]:
+    res = []
+    for a in items or []:
+        if not isinstance(a, dict):
+            a = dict(a)
+        if not a.get('type') or not a.get('url'):
+            continue
+        clean = {k: a.get(k) for k in ATTACHMENT_KEYS if a.get(k) is not None}
+        if 'name' not in clean:
+            clean['name'] = str(clean['url']).replace('\\', '/').split('/')[-1]
+        res.append(clean)
+    return res
+
+def build_preview(text: Optional[str], attachments: List[dict]) -> str:
+    """Короткое превью для списка чатов, считается один раз при записи."""
+    t = (text or "").strip().replace('\n', ' ')
+    if t:
+        return t if len(t) <= PREVIEW_LEN else t[:PREVIEW_LEN - 1] + "…"
+    if not attachments:
+        return ""
+    types = {a.get('type') for a in attachments}
+    for t in ('image', 'file'):
+        if t in types:
+            return ATTACHMENT_LABELS[t]
+    return "Вложение"
+
+def to_legacy(text: Optional[str], attachments: List[dict]) -> str:
+    """Строка в старом формате для колонки content (совместимость со старыми клиентами)."""
+    if not attachments:
+        return text or ""
+    parts = [text or ""]
+    parts.extend(f"{CMD_PREFIX}{a['type']}::{a['url']}" for a in attachments)
+    return ATTACHMENT_SPLITTER.join(parts)
@@ -0,0 +1,132 @@
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+# Короткоживущий кэш профилей и уменьшенные копии аватаров.
+# Кэш сбрасывается по событию "profile" общей шины состояния, TTL лишь страхует
+# от потерянных событий (переподключение слушателя).
+
+AVATAR_SIZES = (64, 160)
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, ttl: float, max_items: int = 10000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._data: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> Tuple[Dict[str, object], list]:
+        """(найденные, отсутствующие в кэше). Значение None — закэшированное "нет такого"."""
+        now = time.monotonic()
+        hit, miss = {}, []
+        with self._lock:
+            for k in keys:
+                e = self._data.get(k, _MISSING)
+                if e is not _MISSING and e[0] > now:
+                    hit[k] = e[1]
+                else:
+                    miss.append(k)
+        return hit, miss
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def size(self) -> int:
+        return len(self._data)
+
+def avatar_urls(uid: int, avatar_hash: Optional[str]) -> dict:
+    """Версионированные ссылки: хэш в адресе меняется вместе с аватаром,
+    поэтому клиент может кэшировать их без повторной проверки."""
+    if not avatar_hash:
+        return {"avatar_url": "", "avatars": {}}
+    v = avatar_hash[:16]
+    base = f"/user/content/avatar/{uid}?v={v}"
+    return {"avatar_url": base, "avatars": {str(s): f"{base}&s={s}" for s in AVATAR_SIZES}}
+
+def avatar_etag(avatar_hash: str, size: int = 0) -> str:
+    return f'"{avatar_hash[:16]}-{size}"'
+
+def sniff_media_type(data: bytes) -> str:
+    if data[:4] == b'GIF8':
+        return "image/gif"
+    if data[:2] == b'\xff\xd8':
+        return "image/jpeg"
+    return "image/png"
+
+def render_avatar(data: bytes, size: int) -> Tuple[bytes, str]:
+    """Квадратная копия size x size. Без Pillow отдается оригинал."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data, sniff_media_type(data)
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im = ImageOps.exif_transpose(im)
+            im = ImageOps.fit(im.convert("RGBA"), (size, size), Image.LANCZOS)
+    except OSError:
+        # Нераспознанный формат — пусть клиент разбирается с оригиналом
+        return data, sniff_media_type(data)
+    out = io.BytesIO()
+    if im.getextrema()[3][0] == 255:
+        im.convert("RGB").save(out, "JPEG", quality=85, optimize=True)
+        return out.getvalue(), "image/jpeg"
+    im.save(out, "PNG", optimize=True)
+    return out.getvalue(), "image/png"
+
+class RenditionCache:
+    """LRU уменьшенных копий по (uid, хэш, размер); ограничен суммарным объемом.
+    Событие профиля приходит с логином, поэтому запоминается логин владельца каждого uid."""
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self._uids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            v = self._data.get(key)
+            if v is not None:
+                self._data.move_to_end(key)
+            return v
+
+    def put(self, key: tuple, value: Tuple[bytes, str], username: Optional[str] = None):
+        with self._lock:
+            if username:
+                self._uids[username] = key[0]
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._data[key] = value
+            self._bytes += len(value[0])
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                _, v = self._data.popitem(last=False)
+                self._bytes -= len(v[0])
+
+    def drop_user(self, uid: int):
+        """Все копии аватара пользователя: он удален или заменен."""
+        with self._lock:
+            for k in [k for k in self._data if k[0] == uid]:
+                self._bytes -= len(self._data.pop(k)[0])
+
+    def invalidate(self, username: str):
+        with self._lock:
+            uid = self._uids.pop(username, None)
+        if uid is not None:
+            self.drop_user(uid)
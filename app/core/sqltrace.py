@@ -0,0 +1,212 @@
+import contextvars
+import hashlib
+import json
+import logging
+import queue
+import random
+import re
+import ssl
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from psycopg2.extensions import cursor as plain_cursor
+
+from app.core.config import Cfg
+from app.core.metrics import normalize_sql
+
+logger = logging.getLogger("QuantServer.sql")
+
+# Эндпоинт, из которого пришел запрос (выставляется в middleware)
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="-")
+
+_EXPLAINABLE = ("SELECT", "WITH")
+_DML = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b")
+# SELECT f(...) без FROM — вызов функции ради побочного эффекта (pg_notify, nextval, ...)
+_FUNC_CALL = re.compile(r"^\s*SELECT\s+[\w.]+\s*\(")
+_SIDE_EFFECTS = re.compile(r"\b(PG_NOTIFY|NEXTVAL|SETVAL|PG_ADVISORY\w*|PG_TERMINATE_BACKEND|PG_CANCEL_BACKEND|LO_\w+|DBLINK\w*)\s*\(")
+# Очередь запросов на EXPLAIN: при переполнении новые просто не снимаются
+EXPLAIN_QUEUE = 16
+EXPLAIN_TIMEOUT_MS = 5000
+
+def fingerprint(sql_norm: str) -> str:
+    return hashlib.md5(sql_norm.encode()).hexdigest()[:12]
+
+def redact(vars) -> str:
+    # В лог уходят только типы параметров, не значения
+    if vars is None:
+        return "[]"
+    if isinstance(vars, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in vars.items()) + "}"
+    try:
+        return "[" + ", ".join(type(v).__name__ for v in vars) + "]"
+    except TypeError:
+        return "[?]"
+
+class _Stat:
+    __slots__ = ("sql", "calls", "total", "max", "rows", "endpoints")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.endpoints: Dict[str, int] = {}
+
+class SqlTracer:
+    def __init__(self, slow_ms: float, sample_rate: float, keep_slow: int = 200):
+        self.slow_s = slow_ms / 1000.0
+        self.sample_rate = sample_rate
+        self._stats: Dict[str, _Stat] = {}
+        self._slow = deque(maxlen=keep_slow)
+        self._plans: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        # EXPLAIN ANALYZE повторно выполняет запрос — не на пути запроса пользователя и не в его
+        # транзакции: отдельный поток со своим соединением (connect задает сервер при старте)
+        self.connect: Optional[Callable] = None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=EXPLAIN_QUEUE)
+        self._worker: Optional[threading.Thread] = None
+
+    def record(self, cur, query, vars, duration: float):
+        sql = normalize_sql(query)
+        fp = fingerprint(sql)
+        ep = current_endpoint.get()
+        rows = cur.rowcount if cur.rowcount and cur.rowcount > 0 else 0
+        with self._lock:
+            st = self._stats.get(fp)
+            if st is None:
+                st = self._stats[fp] = _Stat(sql)
+            st.calls += 1
+            st.total += duration
+            st.rows += rows
+            if duration > st.max:
+                st.max = duration
+            st.endpoints[ep] = st.endpoints.get(ep, 0) + 1
+
+        if duration >= self.slow_s:
+            self._on_slow(cur, query, vars, sql, fp, ep, duration, rows)
+
+    def _on_slow(self, cur, query, vars, sql, fp, ep, duration, rows):
+        logger.warning(f"Slow query {fp} {duration * 1000:.1f}ms rows={rows} endpoint={ep}: {sql} params={redact(vars)}")
+        with self._lock:
+            self._slow.append({"fingerprint": fp, "sql": sql, "ms": round(duration * 1000, 2),
+                               "rows": rows, "endpoint": ep, "at": time.time()})
+        if random.random() < self.sample_rate and self._explainable(sql) and self.connect is not None:
+            job = (query.decode() if isinstance(query, bytes) else query, vars,
+                   {"sql": sql, "ms": round(duration * 1000, 2), "endpoint": ep}, fp)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                return
+            self._ensure_worker()
+
+    @staticmethod
+    def _explainable(sql: str) -> bool:
+        # EXPLAIN ANALYZE реально выполняет запрос, поэтому только чтение без вызовов с побочными эффектами
+        up = f" {sql.upper()} "
+        if not up.lstrip().startswith(_EXPLAINABLE) or _DML.search(up):
+            return False
+        if _FUNC_CALL.match(up) and " FROM " not in up:
+            return False
+        return not _SIDE_EFFECTS.search(up)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._explain_loop, name="sql_explain", daemon=True)
+                self._worker.start()
+
+    def _explain_loop(self):
+        conn = None
+        while True:
+            query, vars, info, fp = self._queue.get()
+            try:
+                if conn is None or conn.closed:
+                    conn = self.connect()
+                plan = self._explain(conn, query, vars)
+            except Exception as e:
+                logger.debug(f"EXPLAIN skipped: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                continue
+            if plan:
+                with self._lock:
+                    self._plans[fp] = dict(info, at=time.time(), plan=plan)
+
+    @staticmethod
+    def _explain(conn, query, vars) -> Optional[str]:
+        ec = conn.cursor(cursor_factory=plain_cursor)
+        try:
+            # Транзакция только для чтения и всегда откатывается: результат запроса не сохраняется
+            ec.execute("SET TRANSACTION READ ONLY")
+            ec.execute("SET LOCAL statement_timeout = %s", (EXPLAIN_TIMEOUT_MS,))
+            ec.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+            return "\n".join(r[0] for r in ec.fetchall())
+        except Exception as e:
+            logger.debug(f"EXPLAIN failed: {e}")
+            return None
+        finally:
+            ec.close()
+            conn.rollback()
+
+    def top(self, n: int = 20, order: str = "total") -> List[dict]:
+        keys = {
+            "total": lambda s: s.total,
+            "calls": lambda s: s.calls,
+            "max": lambda s: s.max,
+            "mean": lambda s: s.total / s.calls if s.calls else 0,
+        }
+        key = keys.get(order, keys["total"])
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda kv: key(kv[1]), reverse=True)[:n]
+            return [{
+                "fingerprint": fp,
+                "sql": st.sql,
+                "calls": st.calls,
+                "total_ms": round(st.total * 1000, 2),
+                "mean_ms": round(st.total * 1000 / st.calls, 3) if st.calls else 0,
+                "max_ms": round(st.max * 1000, 2),
+                "rows": st.rows,
+                "endpoints": dict(st.endpoints),
+                "has_plan": fp in self._plans,
+            } for fp, st in items]
+
+    def slow(self) -> List[dict]:
+        with self._lock:
+            return list(self._slow)
+
+    def plan(self, fp: str) -> Optional[dict]:
+        with self._lock:
+            return self._plans.get(fp)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self._plans.clear()
+
+tracer = SqlTracer(Cfg.SLOW_QUERY_MS, Cfg.EXPLAIN_SAMPLE_RATE)
+
+def main(argv=None):
+    """CLI: python -m app.core.sqltrace [URL] [N] — печатает топ запросов работающего сервера."""
+    from urllib.request import urlopen
+
+    argv = sys.argv[1:] if argv is None else argv
+    base = argv[0] if argv else "https://localhost:8001"
+    n = int(argv[1]) if len(argv) > 1 else 20
+    ctx = ssl._create_unverified_context()
+    with urlopen(f"{base}/debug/sql/top?n={n}", context=ctx, timeout=10) as r:
+        rows = json.load(r).get("statements", [])
+    print(f"{'total ms':>10} {'calls':>7} {'mean ms':>9} {'max ms':>9}  statement")
+    for s in rows:
+        print(f"{s['total_ms']:>10} {s['calls']:>7} {s['mean_ms']:>9} {s['max_ms']:>9}  [{s['fingerprint']}] {s['sql'][:100]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import abc
+import logging
+import select
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("QuantServer.state")
+
+# Эфемерное состояние (печатает, в сети, лимиты) и рассылка событий инвалидации кэшей.
+# memory   — один процесс, всё в словаре;
+# postgres — UNLOGGED таблица + LISTEN/NOTIFY, общее для всех воркеров.
+
+EVENTS_CHANNEL = "quant_events"
+
+class StateBackend(abc.ABC):
+    name = ""
+
+    def __init__(self):
+        self._subs: List[Callable[[str, str], None]] = []
+
+    @abc.abstractmethod
+    def put(self, ns: str, key: str, value: str, ttl: float): ...
+
+    @abc.abstractmethod
+    def get(self, ns: str, key: str) -> Optional[str]: ...
+
+    @abc.abstractmethod
+    def delete(self, ns: str, key: str): ...
+
+    @abc.abstractmethod
+    def count(self, ns: str) -> int: ...
+
+    @abc.abstractmethod
+    def publish(self, topic: str, key: str): ...
+
+    def subscribe(self, cb: Callable[[str, str], None]):
+        self._subs.append(cb)
+
+    def _dispatch(self, topic: str, key: str):
+        for cb in list(self._subs):
+            try:
+                cb(topic, key)
+            except Exception as e:
+                logger.error(f"Event handler error ({topic}): {e}")
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+class MemoryStateBackend(StateBackend):
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self._data: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, ns, key, value, ttl):
+        with self._lock:
+            self._data[(ns, key)] = (value, time.time() + ttl)
+
+    def get(self, ns, key):
+        with self._lock:
+            v = self._data.get((ns, key))
+            if v is None:
+                return None
+            if v[1] < time.time():
+                del self._data[(ns, key)]
+                return None
+            return v[0]
+
+    def delete(self, ns, key):
+        with self._lock:
+            self._data.pop((ns, key), None)
+
+    def count(self, ns):
+        now = time.time()
+        with self._lock:
+            return sum(1 for (n, _), (_, exp) in self._data.items() if n == ns and exp >= now)
+
+    def publish(self, topic, key):
+        self._dispatch(topic, key)
+
+class PostgresStateBackend(StateBackend):
+    name = "postgres"
+
+    def __init__(self, get_cursor, connect, sweep_every: float = 30.0):
+        super().__init__()
+        self._cursor = get_cursor
+        self._connect = connect
+        self._sweep_every = sweep_every
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ensure_schema(self):
+        with self._cursor() as cur:
+            cur.execute("""
+                CREATE UNLOGGED TABLE IF NOT EXISTS ephemeral_state (
+                    ns TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    expires_at TIMESTAMPTZ NOT NULL,
+                    PRIMARY KEY (ns, key)
+                )
+            """)
+
+    def put(self, ns, key, value, ttl):
+        with self._cursor() as cur:
+            cur.execute("""
+                INSERT INTO ephemeral_state (ns, key, value, expires_at)
+                VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+                ON CONFLICT (ns, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+            """, (ns, key, value, ttl))
+
+    def get(self, ns, key):
+        with self._cursor() as cur:
+            cur.execute("SELECT value FROM ephemeral_state WHERE ns=%s AND key=%s AND expires_at > NOW()", (ns, key))
+            r = cur.fetchone()
+            return r['value'] if r else None
+
+    def delete(self, ns, key):
+        with self._cursor() as cur:
+            cur.execute("DELETE FROM ephemeral_state WHERE ns=%s AND key=%s", (ns, key))
+
+    def count(self, ns):
+        with self._cursor() as cur:
+            cur.execute("SELECT COUNT(*) AS c FROM ephemeral_state WHERE ns=%s AND expires_at > NOW()", (ns,))
+            return cur.fetchone()['c']
+
+    def publish(self, topic, key):
+        # Событие получат все воркеры, включая этот (через слушателя)
+        with self._cursor() as cur:
+            cur.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, f"{topic}:{key}"))
+
+    def start(self):
+        self.ensure_schema()
+        self._thread = threading.Thread(target=self._listen_loop, name="state-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen_loop(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {EVENTS_CHANNEL}")
+                backoff = 1.0
+                last_sweep = 0.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            n = conn.notifies.pop(0)
+                            topic, _, key = n.payload.partition(":")
+                            self._dispatch(topic, key)
+                    if time.time() - last_sweep > self._sweep_every:
+                        last_sweep = time.time()
+                        with conn.cursor() as cur:
+                            cur.execute("DELETE FROM ephemeral_state WHERE expires_at < NOW()")
+            except Exception as e:
+                logger.warning(f"State listener error, reconnecting in {backoff:.0f}s: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+def make_backend(kind: str, get_cursor=None, connect=None) -> StateBackend:
+    if kind == "postgres":
+        return PostgresStateBackend(get_cursor, connect)
+    return MemoryStateBackend()
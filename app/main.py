@@ -1,11 +1,24 @@
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Response
-from pydantic import BaseModel
-from contextlib import contextmanager
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Response, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Match
+from pydantic import BaseModel, Field
+from contextlib import contextmanager, asynccontextmanager
 from app.core.config import Cfg
+from app.core import payload
+from app.core.metrics import REGISTRY, normalize_sql
+from app.core.sqltrace import tracer, current_endpoint
+from app.core.state import make_backend
+from app.core import limits
+from app.core import partitions
+from app.core.jobs import JobQueue
+from app.core import export
+from app.core import importer
+from app.core import profiles
 import hashlib
+import json
 import secrets
 import logging
 from typing import List, Optional, Dict, Tuple
@@ -14,7 +27,12 @@ import uuid
 import time
 import sys
 import traceback
-import yt_dlp  # Убедитесь, что библиотека установлена
+import threading
+import importlib
+import asyncio
+import itertools
+import io
+import hmac
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,52 +40,221 @@ logging.basicConfig(
 )
 logger = logging.getLogger("QuantServer")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Подключение к БД и миграции выполняются при старте сервера, а не при импорте модуля
+    t0 = time.perf_counter()
+    await asyncio.to_thread(startup)
+    logger.info(f"Cold start finished in {(time.perf_counter() - t0) * 1000:.0f}ms")
+    yield
+    await asyncio.to_thread(shutdown)
+
+app = FastAPI(lifespan=lifespan)
 
 # Папка static больше не используется, файлы хранятся в БД.
 
-typing_status: Dict[str, Tuple[str, float]] = {}
+TYPING_TTL = 5.0
+PRESENCE_TTL = 15.0
+PROFILE_BATCH_MAX = 100
+
+profile_cache = profiles.TTLCache(Cfg.PROFILE_CACHE_TTL)
+avatar_renditions = profiles.RenditionCache()
 
 db_pool = None
+state = None
+
+# --- МЕТРИКИ ---
+HTTP_REQUESTS = REGISTRY.counter("quant_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = REGISTRY.histogram("quant_http_request_seconds", "HTTP request latency", ("method", "route"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("quant_http_in_flight", "Requests currently being processed")
+DB_CHECKOUT = REGISTRY.histogram("quant_db_pool_checkout_seconds", "Time to get a connection from the pool",
+                                 buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+DB_POOL_ERRORS = REGISTRY.counter("quant_db_pool_errors_total", "Failed pool checkouts")
+DB_POOL_USED = REGISTRY.gauge("quant_db_pool_used", "Connections checked out of the pool",
+                              fn=lambda: len(db_pool._used) if db_pool else 0)
+DB_POOL_SIZE = REGISTRY.gauge("quant_db_pool_max", "Pool capacity",
+                              fn=lambda: db_pool.maxconn if db_pool else 0)
+DB_QUERY = REGISTRY.histogram("quant_db_query_seconds", "SQL statement latency by normalised statement", ("query",))
+PBKDF2_QUEUE = REGISTRY.gauge("quant_pbkdf2_in_progress", "Password hashes being computed right now")
+TYPING_SIZE = REGISTRY.gauge("quant_typing_entries", "Entries in the typing status table",
+                             fn=lambda: state.count("typing") if state else 0)
+PRESENCE_SIZE = REGISTRY.gauge("quant_presence_entries", "Users seen online within the presence TTL",
+                               fn=lambda: state.count("presence") if state else 0)
+PROFILE_CACHE_SIZE = REGISTRY.gauge("quant_profile_cache_entries", "Profiles held in the in-process cache",
+                                    fn=lambda: profile_cache.size())
+PROFILE_LOOKUPS = REGISTRY.counter("quant_profile_lookups_total", "Profile lookups by cache result", ("result",))
+YTDLP_JOBS = REGISTRY.counter("quant_ytdlp_jobs_total", "yt-dlp jobs by kind and result", ("kind", "result"))
+YTDLP_ACTIVE = REGISTRY.gauge("quant_ytdlp_active", "yt-dlp jobs in progress")
+DB_HOLD = REGISTRY.histogram("quant_db_conn_hold_seconds", "Time a pooled connection is held per checkout", ("route",),
+                             buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+DB_STMTS = REGISTRY.histogram("quant_db_statements_per_checkout", "SQL statements (round-trips) per checkout", ("route",),
+                              buckets=(1, 2, 3, 4, 5, 6, 8, 12, 20))
+RATE_LIMITED = REGISTRY.counter("quant_rate_limited_total", "Requests rejected by per-client token buckets", ("cls",))
+SHED = REGISTRY.counter("quant_shed_total", "Requests shed because the DB pool is saturated", ("where",))
+POOL_WAIT_EWMA = REGISTRY.gauge("quant_db_pool_wait_ewma_seconds", "Smoothed pool checkout wait used for shedding",
+                                fn=lambda: shedder.wait)
+
+# --- КОНТРОЛЬ НАГРУЗКИ ---
+rate_limiter = limits.RateLimiter({
+    limits.POLL: limits.parse_rate(Cfg.RATE_POLL),
+    limits.WRITE: limits.parse_rate(Cfg.RATE_WRITE),
+    limits.HEAVY: limits.parse_rate(Cfg.RATE_HEAVY),
+    limits.CONTENT: limits.parse_rate(Cfg.RATE_CONTENT),
+}, workers=Cfg.WORKERS, users_per_ip=Cfg.RATE_USERS_PER_IP)
+shedder = limits.LoadShedder(Cfg.SHED_WAIT_MS)
+# Ограничивает число ожидающих соединение: SimpleConnectionPool при исчерпании сразу падает
+pool_gate = threading.BoundedSemaphore(Cfg.DB_POOL_MAX)
+
+# Переопределения statement_timeout по маршрутам (мс); остальные получают STATEMENT_TIMEOUT_MS
+ROUTE_TIMEOUTS_MS = {
+    "/messages/load": 2000,
+    "/messages/typing": 1000,
+    "/contacts/list": 2000,
+    "/friends/incoming": 2000,
+    "/messages/history": 10000,
+    "/users/search": 3000,
+}
+
+# Больше непрочитанных список чатов не считает: значок показывает "99+"
+UNREAD_CAP = 100
+
+# Ключи запроса (или JSON-тела записи), по которым определяется пользователь (иначе лимит по IP)
+IDENTITY_PARAMS = ("username", "u1", "user", "sender", "me", "login")
+# Тело больше этого ради ключа лимита не читается
+IDENTITY_BODY_MAX = 64 * 1024
+
+def _pbkdf2(password: str, salt: str) -> bytes:
+    PBKDF2_QUEUE.inc()
+    try:
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
+    finally:
+        PBKDF2_QUEUE.dec()
 
 def hash_pw(password: str) -> str:
     salt = secrets.token_hex(16)
-    pw_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
+    pw_hash = _pbkdf2(password, salt)
     return f"{salt}${pw_hash.hex()}"
 
 def check_pw(stored: str, provided: str) -> bool:
     try:
         salt, hash_val = stored.split('$')
-        check = hashlib.pbkdf2_hmac('sha256', provided.encode(), salt.encode(), 100000)
+        check = _pbkdf2(provided, salt)
         return check.hex() == hash_val
     except Exception:
         return False
 
-try:
-    print("[SERVER] Connecting to Database...")
-    db_pool = psycopg2.pool.SimpleConnectionPool(
-        1, 20, 
-        dbname=Cfg.DB_NAME, 
-        user=Cfg.DB_USER, 
-        password=Cfg.DB_PASS, 
-        host=Cfg.DB_HOST, 
-        port=Cfg.DB_PORT, 
-        cursor_factory=RealDictCursor
+class TimedCursor(RealDictCursor):
+    """Курсор, который замеряет каждый запрос (группировка по нормализованному SQL)
+    и передает его в трассировщик: медленные логируются, часть из них получает EXPLAIN.
+    prelude — SET LOCAL, который уходит вместе с первым запросом, без отдельного обращения к БД."""
+    n_exec = 0
+    prelude = None
+
+    def execute(self, query, vars=None):
+        self.n_exec += 1
+        sent = query
+        if self.prelude:
+            if isinstance(query, str):
+                sent = self.prelude + query
+            else:
+                super().execute(self.prelude)
+            self.prelude = None
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sent, vars)
+        finally:
+            dt = time.perf_counter() - t0
+            DB_QUERY.observe(dt, query=normalize_sql(query))
+            try:
+                tracer.record(self, query, vars, dt)
+            except Exception as e:
+                logger.debug(f"SQL trace error: {e}")
+
+    def _flush_prelude(self):
+        if self.prelude:
+            p, self.prelude = self.prelude, None
+            super().execute(p)
+
+    def executemany(self, query, vars_list):
+        self._flush_prelude()
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._flush_prelude()
+        return super().copy_expert(sql, file, size)
+
+def db_connect():
+    # Отдельное соединение вне пула (LISTEN и служебные задачи)
+    return psycopg2.connect(
+        dbname=Cfg.DB_NAME,
+        user=Cfg.DB_USER,
+        password=Cfg.DB_PASS,
+        host=Cfg.DB_HOST,
+        port=Cfg.DB_PORT
     )
-    print("[SERVER] Database Connected Successfully.")
-except Exception as e:
-    logger.critical(f"DB CONNECTION FAILED: {e}")
-    db_pool = None
+
+# EXPLAIN медленных запросов снимается в отдельном потоке на своем соединении, не в запросе пользователя
+tracer.connect = db_connect
+
+def init_db(retries: int = Cfg.DB_CONNECT_RETRIES, backoff: float = Cfg.DB_CONNECT_BACKOFF):
+    global db_pool
+    delay = backoff
+    for attempt in range(1, retries + 1):
+        try:
+            print("[SERVER] Connecting to Database...")
+            db_pool = psycopg2.pool.SimpleConnectionPool(
+                1, Cfg.DB_POOL_MAX, 
+                dbname=Cfg.DB_NAME, 
+                user=Cfg.DB_USER, 
+                password=Cfg.DB_PASS, 
+                host=Cfg.DB_HOST, 
+                port=Cfg.DB_PORT, 
+                cursor_factory=TimedCursor,
+                options=f"-c statement_timeout={Cfg.STATEMENT_TIMEOUT_MS}"
+            )
+            print("[SERVER] Database Connected Successfully.")
+            return
+        except Exception as e:
+            if attempt == retries:
+                logger.critical(f"DB CONNECTION FAILED: {e}")
+                db_pool = None
+                return
+            logger.warning(f"DB connection attempt {attempt}/{retries} failed, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
 
 @contextmanager
-def get_cursor():
+def get_cursor(statement_timeout: Optional[int] = None):
     if db_pool is None:
         raise HTTPException(status_code=503, detail="Database Unavailable")
     
     conn = None
+    cur = None
+    acquired = False
     try:
-        conn = db_pool.getconn()
+        t0 = t_hold = time.perf_counter()
+        if not pool_gate.acquire(timeout=Cfg.POOL_WAIT_MS / 1000.0):
+            shedder.observe(Cfg.POOL_WAIT_MS / 1000.0)
+            SHED.inc(where="checkout")
+            # Обработчик может превратить исключение в 500 — middleware все равно вернет 503
+            limits.mark_shed()
+            raise HTTPException(status_code=503, detail="Server busy",
+                                headers={"Retry-After": str(shedder.retry_after())})
+        acquired = True
+        try:
+            conn = db_pool.getconn()
+        except pool.PoolError:
+            DB_POOL_ERRORS.inc()
+            raise
+        wait = time.perf_counter() - t0
+        DB_CHECKOUT.observe(wait)
+        shedder.observe(wait)
+        t_hold = time.perf_counter()
         cur = conn.cursor()
+        timeout = statement_timeout if statement_timeout is not None else limits.route_timeout.get()
+        # Значение соединения по умолчанию задано при подключении; иное — в том же обращении, что и первый запрос
+        if timeout is not None and int(timeout) != Cfg.STATEMENT_TIMEOUT_MS:
+            cur.prelude = f"SET LOCAL statement_timeout = {int(timeout)}; "
         yield cur
         conn.commit()
     except Exception as e:
@@ -77,13 +264,19 @@ def get_cursor():
     finally:
         if conn:
             db_pool.putconn(conn)
+            ep = current_endpoint.get()
+            DB_HOLD.observe(time.perf_counter() - t_hold, route=ep)
+            if cur is not None:
+                DB_STMTS.observe(cur.n_exec, route=ep)
+        if acquired:
+            pool_gate.release()
 
 def check_db_schema():
     if db_pool is None:
         return
 
     try:
-        with get_cursor() as cur:
+        with get_cursor(statement_timeout=0) as cur:
             cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='media_groups' AND column_name='user_id';")
             if not cur.fetchone():
                 cur.execute("DELETE FROM media_tracks")
@@ -100,10 +293,395 @@ def check_db_schema():
                 logger.info("Adding avatar_data column (BYTEA) to user_profiles...")
                 cur.execute("ALTER TABLE user_profiles ADD COLUMN avatar_data BYTEA")
 
+            # Структурированное содержимое сообщений (текст + вложения + превью)
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='messages' AND column_name='body';")
+            if not cur.fetchone():
+                logger.info("Adding structured payload columns to messages...")
+                cur.execute("""
+                    ALTER TABLE messages
+                        ADD COLUMN body TEXT,
+                        ADD COLUMN attachments JSONB NOT NULL DEFAULT '[]'::jsonb,
+                        ADD COLUMN preview TEXT
+                """)
+
+            # Прочитанность хранится отметкой "прочитано до id" на пару (читатель, собеседник)
+            cur.execute("SELECT to_regclass('public.chat_state') AS t")
+            if cur.fetchone()['t'] is None:
+                logger.info("Creating chat_state and importing read flags...")
+                cur.execute("""
+                    CREATE TABLE chat_state (
+                        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                        peer_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                        last_read_id BIGINT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, peer_id)
+                    )
+                """)
+                cur.execute("""
+                    INSERT INTO chat_state (user_id, peer_id, last_read_id)
+                    SELECT receiver_id, sender_id, MAX(id) FROM messages WHERE is_read GROUP BY 1, 2
+                """)
+
+            # Удаляемый аккаунт скрывается сразу, строки удаляет фоновая задача
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='users' AND column_name='deleted_at';")
+            if not cur.fetchone():
+                cur.execute("ALTER TABLE users ADD COLUMN deleted_at TIMESTAMPTZ")
+
+            # "Очистить у себя" — отметка, до которой история скрыта
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='chat_state' AND column_name='cleared_before_id';")
+            if not cur.fetchone():
+                cur.execute("ALTER TABLE chat_state ADD COLUMN cleared_before_id BIGINT NOT NULL DEFAULT 0")
+
+            # Ключи идемпотентности отправки; хранятся MESSAGE_KEY_TTL_H часов
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS message_keys (
+                    sender_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    client_key TEXT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (sender_id, client_key)
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS message_keys_message_idx ON message_keys (message_id)")
+
+            # Хэш аватара — версия в ссылках на него; заодно досоздаем недостающие
+            # строки профилей, чтобы чтение профиля больше ничего не вставляло
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name='user_profiles' AND column_name='avatar_hash';")
+            if not cur.fetchone():
+                logger.info("Adding avatar_hash column to user_profiles...")
+                cur.execute("ALTER TABLE user_profiles ADD COLUMN avatar_hash TEXT")
+                cur.execute("UPDATE user_profiles SET avatar_hash = md5(avatar_data) WHERE avatar_data IS NOT NULL")
+                cur.execute("""
+                    INSERT INTO user_profiles (user_id)
+                    SELECT u.id FROM users u WHERE NOT EXISTS (SELECT 1 FROM user_profiles p WHERE p.user_id = u.id)
+                """)
+
     except Exception as e:
         logger.warning(f"Schema check failed: {e}")
 
-check_db_schema()
+def migrate_legacy_payloads(batch: int = 2000):
+    """Переводит старые строки (content с <<<SPLIT>>>) в body/attachments/preview пачками."""
+    if db_pool is None:
+        return
+
+    total = 0
+    try:
+        while True:
+            with get_cursor(statement_timeout=0) as cur:
+                cur.execute("SELECT id, content FROM messages WHERE body IS NULL ORDER BY id LIMIT %s", (batch,))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                vals = []
+                for r in rows:
+                    text, atts = payload.parse_legacy(r['content'])
+                    atts = payload.normalize_attachments(atts)
+                    vals.append((r['id'], text, Json(atts), payload.build_preview(text, atts)))
+                execute_values(cur, """
+                    UPDATE messages m SET body = v.body, attachments = v.atts::jsonb, preview = v.preview
+                    FROM (VALUES %s) AS v(id, body, atts, preview)
+                    WHERE m.id = v.id
+                """, vals)
+                total += len(rows)
+        if total:
+            logger.info(f"Converted {total} legacy messages to structured payloads")
+    except Exception as e:
+        logger.warning(f"Legacy payload migration failed: {e}")
+
+def init_state():
+    global state
+    kind = Cfg.STATE_BACKEND
+    if kind == "postgres" and db_pool is None:
+        logger.warning("Postgres state backend requested but DB is unavailable, using memory")
+        kind = "memory"
+    state = make_backend(kind, get_cursor, db_connect)
+    try:
+        state.start()
+    except Exception as e:
+        logger.error(f"State backend start failed ({kind}): {e}")
+        state = make_backend("memory")
+    state.subscribe(on_state_event)
+    logger.info(f"State backend: {state.name}")
+
+def on_state_event(topic, key):
+    if topic == "profile":
+        profile_cache.invalidate(key)
+        avatar_renditions.invalidate(key)
+
+messages_partitioned = False
+
+def init_partitions():
+    global messages_partitioned
+    if db_pool is None:
+        return
+    try:
+        with get_cursor(statement_timeout=0) as cur:
+            if not partitions.is_partitioned(cur):
+                if not Cfg.MESSAGES_PARTITIONING:
+                    return
+                partitions.migrate_to_partitioned(cur)
+            partitions.ensure_partitions(cur, Cfg.PARTITIONS_AHEAD)
+        messages_partitioned = True
+    except Exception as e:
+        logger.error(f"Message partitioning failed: {e}")
+
+def maintenance():
+    # Раз в час: досоздаем будущие секции (раз в 12 часов) и чистим старые ключи отправки
+    n = 0
+    while db_pool is not None:
+        time.sleep(3600)
+        n += 1
+        if messages_partitioned and n % 12 == 0:
+            try:
+                with get_cursor(statement_timeout=0) as cur:
+                    partitions.ensure_partitions(cur, Cfg.PARTITIONS_AHEAD)
+            except Exception as e:
+                logger.warning(f"Partition maintenance failed: {e}")
+        try:
+            with get_cursor(statement_timeout=0) as cur:
+                cur.execute("DELETE FROM message_keys WHERE created_at < NOW() - make_interval(hours => %s)",
+                            (Cfg.MESSAGE_KEY_TTL_H,))
+        except Exception as e:
+            logger.warning(f"Message key cleanup failed: {e}")
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+jobs = JobQueue(get_cursor, workers=Cfg.JOB_WORKERS, batch=Cfg.JOB_BATCH, pause=Cfg.JOB_PAUSE_MS / 1000.0)
+
+def job_delete_user(jid, p):
+    uid = p['uid']
+    jobs.delete_batches(jid, "messages", "sender_id = %s", (uid,))
+    jobs.delete_batches(jid, "messages", "receiver_id = %s", (uid,))
+    jobs.step(jid, "DELETE FROM media_tracks WHERE group_id IN (SELECT id FROM media_groups WHERE user_id = %s)", (uid,))
+    jobs.step(jid, "DELETE FROM media_groups WHERE user_id = %s", (uid,))
+    jobs.step(jid, "DELETE FROM users WHERE id = %s", (uid,))
+
+def job_clear_chat(jid, p):
+    a, b, upto = p['a'], p['b'], p['upto']
+    # Только то, что было на момент очистки; новые сообщения не трогаем
+    jobs.delete_batches(jid, "messages",
+                        "((sender_id = %s AND receiver_id = %s) OR (sender_id = %s AND receiver_id = %s)) AND id <= %s",
+                        (a, b, b, a, upto))
+
+jobs.register("delete_user", job_delete_user)
+jobs.register("clear_chat", job_clear_chat)
+
+def init_jobs():
+    if db_pool is None:
+        return
+    try:
+        jobs.start()
+    except Exception as e:
+        logger.error(f"Job queue start failed: {e}")
+
+def startup():
+    t0 = time.perf_counter()
+    init_db()
+    logger.info(f"DB pool ready in {(time.perf_counter() - t0) * 1000:.0f}ms")
+    check_db_schema()
+    init_partitions()
+    init_state()
+    init_jobs()
+    # Перенос старых сообщений может занять долго — не задерживаем старт
+    threading.Thread(target=migrate_legacy_payloads, name="payload-migration", daemon=True).start()
+    if db_pool is not None:
+        threading.Thread(target=maintenance, name="db-maintenance", daemon=True).start()
+
+def shutdown():
+    global db_pool
+    jobs.stop()
+    if state is not None:
+        state.stop()
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+
+# yt-dlp тяжелый и нужен только боту — импортируется при первом обращении
+_ytdlp = None
+_ytdlp_lock = threading.Lock()
+
+def load_ytdlp():
+    global _ytdlp
+    if _ytdlp is None:
+        with _ytdlp_lock:
+            if _ytdlp is None:
+                t0 = time.perf_counter()
+                _ytdlp = importlib.import_module("yt_dlp")
+                logger.info(f"yt-dlp loaded in {(time.perf_counter() - t0) * 1000:.0f}ms")
+    return _ytdlp
+
+def message_payload(r) -> Tuple[str, list]:
+    # Строки, которые миграция ещё не успела обработать, разбираем на лету
+    if r.get('body') is None:
+        text, atts = payload.parse_legacy(r.get('content'))
+        return text, payload.normalize_attachments(atts)
+    return r['body'], r.get('attachments') or []
+
+def message_dict(r) -> dict:
+    text, atts = message_payload(r)
+    d = {
+        'id': r['id'],
+        'content': r['content'],
+        'text': text,
+        'attachments': atts,
+        'preview': r['preview'] if r['preview'] is not None else payload.build_preview(text, atts),
+        'sender_uid': r['sender_uid'],
+        'sender_name': r['sender_name'],
+        'avatar_url': r['avatar_url'] or "",
+        'created_at': r['created_at'].isoformat() if r['created_at'] else "",
+        'sender_id': r['sender_id'],
+        'is_read': r['is_read'],
+        'reply_to_id': r['reply_to_id'],
+        'attachment_id': r['attachment_id']
+    }
+    # Ключ отправителя — клиент по нему заменяет локальный черновик
+    if r.get('client_key'):
+        d['client_key'] = r['client_key']
+    return d
+
+# --- ИНСТРУМЕНТАЦИЯ ---
+def route_template(request: Request) -> str:
+    # Шаблон пути ("/user/content/avatar/{user_id}"), чтобы не плодить серии на каждый id
+    r = request.scope.get('route')
+    if r is not None:
+        return r.path
+    for r in request.app.routes:
+        m, _ = r.matches(request.scope)
+        if m == Match.FULL:
+            return r.path
+    return "unmatched"
+
+async def _body_identity(request: Request) -> Optional[str]:
+    # Записи передают пользователя в JSON-теле; Starlette сохраняет прочитанное тело для обработчика
+    if not request.headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        if int(request.headers.get("content-length") or 0) > IDENTITY_BODY_MAX:
+            return None
+        data = json.loads(await request.body() or b"null")
+    except Exception:
+        return None
+    if isinstance(data, dict):
+        for k in IDENTITY_PARAMS:
+            v = data.get(k)
+            if v and isinstance(v, str):
+                return v
+    return None
+
+async def client_key(request: Request, cls: str) -> Tuple[str, Optional[str]]:
+    """(ключ корзины, адрес для общей корзины адреса или None)."""
+    ip = request.client.host if request.client else "-"
+    q = request.query_params
+    user = next((q.get(k) for k in IDENTITY_PARAMS if q.get(k)), None)
+    if user is None and cls in (limits.WRITE, limits.HEAVY):
+        user = await _body_identity(request)
+    if user is None:
+        return f"ip:{ip}", None
+    # Заявленное имя не проверяется: корзина — имя на этом адресе, и адрес ограничен общей
+    return f"u:{user}@{ip}", ip
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    route = getattr(request.state, 'route', None) or route_template(request)
+    cls = limits.classify(request.method, route)
+    if cls is None:
+        return await call_next(request)
+
+    wait = rate_limiter.take(cls, *(await client_key(request, cls)))
+    if wait > 0:
+        RATE_LIMITED.inc(cls=cls)
+        return Response(content=b'{"detail":"Too many requests"}', status_code=429, media_type="application/json",
+                        headers={"Retry-After": str(max(1, int(wait + 0.999)))})
+    # Опросы при перегрузке отбрасываем сразу: клиент все равно повторит их по таймеру
+    if cls == limits.POLL and shedder.overloaded():
+        SHED.inc(where="early")
+        return Response(content=b'{"detail":"Server busy"}', status_code=503, media_type="application/json",
+                        headers={"Retry-After": str(shedder.retry_after())})
+
+    flags = {}
+    t1 = limits.request_flags.set(flags)
+    t2 = limits.route_timeout.set(ROUTE_TIMEOUTS_MS.get(route))
+    try:
+        response = await call_next(request)
+    finally:
+        limits.route_timeout.reset(t2)
+        limits.request_flags.reset(t1)
+    if flags.get('shed'):
+        return Response(content=b'{"detail":"Server busy"}', status_code=503, media_type="application/json",
+                        headers={"Retry-After": str(shedder.retry_after())})
+    return response
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
+    route = route_template(request)
+    request.state.route = route
+    token = current_endpoint.set(f"{request.method} {route}")
+    HTTP_IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        current_endpoint.reset(token)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+        HTTP_LATENCY.observe(time.perf_counter() - t0, method=request.method, route=route)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# --- ОТЛАДКА SQL (включается DEBUG_ENDPOINTS=1) ---
+def require_debug():
+    if not Cfg.DEBUG_ENDPOINTS:
+        raise HTTPException(404)
+
+@app.get("/debug/sql/top")
+def debug_sql_top(n: int = 20, order: str = "total"):
+    require_debug()
+    return {"statements": tracer.top(n, order)}
+
+@app.get("/debug/sql/slow")
+def debug_sql_slow():
+    require_debug()
+    return {"slow": tracer.slow()}
+
+@app.get("/debug/sql/plan/{fp}")
+def debug_sql_plan(fp: str):
+    require_debug()
+    plan = tracer.plan(fp)
+    if not plan:
+        raise HTTPException(404, "No plan captured")
+    return plan
+
+@app.post("/debug/sql/reset")
+def debug_sql_reset():
+    require_debug()
+    tracer.reset()
+    return {"status": "ok"}
+
+# --- АДМИНИСТРИРОВАНИЕ (включается ADMIN_TOKEN) ---
+def require_admin(request: Request):
+    tok = request.headers.get("X-Admin-Token", "")
+    if not Cfg.ADMIN_TOKEN or not hmac.compare_digest(tok, Cfg.ADMIN_TOKEN):
+        raise HTTPException(404)
+
+@app.post("/admin/import")
+def admin_import(request: Request, file: UploadFile = File(...), fmt: str = Form("ndjson"), mark_read: bool = Form(True)):
+    require_admin(request)
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(400, "fmt must be ndjson or csv")
+    try:
+        # Файл читается потоком из временного файла загрузки
+        stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+        with get_cursor(statement_timeout=0) as cur:
+            res = importer.import_messages(cur, importer.parse(stream, fmt), mark_read=mark_read)
+        return {"status": "ok", **res}
+    except (ValueError, KeyError, psycopg2.DataError) as e:
+        raise HTTPException(400, f"Bad import file: {e}")
+    except Exception as e:
+        logger.error(f"Import error: {e}")
+        raise HTTPException(500, "Internal server error")
 
 # --- ФУНКЦИЯ ДЛЯ YOUTUBE-DL (которую потеряли) ---
 def get_dl_strategies():
@@ -116,6 +694,15 @@ def get_dl_strategies():
     return strategies
 
 # --- МОДЕЛИ ---
+class AttachmentModel(BaseModel):
+    type: str
+    url: str
+    name: Optional[str] = None
+    size: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    blurhash: Optional[str] = None
+
 class AuthModel(BaseModel):
     login: str
     email: Optional[str] = None
@@ -139,9 +726,12 @@ class DelAvatarModel(BaseModel):
 
 class MsgModel(BaseModel):
     to_user: str
-    text: str
+    text: str = ""
+    attachments: List[AttachmentModel] = []
     attachment_id: Optional[int] = None
     reply_to: Optional[int] = None
+    # Ключ, созданный клиентом: повтор запроса с тем же ключом не создает дубль
+    client_key: Optional[str] = Field(None, max_length=64)
 
 class ClearChatModel(BaseModel):
     me: str
@@ -159,8 +749,11 @@ class EditMsgModel(BaseModel):
     user: str
 
 class ReadMsgModel(BaseModel):
-    ids: List[int]
     user: str
+    peer: Optional[str] = None
+    up_to: Optional[int] = None
+    # Старые клиенты присылают список id
+    ids: List[int] = []
 
 class TypingModel(BaseModel):
     user: str
@@ -242,7 +835,9 @@ def reg(d: AuthModel):
             
             # Создаем профиль
             cur.execute("INSERT INTO user_profiles (user_id) VALUES (%s)", (uid,))
-            return {"status": "ok", "uid": uid}
+        # Имя могли искать до регистрации: закэшированное "не найдено" сбрасывается во всех воркерах
+        state.publish("profile", d.login)
+        return {"status": "ok", "uid": uid}
 
     # ВАЖНО: Сначала ловим HTTPException и просто "пробрасываем" его дальше
     except HTTPException:
@@ -270,28 +865,70 @@ def login(d: AuthModel):
         logger.error(f"Login error: {e}")
         raise HTTPException(500, "Internal server error")
 
+def lookup_profiles(names: List[str]) -> Dict[str, Optional[dict]]:
+    """Профили по именам: из кэша, недостающие — одним запросом. None — пользователя нет."""
+    found, miss = profile_cache.get_many(names)
+    PROFILE_LOOKUPS.inc(len(found), result="hit")
+    if miss:
+        PROFILE_LOOKUPS.inc(len(miss), result="miss")
+        with get_cursor() as cur:
+            cur.execute("""
+                SELECT u.id, u.username, p.status_msg, p.bio, p.avatar_hash
+                FROM users u LEFT JOIN user_profiles p ON p.user_id = u.id
+                WHERE u.username = ANY(%s) AND u.deleted_at IS NULL
+            """, (miss,))
+            rows = {r['username']: r for r in cur.fetchall()}
+        for name in miss:
+            r = rows.get(name)
+            prof = None
+            if r is not None:
+                prof = {"username": name, "user_id": r['id'], "status_msg": r['status_msg'] or "",
+                        "bio": r['bio'] or "", "avatar_hash": r['avatar_hash'] or ""}
+                prof.update(profiles.avatar_urls(r['id'], r['avatar_hash']))
+            profile_cache.put(name, prof)
+            found[name] = prof
+    return found
+
+@app.get("/users/profiles")
+def get_profiles(names: str):
+    lst = list(dict.fromkeys(n.strip() for n in names.split(",") if n.strip()))
+    if len(lst) > PROFILE_BATCH_MAX:
+        raise HTTPException(400, f"At most {PROFILE_BATCH_MAX} names per request")
+    try:
+        res = lookup_profiles(lst)
+    except Exception as e:
+        logger.error(f"Profiles batch error: {e}")
+        raise HTTPException(500, "Internal server error")
+    return {"profiles": {n: p for n, p in res.items() if p is not None}}
+
 @app.get("/user/profile_info")
 def get_profile_info(username: str):
     try:
-        with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (username,))
-            res = cur.fetchone()
-            if not res:
-                return {"status_msg": "", "bio": "", "avatar_url": ""}
-            uid = res['id']
-            cur.execute("SELECT status_msg, bio, avatar_url FROM user_profiles WHERE user_id=%s", (uid,))
-            prof = cur.fetchone()
-            if not prof:
-                cur.execute("INSERT INTO user_profiles (user_id) VALUES (%s) RETURNING status_msg, bio, avatar_url", (uid,))
-                prof = cur.fetchone()
-            
-            ava_url = prof.get('avatar_url') or ""
-            
-            return {"status_msg": prof.get('status_msg') or "", "bio": prof.get('bio') or "", "avatar_url": ava_url}
+        prof = lookup_profiles([username]).get(username)
+        if prof is None:
+            return {"status_msg": "", "bio": "", "avatar_url": ""}
+        return dict(prof, is_online=state.get("presence", username) is not None)
     except Exception as e:
         logger.error(f"Profile info error: {e}")
         return {"status_msg": "", "bio": "", "avatar_url": ""}
 
+@app.get("/user/summary")
+def get_user_summary(username: str):
+    """Все, что показывают профиль и боковая панель, за один запрос."""
+    try:
+        prof = lookup_profiles([username]).get(username)
+        if prof is None:
+            raise HTTPException(404, "User not found")
+        with get_cursor() as cur:
+            cur.execute("SELECT COUNT(*) AS n FROM friends WHERE user_id = %s AND status = 'accepted'", (prof['user_id'],))
+            friends = cur.fetchone()['n']
+        return dict(prof, friends=friends)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"User summary error: {e}")
+        raise HTTPException(500, "Internal server error")
+
 @app.post("/user/profile_update")
 def update_profile(d: ProfileUpdateModel):
     try:
@@ -301,7 +938,8 @@ def update_profile(d: ProfileUpdateModel):
             if not u:
                 raise HTTPException(404, "User not found")
             cur.execute("UPDATE user_profiles SET status_msg = %s, bio = %s WHERE user_id = %s", (d.status_msg, d.bio, u['id']))
-            return {"status": "ok"}
+        state.publish("profile", d.username)
+        return {"status": "ok"}
     except Exception as e:
         logger.error(f"Profile update error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -328,41 +966,74 @@ async def upload_avatar(username: str = Form(...), file: UploadFile = File(...))
         elif header.startswith(b'\xff\xd8'): 
             media_type = 'image/jpeg'
         
-        ts = int(time.time())
-        # Ссылка, которую клиент использует для запроса файла
-        virtual_url = f"/user/content/avatar/{uid}?t={ts}"
+        avatar_hash = hashlib.md5(file_bytes).hexdigest()
+        # Ссылка, которую клиент использует для запроса файла; версия — хэш содержимого
+        virtual_url = profiles.avatar_urls(uid, avatar_hash)['avatar_url']
         
         with get_cursor() as cur:
             # Сохраняем байты и ссылку
             cur.execute(
-                "UPDATE user_profiles SET avatar_data=%s, avatar_url=%s WHERE user_id=%s", 
-                (file_bytes, virtual_url, uid)
+                "UPDATE user_profiles SET avatar_data=%s, avatar_url=%s, avatar_hash=%s WHERE user_id=%s", 
+                (file_bytes, virtual_url, avatar_hash, uid)
             )
+        avatar_renditions.drop_user(uid)
+        state.publish("profile", username)
         
         return {"status": "ok", "url": virtual_url}
     except Exception as e:
         logger.error(f"Avatar upload error: {e}")
         raise HTTPException(500, "Internal server error")
 
+# Ссылки с ?v= неизменяемы: новый аватар получает новый хэш, а значит и новый адрес.
+# Неизменяемым помечается только ответ, чьи байты соответствуют этому v
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def _avatar_headers(v, avatar_hash, size):
+    headers = {"ETag": profiles.avatar_etag(avatar_hash, size)}
+    if v and v == avatar_hash[:16]:
+        headers["Cache-Control"] = IMMUTABLE_CACHE
+    return headers
+
 @app.get("/user/content/avatar/{user_id}")
-def get_avatar_content(user_id: int):
+def get_avatar_content(user_id: int, request: Request, s: int = 0, v: str = ""):
     try:
+        size = s if s in profiles.AVATAR_SIZES else 0
+        inm = request.headers.get("if-none-match")
+        if size and v:
+            # Копия в кэше построена из байтов с хэшем v — иначе ее ключ был бы другим
+            hit = avatar_renditions.get((user_id, v, size))
+            if hit is not None:
+                headers = _avatar_headers(v, v, size)
+                if inm == headers["ETag"]:
+                    return Response(status_code=304, headers=headers)
+                return Response(content=hit[0], media_type=hit[1], headers=headers)
+
         with get_cursor() as cur:
-            cur.execute("SELECT avatar_data FROM user_profiles WHERE user_id=%s", (user_id,))
+            if inm:
+                # Условный запрос: сначала сверяем только хэш, байты не читаем
+                cur.execute("SELECT avatar_hash FROM user_profiles WHERE user_id=%s AND avatar_data IS NOT NULL", (user_id,))
+                res = cur.fetchone()
+                if res and res['avatar_hash'] and inm == profiles.avatar_etag(res['avatar_hash'], size):
+                    return Response(status_code=304, headers=_avatar_headers(v, res['avatar_hash'], size))
+            cur.execute("""
+                SELECT p.avatar_data, p.avatar_hash, u.username
+                FROM user_profiles p JOIN users u ON u.id = p.user_id WHERE p.user_id=%s
+            """, (user_id,))
             res = cur.fetchone()
             
-            if not res or not res['avatar_data']:
-                return Response(content=b"", status_code=404)
-            
-            data = bytes(res['avatar_data'])
+        if not res or not res['avatar_data']:
+            return Response(content=b"", status_code=404)
+        
+        data = bytes(res['avatar_data'])
+        headers = _avatar_headers(v, res['avatar_hash'], size) if res['avatar_hash'] else {}
+        if size:
+            # Уменьшенная копия считается один раз на версию аватара
+            body, media_type = profiles.render_avatar(data, size)
+            if res['avatar_hash']:
+                avatar_renditions.put((user_id, res['avatar_hash'][:16], size), (body, media_type), res['username'])
+            return Response(content=body, media_type=media_type, headers=headers)
             
-            media_type = "image/png"
-            if data[:4] == b'GIF8':
-                media_type = "image/gif"
-            elif data[:2] == b'\xff\xd8':
-                media_type = "image/jpeg"
-                
-            return Response(content=data, media_type=media_type)
+        return Response(content=data, media_type=profiles.sniff_media_type(data), headers=headers)
     except Exception as e:
         logger.error(f"Get avatar error: {e}")
         return Response(content=b"", status_code=500)
@@ -376,8 +1047,10 @@ def delete_avatar_endpoint(d: DelAvatarModel):
             if not u:
                 raise HTTPException(404)
             
-            cur.execute("UPDATE user_profiles SET avatar_url=NULL, avatar_data=NULL WHERE user_id=%s", (u['id'],))
-            return {"status": "ok"}
+            cur.execute("UPDATE user_profiles SET avatar_url=NULL, avatar_data=NULL, avatar_hash=NULL WHERE user_id=%s", (u['id'],))
+        avatar_renditions.drop_user(u['id'])
+        state.publish("profile", d.username)
+        return {"status": "ok"}
     except Exception as e:
         logger.error(f"Avatar delete error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -394,21 +1067,41 @@ def delete_user(d: DelModel):
                 raise HTTPException(401, "Bad password")
             uid = user['id']
             
-            cur.execute("DELETE FROM messages WHERE sender_id=%s OR receiver_id=%s", (uid, uid))
+            # Небольшие таблицы чистим сразу, аккаунт скрываем (имя освобождается),
+            # а сообщения и медиатеку удаляет фоновая задача пачками
             cur.execute("DELETE FROM user_profiles WHERE user_id=%s", (uid,))
             cur.execute("DELETE FROM friends WHERE user_id=%s OR friend_id=%s", (uid, uid))
             cur.execute("DELETE FROM blacklist WHERE user_id=%s OR blocked_id=%s", (uid, uid))
-            cur.execute("DELETE FROM users WHERE id=%s", (uid,))
-            return {"status": "ok"}
+            cur.execute("UPDATE users SET username = '~deleted:' || id, password_hash = '!', deleted_at = NOW() WHERE id=%s", (uid,))
+            job_id = jobs.enqueue(cur, "delete_user", {"uid": uid})
+        jobs.wake()
+        avatar_renditions.drop_user(uid)
+        state.publish("profile", d.username)
+        return {"status": "ok", "job_id": job_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"User delete error: {e}")
         raise HTTPException(500, "Internal server error")
 
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    try:
+        j = jobs.get(job_id)
+    except Exception as e:
+        logger.error(f"Job status error: {e}")
+        raise HTTPException(500, "Internal server error")
+    if not j:
+        raise HTTPException(404, "Job not found")
+    for k in ('created_at', 'started_at', 'finished_at'):
+        j[k] = j[k].isoformat() if j[k] else None
+    return j
+
 @app.get("/users/search")
 def search_user(query: str):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT username FROM users WHERE username ILIKE %s LIMIT 5", (f"{query}%",))
+            cur.execute("SELECT username FROM users WHERE username ILIKE %s AND deleted_at IS NULL LIMIT 5", (f"{query}%",))
             return {"users": [r['username'] for r in cur.fetchall()]}
     except Exception as e:
         logger.error(f"User search error: {e}")
@@ -417,6 +1110,8 @@ def search_user(query: str):
 @app.get("/contacts/list")
 def get_contacts(username: str):
     try:
+        # Список контактов опрашивается каждые 5 с, его и используем как сигнал "в сети"
+        state.put("presence", username, "1", PRESENCE_TTL)
         with get_cursor() as cur:
             cur.execute("SELECT id FROM users WHERE username = %s", (username,))
             res = cur.fetchone()
@@ -431,7 +1126,8 @@ def get_contacts(username: str):
                             WHEN sender_id = %s THEN receiver_id 
                             ELSE sender_id 
                         END as contact_id,
-                        MAX(id) as last_msg_id
+                        MAX(id) as last_msg_id,
+                        MAX(id) FILTER (WHERE receiver_id = %s) as last_in_id
                     FROM messages 
                     WHERE sender_id = %s OR receiver_id = %s
                     GROUP BY 1
@@ -441,15 +1137,26 @@ def get_contacts(username: str):
                     u.username,
                     up.avatar_url,
                     m.content as last_message,
+                    m.preview as last_preview,
                     m.created_at,
-                    m.sender_id
+                    m.sender_id,
+                    -- Водяной знак прочтения: входящих после отметки обычно нет, и ничего не считается.
+                    -- Иначе счет ограничен UNREAD_CAP (клиент все равно пишет "99+"), история не сканируется
+                    CASE WHEN lm.last_in_id IS NULL OR lm.last_in_id <= GREATEST(cs.last_read_id, cs.cleared_before_id, 0) THEN 0
+                         ELSE (SELECT COUNT(*) FROM (
+                                   SELECT 1 FROM messages mm
+                                   WHERE mm.sender_id = lm.contact_id AND mm.receiver_id = %s
+                                     AND mm.id > GREATEST(cs.last_read_id, cs.cleared_before_id, 0) AND mm.deleted_for_receiver = FALSE
+                                   LIMIT %s) capped)
+                    END as unread
                 FROM LastMsgs lm
-                JOIN users u ON u.id = lm.contact_id
+                JOIN users u ON u.id = lm.contact_id AND u.deleted_at IS NULL
                 LEFT JOIN user_profiles up ON up.user_id = u.id
+                LEFT JOIN chat_state cs ON cs.user_id = %s AND cs.peer_id = lm.contact_id
                 JOIN messages m ON m.id = lm.last_msg_id
                 ORDER BY m.id DESC
             """
-            cur.execute(query, (uid, uid, uid))
+            cur.execute(query, (uid, uid, uid, uid, uid, UNREAD_CAP, uid))
             rows = cur.fetchall()
             
             contacts = []
@@ -459,7 +1166,9 @@ def get_contacts(username: str):
                     "username": r['username'],
                     "avatar_url": av,
                     "last_message": r['last_message'],
+                    "last_preview": r['last_preview'] if r['last_preview'] is not None else payload.build_preview(*payload.parse_legacy(r['last_message'])),
                     "last_sender_id": r['sender_id'],
+                    "unread": r['unread'],
                     "timestamp": r['created_at'].isoformat() if r['created_at'] else ""
                 })
                 
@@ -468,30 +1177,44 @@ def get_contacts(username: str):
         logger.error(f"Contacts list error: {e}")
         return {"contacts": []}
 
+# Пара (я, цель) по именам — общая часть однострочных запросов ниже. Параметры: (me, target)
+PAIR_CTE = """
+    WITH me AS (SELECT id FROM users WHERE username = %s),
+         tg AS (SELECT id FROM users WHERE username = %s)
+"""
+
 @app.post("/friends/request")
 def send_req(d: ActionModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.me,))
-            mid_row = cur.fetchone()
-            if not mid_row: raise HTTPException(404, "User ME not found")
-            mid = mid_row['id']
-            
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.target,))
-            tgt = cur.fetchone()
-            if not tgt:
-                raise HTTPException(404, "Target not found")
-            if mid == tgt['id']:
-                raise HTTPException(400, "Same user")
-                
-            cur.execute("SELECT 1 FROM blacklist WHERE user_id=%s AND blocked_id=%s", (tgt['id'], mid))
-            if cur.fetchone():
-                raise HTTPException(403, "Blocked")
-                
-            cur.execute("SELECT status FROM friends WHERE user_id=%s AND friend_id=%s", (mid, tgt['id']))
-            if not cur.fetchone():
-                cur.execute("INSERT INTO friends (user_id, friend_id, status) VALUES (%s, %s, 'pending')", (mid, tgt['id']))
-            return {"status": "ok"}
+            # Проверки и вставка одним запросом: один round-trip вместо четырех
+            cur.execute(PAIR_CTE + """,
+                chk AS (
+                    SELECT me.id AS mid, tg.id AS tid,
+                           EXISTS (SELECT 1 FROM blacklist b WHERE b.user_id = tg.id AND b.blocked_id = me.id) AS blocked
+                    FROM me, tg
+                ),
+                ins AS (
+                    INSERT INTO friends (user_id, friend_id, status)
+                    SELECT mid, tid, 'pending' FROM chk
+                    WHERE NOT blocked AND mid <> tid
+                      AND NOT EXISTS (SELECT 1 FROM friends f WHERE f.user_id = chk.mid AND f.friend_id = chk.tid)
+                    RETURNING 1
+                )
+                SELECT (SELECT id FROM me) AS mid, (SELECT id FROM tg) AS tid, (SELECT blocked FROM chk) AS blocked
+            """, (d.me, d.target))
+            r = cur.fetchone()
+        if r['mid'] is None:
+            raise HTTPException(404, "User ME not found")
+        if r['tid'] is None:
+            raise HTTPException(404, "Target not found")
+        if r['mid'] == r['tid']:
+            raise HTTPException(400, "Same user")
+        if r['blocked']:
+            raise HTTPException(403, "Blocked")
+        return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Friend request error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -500,17 +1223,26 @@ def send_req(d: ActionModel):
 def accept_req(d: ActionModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.me,))
-            mid = cur.fetchone()['id']
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.target,))
-            tid = cur.fetchone()['id']
-            cur.execute("UPDATE friends SET status='accepted' WHERE user_id=%s AND friend_id=%s", (tid, mid))
-            cur.execute("SELECT 1 FROM friends WHERE user_id=%s AND friend_id=%s", (mid, tid))
-            if cur.fetchone():
-                cur.execute("UPDATE friends SET status='accepted' WHERE user_id=%s AND friend_id=%s", (mid, tid))
-            else:
-                cur.execute("INSERT INTO friends (user_id, friend_id, status) VALUES (%s, %s, 'accepted')", (mid, tid))
-            return {"status": "ok"}
+            cur.execute(PAIR_CTE + """,
+                up AS (
+                    UPDATE friends f SET status = 'accepted' FROM me, tg
+                    WHERE (f.user_id = tg.id AND f.friend_id = me.id) OR (f.user_id = me.id AND f.friend_id = tg.id)
+                    RETURNING f.user_id
+                ),
+                ins AS (
+                    INSERT INTO friends (user_id, friend_id, status)
+                    SELECT me.id, tg.id, 'accepted' FROM me, tg
+                    WHERE NOT EXISTS (SELECT 1 FROM friends f WHERE f.user_id = me.id AND f.friend_id = tg.id)
+                    RETURNING 1
+                )
+                SELECT (SELECT id FROM me) AS mid, (SELECT id FROM tg) AS tid
+            """, (d.me, d.target))
+            r = cur.fetchone()
+        if r['mid'] is None or r['tid'] is None:
+            raise HTTPException(404, "User not found")
+        return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Friend accept error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -519,11 +1251,10 @@ def accept_req(d: ActionModel):
 def rem_friend(d: ActionModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.me,))
-            mid = cur.fetchone()['id']
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.target,))
-            tid = cur.fetchone()['id']
-            cur.execute("DELETE FROM friends WHERE (user_id=%s AND friend_id=%s) OR (user_id=%s AND friend_id=%s)", (mid, tid, tid, mid))
+            cur.execute(PAIR_CTE + """
+                DELETE FROM friends f USING me, tg
+                WHERE (f.user_id = me.id AND f.friend_id = tg.id) OR (f.user_id = tg.id AND f.friend_id = me.id)
+            """, (d.me, d.target))
             return {"status": "ok"}
     except Exception as e:
         logger.error(f"Friend remove error: {e}")
@@ -614,14 +1345,26 @@ def get_bl(user: str):
 def block_u(d: ActionModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.me,))
-            mid = cur.fetchone()['id']
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.target,))
-            tid = cur.fetchone()['id']
-            cur.execute("DELETE FROM friends WHERE (user_id=%s AND friend_id=%s) OR (user_id=%s AND friend_id=%s)", (mid, tid, tid, mid))
-            if not cur.execute("SELECT 1 FROM blacklist WHERE user_id=%s AND blocked_id=%s", (mid, tid)):
-                cur.execute("INSERT INTO blacklist (user_id, blocked_id) VALUES (%s, %s)", (mid, tid))
-            return {"status": "ok"}
+            cur.execute(PAIR_CTE + """,
+                unf AS (
+                    DELETE FROM friends f USING me, tg
+                    WHERE (f.user_id = me.id AND f.friend_id = tg.id) OR (f.user_id = tg.id AND f.friend_id = me.id)
+                    RETURNING 1
+                ),
+                ins AS (
+                    INSERT INTO blacklist (user_id, blocked_id)
+                    SELECT me.id, tg.id FROM me, tg
+                    WHERE NOT EXISTS (SELECT 1 FROM blacklist b WHERE b.user_id = me.id AND b.blocked_id = tg.id)
+                    RETURNING 1
+                )
+                SELECT (SELECT id FROM me) AS mid, (SELECT id FROM tg) AS tid
+            """, (d.me, d.target))
+            r = cur.fetchone()
+        if r['mid'] is None or r['tid'] is None:
+            raise HTTPException(404, "User not found")
+        return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Block user error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -630,30 +1373,100 @@ def block_u(d: ActionModel):
 def unblock_u(d: ActionModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.me,))
-            mid = cur.fetchone()['id']
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.target,))
-            tid = cur.fetchone()['id']
-            cur.execute("DELETE FROM blacklist WHERE user_id=%s AND blocked_id=%s", (mid, tid))
+            cur.execute(PAIR_CTE + """
+                DELETE FROM blacklist b USING me, tg WHERE b.user_id = me.id AND b.blocked_id = tg.id
+            """, (d.me, d.target))
             return {"status": "ok"}
     except Exception as e:
         logger.error(f"Unblock user error: {e}")
         raise HTTPException(500, "Internal server error")
 
+# Отправка идемпотентна по (отправитель, client_key): ключ и сообщение создаются
+# в одном запросе с общим id, повтор возвращает сохраненную строку
+SENT_COLS = """m.id, m.content, m.body, m.attachments, m.preview, m.created_at, m.sender_id, m.reply_to_id, m.attachment_id,
+    u.id AS sender_uid, u.username AS sender_name, up.avatar_url, FALSE AS is_read"""
+SENT_SELECT = f"""
+    SELECT {SENT_COLS}, mk.client_key
+    FROM message_keys mk
+    JOIN messages m ON m.id = mk.message_id
+    JOIN users u ON u.id = m.sender_id
+    LEFT JOIN user_profiles up ON up.user_id = u.id
+"""
+SEND_SQL = f"""
+    WITH s AS (SELECT id FROM users WHERE username = %(sender)s),
+    r AS (SELECT id FROM users WHERE username = %(to)s),
+    nid AS (SELECT nextval(pg_get_serial_sequence('messages', 'id')) AS id),
+    k AS (
+        INSERT INTO message_keys (sender_id, client_key, message_id)
+        SELECT s.id, %(key)s, nid.id FROM s, r, nid WHERE %(key)s IS NOT NULL
+        ON CONFLICT (sender_id, client_key) DO NOTHING
+        RETURNING message_id
+    ),
+    ins AS (
+        INSERT INTO messages (id, sender_id, receiver_id, content, body, attachments, preview, attachment_id, reply_to_id, created_at, is_read, deleted_for_sender, deleted_for_receiver)
+        SELECT nid.id, s.id, r.id, %(content)s, %(body)s, %(atts)s, %(preview)s, %(att_id)s, %(reply)s, NOW(), FALSE, FALSE, FALSE
+        FROM s, r, nid
+        WHERE %(key)s IS NULL OR EXISTS (SELECT 1 FROM k)
+        RETURNING *
+    )
+    SELECT {SENT_COLS}, %(key)s AS client_key
+    FROM ins m JOIN users u ON u.id = m.sender_id LEFT JOIN user_profiles up ON up.user_id = u.id
+    UNION ALL
+    {SENT_SELECT}
+    WHERE %(key)s IS NOT NULL AND NOT EXISTS (SELECT 1 FROM k)
+      AND mk.sender_id = (SELECT id FROM s) AND mk.client_key = %(key)s
+"""
+
 @app.post("/messages/send")
 def send_m(sender: str, msg: MsgModel):
     try:
+        if msg.attachments:
+            text, atts = msg.text, payload.normalize_attachments(a.dict() for a in msg.attachments)
+        elif payload.has_legacy_markers(msg.text):
+            # Старые клиенты всё ещё присылают склеенную строку
+            text, atts = payload.parse_legacy(msg.text)
+            atts = payload.normalize_attachments(atts)
+        else:
+            text, atts = msg.text, []
+        key = msg.client_key or None
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (sender,))
-            sid = cur.fetchone()['id']
-            cur.execute("SELECT id FROM users WHERE username=%s", (msg.to_user,))
-            rid = cur.fetchone()['id']
-            cur.execute("INSERT INTO messages (sender_id, receiver_id, content, attachment_id, reply_to_id, created_at, is_read, deleted_for_sender, deleted_for_receiver) VALUES (%s, %s, %s, %s, %s, NOW(), FALSE, FALSE, FALSE)", (sid, rid, msg.text, msg.attachment_id, msg.reply_to))
-            return {"status": "ok"}
+            # Один round-trip: имена разрешаются в самой вставке, ключ резервируется
+            # вместе с id сообщения. Повтор с тем же ключом ничего не вставляет
+            # и возвращает уже сохраненное сообщение.
+            cur.execute(SEND_SQL, {
+                'sender': sender, 'to': msg.to_user, 'key': key,
+                'content': payload.to_legacy(text, atts), 'body': text, 'atts': Json(atts),
+                'preview': payload.build_preview(text, atts),
+                'att_id': msg.attachment_id, 'reply': msg.reply_to,
+            })
+            r = cur.fetchone()
+            if r is None and key is not None:
+                # Параллельный повтор: первая вставка зафиксировалась уже после снимка
+                # нашего запроса — новый запрос ее увидит
+                cur.execute(f"{SENT_SELECT} WHERE mk.sender_id = (SELECT id FROM users WHERE username = %(sender)s) AND mk.client_key = %(key)s",
+                            {'sender': sender, 'key': key})
+                r = cur.fetchone()
+            if r is None:
+                raise HTTPException(404, "User not found")
+            return {"status": "ok", "message": message_dict(r)}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Send message error: {e}")
         raise HTTPException(500, "Internal server error")
 
+# Отметки обеих сторон переписки; сообщение прочитано, если его id не больше
+# отметки получателя. Параметры: (id1, id2, id2, id1)
+READ_MARKS_CTE = """
+    WITH rm AS (
+        SELECT user_id, last_read_id, cleared_before_id FROM chat_state
+        WHERE (user_id = %s AND peer_id = %s) OR (user_id = %s AND peer_id = %s)
+    )
+"""
+IS_READ_EXPR = "m.id <= COALESCE((SELECT last_read_id FROM rm WHERE rm.user_id = m.receiver_id), 0) AS is_read"
+# Скрывает очищенную зрителем часть истории. Параметр: id зрителя
+CLEARED_PRED = "m.id > COALESCE((SELECT cleared_before_id FROM rm WHERE rm.user_id = %s), 0)"
+
 @app.get("/messages/history")
 def get_history(u1: str, u2: str, offset: int = 0, limit: int = 50):
     try:
@@ -665,8 +1478,9 @@ def get_history(u1: str, u2: str, offset: int = 0, limit: int = 50):
             if not res1 or not res2:
                 return {"messages": []}
             id1, id2 = res1['id'], res2['id']
-            query = """
-                SELECT m.id, m.content, u.id as sender_uid, u.username as sender_name, up.avatar_url, m.created_at, m.sender_id, m.is_read, m.reply_to_id, m.attachment_id
+            query = f"""
+                {READ_MARKS_CTE}
+                SELECT m.id, m.content, m.body, m.attachments, m.preview, u.id as sender_uid, u.username as sender_name, up.avatar_url, m.created_at, m.sender_id, {IS_READ_EXPR}, m.reply_to_id, m.attachment_id
                 FROM messages m 
                 JOIN users u ON m.sender_id = u.id 
                 LEFT JOIN user_profiles up ON u.id = up.user_id
@@ -676,26 +1490,15 @@ def get_history(u1: str, u2: str, offset: int = 0, limit: int = 50):
                     OR 
                     (sender_id=%s AND receiver_id=%s AND deleted_for_receiver = FALSE)
                 )
+                AND {CLEARED_PRED}
                 ORDER BY m.created_at DESC, m.id DESC
                 LIMIT %s OFFSET %s
             """
-            cur.execute(query, (id1, id2, id2, id1, limit, offset))
+            # Сортировка по ключу секционирования: при секционированной таблице
+            # секции читаются от новых к старым и старые не трогаются, когда LIMIT набран
+            cur.execute(query, (id1, id2, id2, id1, id1, id2, id2, id1, id1, limit, offset))
             
-            msgs = []
-            for r in cur.fetchall():
-                msg_dict = {
-                    'id': r['id'],
-                    'content': r['content'],
-                    'sender_uid': r['sender_uid'],
-                    'sender_name': r['sender_name'],
-                    'avatar_url': r['avatar_url'] or "",
-                    'created_at': r['created_at'].isoformat() if r['created_at'] else "",
-                    'sender_id': r['sender_id'],
-                    'is_read': r['is_read'],
-                    'reply_to_id': r['reply_to_id'],
-                    'attachment_id': r['attachment_id']
-                }
-                msgs.append(msg_dict)
+            msgs = [message_dict(r) for r in cur.fetchall()]
             return {"messages": list(reversed(msgs))}
     except Exception as e:
         logger.error(f"Message history error: {e}")
@@ -715,42 +1518,158 @@ def load_m(u1: str, u2: str, last_id: int = 0):
             if not res1 or not res2:
                 return {"messages": []}
             id1, id2 = res1['id'], res2['id']
-            query = """
-                SELECT m.id, m.content, u.id as sender_uid, u.username as sender_name, up.avatar_url, m.created_at, m.sender_id, m.is_read, m.reply_to_id, m.attachment_id
+            query = f"""
+                {READ_MARKS_CTE}
+                SELECT m.id, m.content, m.body, m.attachments, m.preview, u.id as sender_uid, u.username as sender_name, up.avatar_url, m.created_at, m.sender_id, {IS_READ_EXPR}, m.reply_to_id, m.attachment_id, mk.client_key
                 FROM messages m 
                 JOIN users u ON m.sender_id = u.id 
                 LEFT JOIN user_profiles up ON u.id = up.user_id
+                LEFT JOIN message_keys mk ON mk.message_id = m.id AND mk.sender_id = m.sender_id
                 WHERE 
                 (
-                    ((sender_id=%s AND receiver_id=%s AND deleted_for_sender = FALSE) 
+                    ((m.sender_id=%s AND receiver_id=%s AND deleted_for_sender = FALSE) 
                     OR 
-                    (sender_id=%s AND receiver_id=%s AND deleted_for_receiver = FALSE))
+                    (m.sender_id=%s AND receiver_id=%s AND deleted_for_receiver = FALSE))
                     AND m.id > %s
+                    AND {CLEARED_PRED}
+                    AND m.created_at >= COALESCE((SELECT created_at FROM messages WHERE id = %s), '-infinity') - INTERVAL '5 minutes'
                 )
                 ORDER BY m.created_at ASC, m.id ASC
             """
-            cur.execute(query, (id1, id2, id2, id1, last_id))
+            # Условие по created_at отсекает старые секции при выполнении;
+            # запас в 5 минут покрывает вставки, чья транзакция началась раньше предыдущей
+            cur.execute(query, (id1, id2, id2, id1, id1, id2, id2, id1, last_id, id1, last_id))
             
-            msgs = []
-            for r in cur.fetchall():
-                msg_dict = {
-                    'id': r['id'],
-                    'content': r['content'],
-                    'sender_uid': r['sender_uid'],
-                    'sender_name': r['sender_name'],
-                    'avatar_url': r['avatar_url'] or "",
-                    'created_at': r['created_at'].isoformat() if r['created_at'] else "",
-                    'sender_id': r['sender_id'],
-                    'is_read': r['is_read'],
-                    'reply_to_id': r['reply_to_id'],
-                    'attachment_id': r['attachment_id']
-                }
-                msgs.append(msg_dict)
+            msgs = [message_dict(r) for r in cur.fetchall()]
             return {"messages": msgs}
     except Exception as e:
         logger.error(f"Load messages error: {e}")
         return {"messages": []}
 
+# --- ЭКСПОРТ ---
+EXPORT_FETCH = 2000
+# Каждая страница — короткая транзакция: соединение и слот pool_gate возвращаются между страницами,
+# и медленный клиент не держит пул все время скачивания
+EXPORT_PAGE_TIMEOUT_MS = 10000
+EXPORT_PAGE_RETRIES = 3
+
+def _export_page(fetch):
+    # Пул занят — короткая пауза и повтор, а не обрыв начатой выгрузки
+    for attempt in range(EXPORT_PAGE_RETRIES):
+        try:
+            with get_cursor(statement_timeout=EXPORT_PAGE_TIMEOUT_MS) as cur:
+                return fetch(cur)
+        except HTTPException as e:
+            if e.status_code != 503 or attempt == EXPORT_PAGE_RETRIES - 1:
+                raise
+            time.sleep(shedder.retry_after())
+
+def export_messages(uid: int, peer_id: Optional[int], after_id: int):
+    # Постраничный обход по id (keyset): без серверного курсора и долгой транзакции
+    pair = "AND ((m.sender_id = %(u)s AND m.receiver_id = %(p)s) OR (m.sender_id = %(p)s AND m.receiver_id = %(u)s))" if peer_id else ""
+    sql = f"""
+        SELECT m.id, su.username AS sender, ru.username AS receiver, m.created_at,
+               m.content, m.body, m.attachments, m.reply_to_id
+        FROM messages m
+        JOIN users su ON su.id = m.sender_id
+        JOIN users ru ON ru.id = m.receiver_id
+        LEFT JOIN chat_state cs ON cs.user_id = %(u)s
+             AND cs.peer_id = CASE WHEN m.sender_id = %(u)s THEN m.receiver_id ELSE m.sender_id END
+        WHERE ((m.sender_id = %(u)s AND m.deleted_for_sender = FALSE)
+            OR (m.receiver_id = %(u)s AND m.deleted_for_receiver = FALSE))
+          {pair}
+          AND m.id > GREATEST(%(after)s, COALESCE(cs.cleared_before_id, 0))
+        ORDER BY m.id
+        LIMIT %(n)s
+    """
+    last = after_id
+    while True:
+        def fetch(cur):
+            cur.execute(sql, {"u": uid, "p": peer_id, "after": last, "n": EXPORT_FETCH})
+            return cur.fetchall()
+        rows = _export_page(fetch)
+        for r in rows:
+            text, atts = message_payload(r)
+            yield {"type": "message", "id": r['id'], "from": r['sender'], "to": r['receiver'],
+                   "created_at": r['created_at'], "text": text, "attachments": atts,
+                   "reply_to_id": r['reply_to_id']}
+        if len(rows) < EXPORT_FETCH:
+            break
+        last = rows[-1]['id']
+
+def export_account(uid: int):
+    # Данные аккаунта небольшие: одной короткой транзакцией
+    def fetch(cur):
+        out = []
+        cur.execute("""
+            SELECT u.username, u.email, u.created_at, p.status_msg, p.bio
+            FROM users u LEFT JOIN user_profiles p ON p.user_id = u.id WHERE u.id = %s
+        """, (uid,))
+        out.append({"type": "profile", **(cur.fetchone() or {})})
+        cur.execute("""
+            SELECT u.username, f.status FROM friends f JOIN users u ON u.id = f.friend_id WHERE f.user_id = %s
+        """, (uid,))
+        out.extend({"type": "friend", **r} for r in cur.fetchall())
+        cur.execute("SELECT u.username FROM blacklist b JOIN users u ON u.id = b.blocked_id WHERE b.user_id = %s", (uid,))
+        out.extend({"type": "blocked", **r} for r in cur.fetchall())
+        cur.execute("SELECT id, title, author, genre, created_at FROM media_groups WHERE user_id = %s ORDER BY id", (uid,))
+        out.extend({"type": "media_group", **g} for g in cur.fetchall())
+        cur.execute("""
+            SELECT t.group_id, t.title, t.performer, t.file_path, t.language, t.rating
+            FROM media_tracks t JOIN media_groups g ON g.id = t.group_id WHERE g.user_id = %s ORDER BY t.id
+        """, (uid,))
+        out.extend({"type": "media_track", **r} for r in cur.fetchall())
+        return out
+    yield from _export_page(fetch)
+
+@app.get("/messages/export")
+def export_chat(user: str, peer: Optional[str] = None, fmt: str = "ndjson", after_id: int = 0):
+    """Вся переписка с peer (или все данные пользователя без peer) потоком NDJSON или zip.
+    after_id — продолжить с сообщения, следующего за ним (после обрыва)."""
+    if fmt not in ("ndjson", "zip"):
+        raise HTTPException(400, "fmt must be ndjson or zip")
+    try:
+        # Проверка до начала ответа, чтобы ошибка вернулась статусом, а не обрывом
+        with get_cursor() as cur:
+            cur.execute("SELECT id FROM users WHERE username=%s AND deleted_at IS NULL", (user,))
+            u = cur.fetchone()
+            peer_id = None
+            if u and peer:
+                cur.execute("SELECT id FROM users WHERE username=%s", (peer,))
+                pr = cur.fetchone()
+                peer_id = pr['id'] if pr else None
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        raise HTTPException(500, "Internal server error")
+    if not u or (peer and peer_id is None):
+        raise HTTPException(404, "User not found")
+
+    uid = u['id']
+    msgs = export_messages(uid, peer_id, after_id)
+    name = f"quant_{user}_{peer}" if peer else f"quant_{user}"
+
+    def body():
+        try:
+            if fmt == "zip":
+                files = [("messages.ndjson", msgs)]
+                if not peer and not after_id:
+                    files.insert(0, ("account.ndjson", export_account(uid)))
+                yield from export.stream_zip(files)
+            else:
+                recs = msgs if peer or after_id else itertools.chain(export_account(uid), msgs)
+                yield from export.stream_ndjson(recs)
+        except Exception as e:
+            logger.error(f"Export stream error: {e}")
+            raise
+
+    if fmt == "zip":
+        return StreamingResponse(body(), media_type="application/zip",
+                                 headers={"Content-Disposition": f'attachment; filename="{name}.zip"'})
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{name}.ndjson"'})
+
 @app.post("/messages/clear")
 def clear_chat(d: ClearChatModel):
     try:
@@ -760,11 +1679,38 @@ def clear_chat(d: ClearChatModel):
             cur.execute("SELECT id FROM users WHERE username=%s", (d.target,))
             tid = cur.fetchone()['id']
             if d.for_all:
-                cur.execute("DELETE FROM messages WHERE (sender_id=%s AND receiver_id=%s) OR (sender_id=%s AND receiver_id=%s)", (mid, tid, tid, mid))
+                # Для обеих сторон история скрывается отметкой сразу, строки удаляются в фоне
+                cur.execute("""
+                    SELECT COALESCE(MAX(id), 0) AS id FROM messages
+                    WHERE (sender_id=%s AND receiver_id=%s) OR (sender_id=%s AND receiver_id=%s)
+                """, (mid, tid, tid, mid))
+                upto = cur.fetchone()['id']
+                cur.execute("""
+                    INSERT INTO chat_state (user_id, peer_id, cleared_before_id)
+                    VALUES (%s, %s, %s), (%s, %s, %s)
+                    ON CONFLICT (user_id, peer_id) DO UPDATE SET cleared_before_id = EXCLUDED.cleared_before_id
+                    WHERE chat_state.cleared_before_id < EXCLUDED.cleared_before_id
+                """, (mid, tid, upto, tid, mid, upto))
+                # Задача ставится всегда: отметки могли уже стоять ("очистить у себя" у обоих),
+                # а строки физически еще не удалены
+                if upto:
+                    job_id = jobs.enqueue(cur, "clear_chat", {"a": mid, "b": tid, "upto": upto})
+                    result = {"status": "ok", "job_id": job_id}
+                else:
+                    result = {"status": "ok"}
             else:
-                cur.execute("UPDATE messages SET deleted_for_sender=TRUE WHERE sender_id=%s AND receiver_id=%s", (mid, tid))
-                cur.execute("UPDATE messages SET deleted_for_receiver=TRUE WHERE sender_id=%s AND receiver_id=%s", (tid, mid))
-            return {"status": "ok"}
+                # Одна строка в chat_state вместо пометки каждого сообщения
+                cur.execute("""
+                    INSERT INTO chat_state (user_id, peer_id, cleared_before_id)
+                    SELECT %s, %s, COALESCE(MAX(id), 0) FROM messages
+                    WHERE (sender_id=%s AND receiver_id=%s) OR (sender_id=%s AND receiver_id=%s)
+                    ON CONFLICT (user_id, peer_id) DO UPDATE SET cleared_before_id = EXCLUDED.cleared_before_id
+                    WHERE chat_state.cleared_before_id < EXCLUDED.cleared_before_id
+                """, (mid, tid, mid, tid, tid, mid))
+                result = {"status": "ok"}
+        if 'job_id' in result:
+            jobs.wake()
+        return result
     except Exception as e:
         logger.error(f"Clear chat error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -773,21 +1719,33 @@ def clear_chat(d: ClearChatModel):
 def delete_one_msg(d: DeleteMsgModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.user,))
-            uid = cur.fetchone()['id']
-            cur.execute("SELECT sender_id, receiver_id FROM messages WHERE id=%s", (d.id,))
-            m = cur.fetchone()
-            if not m:
-                raise HTTPException(404)
-            is_sender = (m['sender_id'] == uid)
-            if d.for_all and is_sender:
-                cur.execute("DELETE FROM messages WHERE id=%s", (d.id,))
-            else:
-                if is_sender:
-                    cur.execute("UPDATE messages SET deleted_for_sender=TRUE WHERE id=%s", (d.id,))
-                else:
-                    cur.execute("UPDATE messages SET deleted_for_receiver=TRUE WHERE id=%s", (d.id,))
-            return {"status": "ok"}
+            # Удаление у всех (только отправитель) или пометка у себя — одним запросом
+            cur.execute("""
+                WITH me AS (SELECT id FROM users WHERE username = %(u)s),
+                     m AS (
+                         SELECT x.id, x.created_at, x.sender_id = me.id AS is_sender
+                         FROM messages x, me WHERE x.id = %(id)s
+                     ),
+                     del AS (
+                         DELETE FROM messages x USING m
+                         WHERE x.id = m.id AND x.created_at = m.created_at AND %(all)s AND m.is_sender
+                         RETURNING x.id
+                     ),
+                     upd AS (
+                         UPDATE messages x SET deleted_for_sender = x.deleted_for_sender OR m.is_sender,
+                                               deleted_for_receiver = x.deleted_for_receiver OR NOT m.is_sender
+                         FROM m
+                         WHERE x.id = m.id AND x.created_at = m.created_at AND NOT (%(all)s AND m.is_sender)
+                         RETURNING x.id
+                     )
+                SELECT (SELECT id FROM m) AS found
+            """, {"u": d.user, "id": d.id, "all": d.for_all})
+            found = cur.fetchone()['found']
+        if found is None:
+            raise HTTPException(404)
+        return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Delete message error: {e}")
         raise HTTPException(500, "Internal server error")
@@ -796,10 +1754,24 @@ def delete_one_msg(d: DeleteMsgModel):
 def read_msgs(d: ReadMsgModel):
     try:
         with get_cursor() as cur:
-            cur.execute("SELECT id FROM users WHERE username=%s", (d.user,))
-            uid = cur.fetchone()['id']
-            if d.ids:
-                cur.execute("UPDATE messages SET is_read=TRUE WHERE receiver_id=%s AND id = ANY(%s)", (uid, d.ids))
+            if d.peer and d.up_to:
+                # Отметка только растет; если она уже не меньше, строка не переписывается
+                cur.execute("""
+                    INSERT INTO chat_state (user_id, peer_id, last_read_id)
+                    SELECT r.id, p.id, %s FROM users r, users p WHERE r.username = %s AND p.username = %s
+                    ON CONFLICT (user_id, peer_id) DO UPDATE SET last_read_id = EXCLUDED.last_read_id
+                    WHERE chat_state.last_read_id < EXCLUDED.last_read_id
+                """, (d.up_to, d.user, d.peer))
+            elif d.ids:
+                cur.execute("""
+                    INSERT INTO chat_state (user_id, peer_id, last_read_id)
+                    SELECT m.receiver_id, m.sender_id, MAX(m.id) FROM messages m
+                    JOIN users r ON r.id = m.receiver_id
+                    WHERE r.username = %s AND m.id = ANY(%s)
+                    GROUP BY 1, 2
+                    ON CONFLICT (user_id, peer_id) DO UPDATE SET last_read_id = EXCLUDED.last_read_id
+                    WHERE chat_state.last_read_id < EXCLUDED.last_read_id
+                """, (d.user, d.ids))
             return {"status": "ok"}
     except Exception as e:
         logger.error(f"Read messages error: {e}")
@@ -811,10 +1783,14 @@ def edit_msg(d: EditMsgModel):
         with get_cursor() as cur:
             cur.execute("SELECT id FROM users WHERE username=%s", (d.user,))
             uid = cur.fetchone()['id']
-            cur.execute("SELECT sender_id FROM messages WHERE id=%s", (d.id,))
+            cur.execute("SELECT sender_id, content, body, attachments FROM messages WHERE id=%s", (d.id,))
             m = cur.fetchone()
             if m and m['sender_id'] == uid:
-                cur.execute("UPDATE messages SET content=%s WHERE id=%s", (d.new_text, d.id))
+                _, atts = message_payload(m)
+                cur.execute(
+                    "UPDATE messages SET content=%s, body=%s, attachments=%s, preview=%s WHERE id=%s",
+                    (payload.to_legacy(d.new_text, atts), d.new_text, Json(atts), payload.build_preview(d.new_text, atts), d.id)
+                )
             return {"status": "ok"}
     except Exception as e:
         logger.error(f"Edit message error: {e}")
@@ -824,10 +1800,9 @@ def edit_msg(d: EditMsgModel):
 def set_typing(d: TypingModel):
     try:
         if d.status:
-            typing_status[d.user] = (d.target, time.time())
+            state.put("typing", d.user, d.target, TYPING_TTL)
         else:
-            if d.user in typing_status:
-                del typing_status[d.user]
+            state.delete("typing", d.user)
         return {"status": "ok"}
     except Exception as e:
         logger.error(f"Typing error: {e}")
@@ -836,11 +1811,7 @@ def set_typing(d: TypingModel):
 @app.get("/messages/typing")
 def get_typing(user: str, me: str):
     try:
-        if user in typing_status:
-            target, ts = typing_status[user]
-            if target == me and (time.time() - ts) < 5.0:
-                return {"is_typing": True}
-        return {"is_typing": False}
+        return {"is_typing": state.get("typing", user) == me}
     except Exception as e:
         logger.error(f"Get typing error: {e}")
         return {"is_typing": False}
@@ -996,7 +1967,14 @@ def get_videos_list():
 
 @app.post("/bot/analyze")
 def analyze_url(d: BotAnalyzeModel):
+    YTDLP_ACTIVE.inc()
+    result = "error"
     try:
+        try:
+            yt_dlp = load_ytdlp()
+        except ImportError:
+            result = "missing"
+            return {"status": "error", "msg": "yt-dlp is not installed on the server"}
         s = get_dl_strategies()
         for opts in s:
             try:
@@ -1005,6 +1983,7 @@ def analyze_url(d: BotAnalyzeModel):
                     i = ydl.extract_info(d.url, download=False)
                     if not i:
                         continue
+                    result = "ok"
                     return {
                         "status": "ok",
                         "title": i.get('title'),
@@ -1017,11 +1996,16 @@ def analyze_url(d: BotAnalyzeModel):
                     }
             except:
                 continue
+        result = "unavailable"
         return {"status": "error", "msg": "Content unavailable"}
     except Exception as e:
         logger.error(f"Analyze URL error: {e}")
         return {"status": "error", "msg": "Internal server error"}
+    finally:
+        YTDLP_ACTIVE.dec()
+        YTDLP_JOBS.inc(kind="analyze", result=result)
 
 @app.post("/bot/download")
 def download_media(d: BotDownloadModel):
+    YTDLP_JOBS.inc(kind="download", result="disabled")
     return {"status": "error", "msg": "Downloads disabled in DB mode for simplicity"}
\ No newline at end of file
@@ -0,0 +1,8 @@
+# Нагрузочные тесты сервера:
+#   python -m bench.seed    — наполнение локальной БД синтетическими данными
+#   python -m bench.load    — эмуляция N клиентов, результаты в JSON
+#   python -m bench.compare — сравнение двух прогонов
+#   python -m bench.partitions — секционирование и DETACH на живой БД во временной схеме
+
+PREFIX = "bench_"
+PASSWORD = "bench"
@@ -0,0 +1,51 @@
+"""
+Сравнение двух прогонов bench.load:
+
+    python -m bench.compare runs/base.json runs/head.json
+"""
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps")
+
+def delta(a, b):
+    if not a:
+        return "   n/a"
+    return f"{(b - a) / a * 100:+6.1f}%"
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__.strip())
+        sys.exit(2)
+    with open(argv[0], encoding="utf-8") as f:
+        base = json.load(f)
+    with open(argv[1], encoding="utf-8") as f:
+        head = json.load(f)
+    print(f"base {base['meta'].get('commit') or argv[0]}  ->  head {head['meta'].get('commit') or argv[1]}")
+    print(f"{'endpoint':<14}" + "".join(f"{m:>22}" for m in METRICS))
+    names = sorted(set(base["endpoints"]) | set(head["endpoints"]))
+    for n in names:
+        b = base["endpoints"].get(n, {})
+        h = head["endpoints"].get(n, {})
+        cols = []
+        for m in METRICS:
+            bv, hv = b.get(m, 0), h.get(m, 0)
+            cols.append(f"{bv:>7} → {hv:>7} {delta(bv, hv)}")
+        print(f"{n:<14}" + "".join(f"{c:>22}" for c in cols))
+    print(f"total rps: {base['total']['rps']} → {head['total']['rps']} {delta(base['total']['rps'], head['total']['rps'])}")
+
+    # Серверная сторона: запросы к БД и удержание соединения на вызов
+    bdb, hdb = base.get("db", {}), head.get("db", {})
+    if bdb or hdb:
+        print(f"\n{'route':<34}{'stmts/checkout':>26}{'hold ms':>28}")
+        for r in sorted(set(bdb) | set(hdb)):
+            b, h = bdb.get(r, {}), hdb.get(r, {})
+            cols = []
+            for m in ("stmts_per_checkout", "hold_ms"):
+                bv, hv = b.get(m, 0), h.get(m, 0)
+                cols.append(f"{bv:>8} → {hv:>8} {delta(bv, hv)}")
+            print(f"{r:<34}{cols[0]:>26}{cols[1]:>28}")
+
+if __name__ == "__main__":
+    main()
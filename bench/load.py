@@ -0,0 +1,290 @@
+"""
+Нагрузочный драйвер: N имитированных клиентов с тем же набором запросов, что делает десктоп.
+
+    python -m bench.load --url https://localhost:8001 --clients 200 --duration 120 --out runs/head.json
+
+Каждый клиент — отдельный поток с собственной requests.Session (как и приложение).
+Расписание повторяет таймеры клиента:
+  * /messages/load      — каждые 3 с (PollWorker открытого чата)
+  * /contacts/list      — каждые 5 с (chat_list_timer)
+  * /messages/typing    — каждые 2.5 с (typing_poll_timer)
+  * /messages/send      — в среднем раз в --send-every с (экспоненциально)
+  * /messages/history   — при открытии чата и подгрузка страниц при прокрутке
+  * /user/profile_info + аватар — при открытии чата
+  * /friends/request + accept, /blacklist/block + unblock, /messages/delete_one — редко (--social-every)
+В JSON пишутся p50/p95/p99 по эндпоинтам и посекундная пропускная способность,
+а также со стороны сервера (по /metrics): сколько запросов к БД и сколько времени
+соединение из пула удерживается на один вызов каждого эндпоинта.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import defaultdict
+
+import requests
+import urllib3
+
+from bench import PREFIX, PASSWORD
+
+urllib3.disable_warnings()
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.per_second = defaultdict(lambda: [0, 0])
+        self.t0 = time.time()
+
+    def add(self, name, dt, ok):
+        sec = int(time.time() - self.t0)
+        with self._lock:
+            self.samples[name].append(dt)
+            if not ok:
+                self.errors[name] += 1
+            ps = self.per_second[sec]
+            ps[0] += 1
+            if not ok:
+                ps[1] += 1
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+class SimClient(threading.Thread):
+    def __init__(self, idx, args, users, rec, stop):
+        super().__init__(daemon=True)
+        self.a = args
+        self.rec = rec
+        self.stop = stop
+        self.rnd = random.Random(args.seed + idx)
+        self.me = users[idx % len(users)]
+        self.users = users
+        self.s = requests.Session()
+        self.s.verify = False
+        self.peer = None
+        self.last_id = 0
+        self.loaded = 0
+
+    def call(self, name, method, path, **kw):
+        t = time.perf_counter()
+        ok = False
+        r = None
+        try:
+            r = self.s.request(method, f"{self.a.url}{path}", timeout=self.a.timeout, **kw)
+            ok = r.status_code < 400
+        except requests.RequestException:
+            pass
+        self.rec.add(name, time.perf_counter() - t, ok)
+        return r if ok else None
+
+    def open_chat(self):
+        r = self.call("contacts", "GET", "/contacts/list", params={"username": self.me})
+        contacts = r.json().get("contacts", []) if r else []
+        if contacts and self.rnd.random() < 0.8:
+            self.peer = self.rnd.choice(contacts[:20])["username"]
+        else:
+            self.peer = self.rnd.choice(self.users)
+        r = self.call("profile_info", "GET", "/user/profile_info", params={"username": self.peer})
+        av = r.json().get("avatar_url") if r else None
+        if av:
+            self.call("avatar", "GET", av if av.startswith("/") else f"/{av}")
+        r = self.call("history", "GET", "/messages/history", params={"u1": self.me, "u2": self.peer, "offset": 0, "limit": 50})
+        msgs = r.json().get("messages", []) if r else []
+        self.loaded = len(msgs)
+        self.last_id = msgs[-1]["id"] if msgs else 0
+
+    def run(self):
+        a = self.a
+        # Клиенты стартуют вразнобой, как после реального логина
+        time.sleep(self.rnd.random() * a.ramp)
+        self.open_chat()
+        now = time.time()
+        due = {
+            "poll": now + self.rnd.random() * 3,
+            "contacts": now + self.rnd.random() * 5,
+            "typing": now + self.rnd.random() * 2.5,
+            "send": now + self.rnd.expovariate(1.0 / a.send_every),
+            "page": now + self.rnd.expovariate(1.0 / a.page_every),
+            "switch": now + self.rnd.expovariate(1.0 / a.switch_every),
+            "social": now + self.rnd.expovariate(1.0 / a.social_every),
+        }
+        while not self.stop.is_set():
+            act, at = min(due.items(), key=lambda kv: kv[1])
+            wait = at - time.time()
+            if wait > 0 and self.stop.wait(wait):
+                break
+            now = time.time()
+            if act == "poll":
+                r = self.call("load", "GET", "/messages/load", params={"u1": self.me, "u2": self.peer, "last_id": self.last_id})
+                msgs = r.json().get("messages", []) if r else []
+                if msgs:
+                    self.last_id = msgs[-1]["id"]
+                due["poll"] = now + 3
+            elif act == "contacts":
+                self.call("contacts", "GET", "/contacts/list", params={"username": self.me})
+                due["contacts"] = now + 5
+            elif act == "typing":
+                self.call("typing", "GET", "/messages/typing", params={"user": self.peer, "me": self.me})
+                due["typing"] = now + 2.5
+            elif act == "send":
+                self.call("send", "POST", "/messages/send", params={"sender": self.me},
+                          json={"to_user": self.peer, "text": f"bench {self.rnd.random():.6f}"})
+                due["send"] = now + self.rnd.expovariate(1.0 / a.send_every)
+            elif act == "page":
+                self.call("history_page", "GET", "/messages/history",
+                          params={"u1": self.me, "u2": self.peer, "offset": self.loaded, "limit": 30})
+                self.loaded += 30
+                due["page"] = now + self.rnd.expovariate(1.0 / a.page_every)
+            elif act == "switch":
+                self.open_chat()
+                due["switch"] = now + self.rnd.expovariate(1.0 / a.switch_every)
+            elif act == "social":
+                self.social()
+                due["social"] = now + self.rnd.expovariate(1.0 / a.social_every)
+
+    def social(self):
+        other = self.rnd.choice(self.users)
+        if other == self.me:
+            return
+        pair = {"me": self.me, "target": other}
+        back = {"me": other, "target": self.me}
+        self.call("friend_request", "POST", "/friends/request", json=pair)
+        self.call("friend_accept", "POST", "/friends/accept", json=back)
+        self.call("block", "POST", "/blacklist/block", json=pair)
+        self.call("unblock", "POST", "/blacklist/unblock", json=pair)
+        if self.last_id:
+            self.call("delete_one", "POST", "/messages/delete_one",
+                      json={"user": self.me, "id": self.last_id, "for_all": False})
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return ""
+
+_METRIC_RE = re.compile(r'^(quant_db_conn_hold_seconds|quant_db_statements_per_checkout)_(sum|count)\{route="([^"]*)"\} ([0-9.eE+-]+)$')
+
+def scrape_db(url, timeout):
+    """Суммы и количества по маршрутам из /metrics (накопительные с запуска сервера)."""
+    res = {}
+    try:
+        r = requests.get(f"{url}/metrics", verify=False, timeout=timeout)
+        r.raise_for_status()
+    except requests.RequestException:
+        return res
+    for line in r.text.splitlines():
+        m = _METRIC_RE.match(line)
+        if m:
+            name, part, route, v = m.groups()
+            res[(name, part, route)] = float(v)
+    return res
+
+def db_delta(before, after):
+    out = {}
+    routes = {k[2] for k in after}
+    for route in sorted(routes):
+        def d(name, part):
+            return after.get((name, part, route), 0.0) - before.get((name, part, route), 0.0)
+        n = d("quant_db_conn_hold_seconds", "count")
+        if n <= 0:
+            continue
+        out[route] = {
+            "checkouts": int(n),
+            "stmts_per_checkout": round(d("quant_db_statements_per_checkout", "sum") / n, 2),
+            "hold_ms": round(d("quant_db_conn_hold_seconds", "sum") / n * 1000, 3),
+        }
+    return out
+
+def summarize(rec, args, elapsed):
+    endpoints = {}
+    total = 0
+    for name, vals in sorted(rec.samples.items()):
+        vals = sorted(vals)
+        total += len(vals)
+        endpoints[name] = {
+            "count": len(vals),
+            "errors": rec.errors.get(name, 0),
+            "rps": round(len(vals) / elapsed, 2),
+            "mean_ms": round(sum(vals) / len(vals) * 1000, 2),
+            "p50_ms": round(percentile(vals, 50) * 1000, 2),
+            "p95_ms": round(percentile(vals, 95) * 1000, 2),
+            "p99_ms": round(percentile(vals, 99) * 1000, 2),
+            "max_ms": round(vals[-1] * 1000, 2),
+        }
+    curve = [{"t": s, "rps": v[0], "errors": v[1]} for s, v in sorted(rec.per_second.items())]
+    return {
+        "meta": {
+            "commit": git_rev(),
+            "started": datetime.datetime.fromtimestamp(rec.t0).isoformat(),
+            "elapsed_s": round(elapsed, 2),
+            "args": vars(args),
+        },
+        "total": {"count": total, "rps": round(total / elapsed, 2)},
+        "endpoints": endpoints,
+        "throughput": curve,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay the desktop client request mix against a server")
+    ap.add_argument("--url", default="https://localhost:8001")
+    ap.add_argument("--clients", type=int, default=50)
+    ap.add_argument("--duration", type=float, default=60)
+    ap.add_argument("--ramp", type=float, default=5, help="seconds over which clients start")
+    ap.add_argument("--users", type=int, default=10000, help="how many seeded bench users to pick from")
+    ap.add_argument("--send-every", type=float, default=20)
+    ap.add_argument("--page-every", type=float, default=60)
+    ap.add_argument("--switch-every", type=float, default=45)
+    ap.add_argument("--social-every", type=float, default=120)
+    ap.add_argument("--timeout", type=float, default=10)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--login", action="store_true", help="log every client in first (exercises PBKDF2)")
+    ap.add_argument("--out", default="")
+    a = ap.parse_args()
+
+    users = [f"{PREFIX}{i:06d}" for i in range(a.users)]
+    rec = Recorder()
+    stop = threading.Event()
+    clients = [SimClient(i, a, users, rec, stop) for i in range(a.clients)]
+    if a.login:
+        for c in clients:
+            c.call("login", "POST", "/login", json={"login": c.me, "pw": PASSWORD})
+    db_before = scrape_db(a.url, a.timeout)
+    rec.t0 = time.time()
+    for c in clients:
+        c.start()
+    try:
+        stop.wait(a.duration)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    for c in clients:
+        c.join(timeout=a.timeout + 1)
+    elapsed = time.time() - rec.t0
+
+    res = summarize(rec, a, elapsed)
+    res["db"] = db_delta(db_before, scrape_db(a.url, a.timeout))
+    print(f"{'endpoint':<14} {'count':>8} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, e in res["endpoints"].items():
+        print(f"{name:<14} {e['count']:>8} {e['errors']:>5} {e['rps']:>8} {e['p50_ms']:>8} {e['p95_ms']:>8} {e['p99_ms']:>8}")
+    print(f"total: {res['total']['count']} requests, {res['total']['rps']} rps")
+    if res["db"]:
+        print(f"\n{'route':<34} {'checkouts':>9} {'stmts':>6} {'hold ms':>8}")
+        for route, e in res["db"].items():
+            print(f"{route:<34} {e['checkouts']:>9} {e['stmts_per_checkout']:>6} {e['hold_ms']:>8}")
+    if a.out:
+        os.makedirs(os.path.dirname(os.path.abspath(a.out)), exist_ok=True)
+        with open(a.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"written to {a.out}")
+
+if __name__ == "__main__":
+    main()
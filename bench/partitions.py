@@ -0,0 +1,69 @@
+"""
+Проверка обслуживания секций messages на живой БД (PostgreSQL 14+):
+
+    python -m bench.partitions
+
+Во временной схеме создается обычная messages со старой и текущей перепиской, переводится
+в секционированную (messages_legacy + месяцы + messages_default), затем отсоединяются
+помесячная секция и messages_legacy — тем же detach_partition, что и в
+`python -m app.core.partitions detach`. Схема удаляется в конце; рабочие таблицы не трогаются.
+"""
+import datetime
+
+import psycopg2
+
+from app.core.config import Cfg
+from app.core import partitions
+
+SCHEMA = "bench_partitions"
+
+def count(cur, table):
+    cur.execute(f"SELECT COUNT(*) FROM {table}")
+    return cur.fetchone()[0]
+
+def main():
+    conn = psycopg2.connect(dbname=Cfg.DB_NAME, user=Cfg.DB_USER, password=Cfg.DB_PASS,
+                            host=Cfg.DB_HOST, port=Cfg.DB_PORT)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cur.execute(f"CREATE SCHEMA {SCHEMA}")
+            # Сессионный search_path: все имена partitions.* разрешаются во временной схеме
+            cur.execute(f"SET search_path TO {SCHEMA}")
+        now = datetime.datetime.now()
+        nxt = partitions.add_months(partitions.month_start(now.date()), 1)
+        with conn.cursor() as cur:
+            cur.execute("""CREATE TABLE messages (id SERIAL PRIMARY KEY, sender_id INT, receiver_id INT,
+                           content TEXT, created_at TIMESTAMP DEFAULT NOW())""")
+            cur.execute("INSERT INTO messages (sender_id, receiver_id, content, created_at) VALUES "
+                        "(1, 2, 'old', %s), (2, 1, 'now', %s)", (now - datetime.timedelta(days=800), now))
+            conn.autocommit = False
+            partitions.migrate_to_partitioned(cur)
+            ensure = partitions.ensure_partitions(cur, 1)
+            cur.execute("INSERT INTO messages (sender_id, receiver_id, content, created_at) VALUES "
+                        "(1, 2, 'next', %s), (1, 2, 'far', %s)",
+                        (nxt + datetime.timedelta(days=1), now + datetime.timedelta(days=3650)))
+            conn.commit()
+            conn.autocommit = True
+            print("partitions:", ", ".join(ensure))
+            assert partitions.has_default(cur), "messages_default was not created"
+            assert count(cur, partitions.DEFAULT) == 1, "far-future row did not land in DEFAULT"
+
+            month = partitions.partition_name(nxt)
+            partitions.detach_partition(conn, month)
+            partitions.detach_partition(conn, partitions.LEGACY)
+            left = {name for name, _ in partitions.list_partitions(cur)}
+            assert month not in left and partitions.LEGACY not in left, left
+            assert count(cur, month) == 1 and count(cur, partitions.LEGACY) == 2
+            assert count(cur, "messages") == 1
+        print(f"OK: detached {month} and {partitions.LEGACY}")
+    finally:
+        conn.rollback()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
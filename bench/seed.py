@@ -0,0 +1,202 @@
+"""
+Генератор синтетических данных для нагрузочных тестов.
+
+    python -m bench.seed --users 100000 --messages 50000000 --seed 42
+
+Пишет напрямую в Postgres через COPY (схему создает сервер при старте).
+Все пользователи получают логин bench_NNNNNN и пароль "bench".
+Распределения:
+  * друзья — степенной закон (немного "популярных" пользователей, много с парой друзей);
+  * сообщения — переписки выбираются из ребер графа друзей, длина переписки по Парето,
+    так что небольшая доля чатов содержит большую часть сообщений;
+  * время сообщений — за последние --days дней, с сохранением порядка внутри чата.
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import time
+
+import psycopg2
+
+from app.core.config import Cfg
+from app.core import payload
+from bench import PREFIX, PASSWORD
+
+WORDS = ("привет как дела ок да нет завтра сегодня встреча код сервер база запрос ответ "
+         "смотри ссылка фото видео музыка трек альбом круто спасибо давай потом позже").split()
+GENRES = ("Rock", "Jazz", "Electronic", "Classical", "Hip-Hop", "Ambient")
+
+class RowStream:
+    """Файлоподобный объект для copy_expert: строки генерируются по мере чтения."""
+    def __init__(self, rows):
+        self._rows = rows
+        self._buf = b""
+        self.count = 0
+
+    def _line(self, row):
+        return ("\t".join(r"\N" if v is None else str(v) for v in row) + "\n").encode()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += self._line(next(self._rows))
+                self.count += 1
+            except StopIteration:
+                break
+        if size < 0:
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    readline = read
+
+def connect():
+    return psycopg2.connect(dbname=Cfg.DB_NAME, user=Cfg.DB_USER, password=Cfg.DB_PASS,
+                            host=Cfg.DB_HOST, port=Cfg.DB_PORT)
+
+def copy_rows(cur, table, columns, rows):
+    stream = RowStream(iter(rows))
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream, size=1 << 16)
+    return stream.count
+
+def pw_hash():
+    salt = "benchsalt"
+    return f"{salt}${hashlib.pbkdf2_hmac('sha256', PASSWORD.encode(), salt.encode(), 100000).hex()}"
+
+def sentence(rnd):
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 14)))
+
+def pareto_int(rnd, alpha, lo, hi):
+    return min(hi, int(lo * rnd.paretovariate(alpha)))
+
+def truncate(cur):
+    cur.execute("SELECT id FROM users WHERE username LIKE %s", (PREFIX.replace("_", r"\_") + "%",))
+    ids = [r[0] for r in cur.fetchall()]
+    if not ids:
+        return
+    print(f"Removing {len(ids)} previous bench users...")
+    cur.execute("DELETE FROM messages WHERE sender_id = ANY(%s) OR receiver_id = ANY(%s)", (ids, ids))
+    cur.execute("DELETE FROM media_tracks WHERE group_id IN (SELECT id FROM media_groups WHERE user_id = ANY(%s))", (ids,))
+    cur.execute("DELETE FROM media_groups WHERE user_id = ANY(%s)", (ids,))
+    cur.execute("DELETE FROM friends WHERE user_id = ANY(%s) OR friend_id = ANY(%s)", (ids, ids))
+    cur.execute("DELETE FROM blacklist WHERE user_id = ANY(%s) OR blocked_id = ANY(%s)", (ids, ids))
+    cur.execute("DELETE FROM user_profiles WHERE user_id = ANY(%s)", (ids,))
+    cur.execute("DELETE FROM users WHERE id = ANY(%s)", (ids,))
+
+def seed_users(cur, n, rnd):
+    h = pw_hash()
+    now = datetime.datetime.now()
+    rows = ((f"{PREFIX}{i:06d}", f"{PREFIX}{i:06d}@bench.local", h, now - datetime.timedelta(days=rnd.randint(0, 900)))
+            for i in range(n))
+    copy_rows(cur, "users", ("username", "email", "password_hash", "created_at"), rows)
+    cur.execute("SELECT id FROM users WHERE username LIKE %s ORDER BY username", (PREFIX.replace("_", r"\_") + "%",))
+    ids = [r[0] for r in cur.fetchall()]
+    copy_rows(cur, "user_profiles", ("user_id", "status_msg", "bio"),
+              ((uid, sentence(rnd)[:40], sentence(rnd)) for uid in ids))
+    return ids
+
+def seed_friends(cur, ids, avg, rnd):
+    edges = set()
+    n = len(ids)
+    for a in range(n):
+        for _ in range(pareto_int(rnd, 1.6, max(1, avg // 3), avg * 20)):
+            # Предпочтение "ранним" пользователям дает хабы в графе
+            b = int(n * rnd.random() ** 2)
+            if a != b:
+                edges.add((min(a, b), max(a, b)))
+    rows = []
+    for a, b in edges:
+        rows.append((ids[a], ids[b], 'accepted'))
+        rows.append((ids[b], ids[a], 'accepted'))
+    copy_rows(cur, "friends", ("user_id", "friend_id", "status"), rows)
+    return sorted(edges)
+
+def message_rows(ids, edges, total, days, rnd):
+    # Веса переписок по Парето, затем нормализация до total
+    weights = [rnd.paretovariate(1.2) for _ in edges]
+    scale = total / sum(weights)
+    now = time.time()
+    span = days * 86400
+    left = total
+    for (a, b), w in zip(edges, weights):
+        if left <= 0:
+            break
+        cnt = min(left, max(1, int(w * scale)))
+        left -= cnt
+        sa, sb = ids[a], ids[b]
+        start = now - span * rnd.random()
+        step = (now - start) / cnt
+        t = start
+        for _ in range(cnt):
+            t += step * rnd.random() * 2
+            sender, receiver = (sa, sb) if rnd.random() < 0.5 else (sb, sa)
+            if rnd.random() < 0.05:
+                text = ""
+                atts = [{'type': 'image', 'url': f"/bench/img/{rnd.randint(1, 10**6)}.jpg", 'name': "photo.jpg",
+                         'size': rnd.randint(20_000, 4_000_000), 'width': 1280, 'height': 960}]
+            else:
+                text, atts = sentence(rnd), []
+            ts = datetime.datetime.fromtimestamp(min(t, now))
+            yield (sender, receiver, payload.to_legacy(text, atts), text, json.dumps(atts),
+                   payload.build_preview(text, atts), ts, 't' if t < now - 3600 else 'f', 'f', 'f')
+
+def seed_messages(cur, ids, edges, total, days, rnd):
+    cols = ("sender_id", "receiver_id", "content", "body", "attachments", "preview",
+            "created_at", "is_read", "deleted_for_sender", "deleted_for_receiver")
+    n = copy_rows(cur, "messages", cols, message_rows(ids, edges, total, days, rnd))
+    # Отметки прочтения: все, что старше часа, считается прочитанным
+    cur.execute("""
+        INSERT INTO chat_state (user_id, peer_id, last_read_id)
+        SELECT receiver_id, sender_id, MAX(id) FROM messages
+        WHERE is_read AND receiver_id = ANY(%s) GROUP BY 1, 2
+        ON CONFLICT (user_id, peer_id) DO UPDATE SET last_read_id = GREATEST(chat_state.last_read_id, EXCLUDED.last_read_id)
+    """, (ids,))
+    return n
+
+def seed_media(cur, ids, groups, tracks, rnd):
+    rows = ((uid, f"Album {i}", f"Artist {rnd.randint(1, 5000)}", rnd.choice(GENRES), "")
+            for uid in ids for i in range(rnd.randint(0, groups * 2)))
+    copy_rows(cur, "media_groups", ("user_id", "title", "author", "genre", "cover_path"), rows)
+    cur.execute("SELECT id FROM media_groups WHERE user_id = ANY(%s)", (ids,))
+    gids = [r[0] for r in cur.fetchall()]
+    rows = ((g, f"Track {i}", f"Artist {rnd.randint(1, 5000)}", f"/music/{g}/{i}.mp3", i == 0, "en", rnd.randint(0, 5), None)
+            for g in gids for i in range(rnd.randint(1, tracks * 2)))
+    copy_rows(cur, "media_tracks", ("group_id", "title", "performer", "file_path", "is_original", "language", "rating", "parent_id"), rows)
+
+def main():
+    ap = argparse.ArgumentParser(description="Seed Postgres with synthetic Quant data")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--messages", type=int, default=1000000)
+    ap.add_argument("--friends", type=int, default=20, help="average friends per user")
+    ap.add_argument("--media-groups", type=int, default=2, help="average media groups per user")
+    ap.add_argument("--tracks", type=int, default=6, help="average tracks per group")
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--keep", action="store_true", help="do not remove previous bench_* data")
+    a = ap.parse_args()
+
+    rnd = random.Random(a.seed)
+    conn = connect()
+    t0 = time.time()
+    with conn, conn.cursor() as cur:
+        if not a.keep:
+            truncate(cur)
+        ids = seed_users(cur, a.users, rnd)
+        print(f"users: {len(ids)} ({time.time() - t0:.1f}s)")
+        edges = seed_friends(cur, ids, a.friends, rnd)
+        print(f"friend pairs: {len(edges)} ({time.time() - t0:.1f}s)")
+        seed_media(cur, ids, a.media_groups, a.tracks, rnd)
+        print(f"media ({time.time() - t0:.1f}s)")
+        n = seed_messages(cur, ids, edges, a.messages, a.days, rnd)
+        print(f"messages: {n} ({time.time() - t0:.1f}s)")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+    conn.close()
+    print(f"done in {time.time() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+
+import httpx
+import shiboken6
+from PySide6.QtCore import Qt, QCoreApplication, QObject, Signal, Slot
+
+from client.api import api, flight_key, retry_budget, retry_delay, POOL_SIZE
+from client import decode as decoder
+from client.diskcache import disk_cache
+from client.scheduler import scheduler, current_priority, VISIBLE
+
+# Асинхронная сеть для массовых загрузок (картинки, аватары, превью).
+# Цикл asyncio живет в одном фоновом потоке: сотни одновременных загрузок —
+# это сотни корутин, а не сотни задач в QThreadPool, занимающих по потоку на время ожидания.
+# Результат возвращается в GUI-поток одним общим сигналом, без пары QRunnable+Signals на запрос.
+# Загрузки привязываются к виджету-владельцу (токен client.scheduler): удаление виджета
+# или конец сессии отменяет их, а опоздавший ответ до мертвого виджета не доходит.
+# Диск и декодирование — в пулах планировщика, с приоритетом запустившего вызова.
+
+MAX_CONNECTIONS = 64
+RETRIES = 2
+# Миниатюры строятся из неизменного по адресу оригинала — хранятся, пока их не вытеснит LRU
+THUMB_TTL = 365 * 24 * 3600
+
+def _timeout(t) -> httpx.Timeout:
+    # Ожидание свободного соединения не ограничено: очередь из сотен загрузок — норма
+    return httpx.Timeout(t, connect=3.05, pool=None)
+
+def _read_file(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+class _Dispatcher(QObject):
+    """Живет в GUI-потоке; сигнал из потока цикла доставляется очередью Qt."""
+    call = Signal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.call.connect(self._run)
+
+    @Slot(object)
+    def _run(self, fn):
+        try:
+            fn()
+        except Exception:
+            traceback.print_exc()
+
+class _Flight:
+    """Общий запрос single-flight и число ждущих его корутин."""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class AsyncNet:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._external = None
+        self._dispatcher = None
+        self._inflight = {}  # ключ совмещения -> _Flight; трогается только из потока цикла
+
+    # --- цикл ---
+    def _ensure(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop, args=(ready,), name="aio_net", daemon=True)
+            self._thread.start()
+            ready.wait()
+            app = QCoreApplication.instance()
+            if app is not None:
+                app.aboutToQuit.connect(self.close)
+            return self._loop
+
+    def _run_loop(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=POOL_SIZE)
+        self._client = httpx.AsyncClient(verify=False, limits=limits, timeout=_timeout(10), follow_redirects=True)
+        # Сторонние сайты — отдельный пул с проверкой сертификатов, как в api.external
+        self._external = httpx.AsyncClient(verify=True, limits=limits, timeout=_timeout(10), follow_redirects=True)
+        self._loop = loop
+        ready.set()
+        loop.run_forever()
+
+    def close(self):
+        loop = self._loop
+        if loop is None:
+            return
+        async def shutdown():
+            await self._client.aclose()
+            await self._external.aclose()
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=1)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        self._loop = None
+
+    def _get_dispatcher(self):
+        if self._dispatcher is None:
+            d = _Dispatcher()
+            app = QCoreApplication.instance()
+            if app is not None and d.thread() is not app.thread():
+                d.moveToThread(app.thread())
+            self._dispatcher = d
+        return self._dispatcher
+
+    # --- запуск из GUI ---
+    def call(self, coro, callback=None, owner=None, priority=VISIBLE, token=None):
+        """Запускает корутину в цикле сети. callback(результат) вызывается в GUI-потоке,
+        если владелец (QObject) еще жив. priority — client.scheduler.VISIBLE/PREFETCH/BACKGROUND;
+        token — дополнительный CancelToken (например, чата).
+        Возвращает concurrent.futures.Future — его можно отменить."""
+        fut = asyncio.run_coroutine_threadsafe(self._prioritized(coro, priority), self._ensure())
+        if owner is not None:
+            scheduler.token_for(owner).add(fut)
+        if token is not None:
+            token.add(fut)
+        if owner is None and token is None:
+            scheduler.session.add(fut)
+        if callback is not None:
+            dispatcher = self._get_dispatcher()
+            def done(f):
+                if f.cancelled() or f.exception() is not None:
+                    return
+                res = f.result()
+                dispatcher.call.emit(lambda: self._deliver(owner, callback, res))
+            fut.add_done_callback(done)
+        return fut
+
+    @staticmethod
+    async def _prioritized(coro, priority):
+        # Переменная контекста задачи: ее видят пулы диска/декодирования и очередь загрузок
+        current_priority.set(priority)
+        return await coro
+
+    @staticmethod
+    def _deliver(owner, callback, res):
+        if owner is not None and not shiboken6.isValid(owner):
+            return
+        callback(res)
+
+    def cancel(self, owner):
+        """Отменяет все загрузки владельца (например, при смене чата)."""
+        scheduler.token_for(owner).cancel()
+
+    @staticmethod
+    async def _disk(fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(scheduler.disk, fn, *args)
+
+    # --- корутины ---
+    async def request(self, method, path, timeout=10, media=False, **kw) -> httpx.Response:
+        """media=True — загрузка медиа: сетевую часть ограничивают слоты scheduler.media."""
+        url = api.url(path)
+        external = url.startswith("http") and not url.startswith(api.base_url)
+        if not external:
+            for hook in api._request_hooks:
+                hook(method, path, kw)
+        key = flight_key(method, url, kw)
+        if key is None:
+            return await self._send(method, path, url, external, timeout, media, kw)
+        flight = self._inflight.get(key)
+        if flight is None:
+            # Задача наследует контекст первого ждущего — и его приоритет в очереди слотов
+            flight = _Flight(asyncio.ensure_future(self._send(method, path, url, external, timeout, media, kw)))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda t, k=key, f=flight: self._flight_done(k, f))
+        elif not external:
+            api.stats.coalesced(method, path.split("?", 1)[0])
+        flight.waiters += 1
+        try:
+            # shield: отмена одного ожидающего (виджет удален) не обрывает запрос для остальных
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Отменен последний ждущий (пузырь ушел с экрана, смена чата): запрос никому не нужен.
+                # Новый запрос того же адреса начнется заново, а не получит отмену
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight.task.cancel()
+
+    def _flight_done(self, key, flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+        if not flight.task.cancelled():
+            flight.task.exception()  # иначе asyncio ругается на непрочитанное исключение, если все ждущие отменены
+
+    async def _send(self, method, path, url, external, timeout, media, kw) -> httpx.Response:
+        client = self._external if external else self._client
+        attempt = 0
+        budget = retry_budget(timeout)
+        while True:
+            t0 = time.perf_counter()
+            r = None
+            try:
+                if media:
+                    # Слот держит тот, кто реально качает: ждущие того же адреса слотов не занимают,
+                    # а отмена загрузки освобождает слот вместе с соединением
+                    async with scheduler.media:
+                        t0 = time.perf_counter()
+                        r = await client.request(method, url, timeout=_timeout(timeout), **kw)
+                else:
+                    r = await client.request(method, url, timeout=_timeout(timeout), **kw)
+            finally:
+                if not external:
+                    elapsed = time.perf_counter() - t0
+                    for hook in api._response_hooks:
+                        try:
+                            hook(method, path.split("?", 1)[0], r, elapsed)
+                        except Exception:
+                            pass
+            # Повтор только для чтения — как в BackoffAdapter для GET
+            if r.status_code not in (429, 503) or method != "GET" or attempt >= RETRIES:
+                return r
+            # Как в BackoffAdapter: паузы вместе не длиннее таймаута вызова
+            delay = retry_delay(r.headers, attempt)
+            if budget is not None:
+                if delay > budget:
+                    return r
+                budget -= delay
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get_json(self, path, default=None, timeout=5, **kw):
+        try:
+            r = await self.request("GET", path, timeout=timeout, **kw)
+            if r.status_code == 200:
+                return r.json()
+        except Exception:
+            pass
+        return default
+
+    async def get_list(self, path, key, timeout=5, **kw):
+        """Список из ответа {key: [...]}; None — запрос не удался (в отличие от пустого списка)."""
+        j = await self.get_json(path, timeout=timeout, **kw)
+        return None if j is None else j.get(key, [])
+
+    async def post(self, path, timeout=5, **kw) -> httpx.Response:
+        return await self.request("POST", path, timeout=timeout, **kw)
+
+    # --- конечные точки (как в client.api, для вызовов из цикла) ---
+    async def ping(self):
+        return await self.request("GET", "/openapi.json", timeout=2)
+
+    async def login(self, login, pw):
+        return await self.post("/login", json={"login": login, "pw": pw}, timeout=5)
+
+    async def register(self, data):
+        return await self.post("/register", json=data, timeout=5)
+
+    async def update_profile(self, username, status_msg, bio):
+        return await self.post("/user/profile_update", json={"username": username, "status_msg": status_msg, "bio": bio})
+
+    async def upload_avatar(self, username, filename, data, mime, timeout=120):
+        return await self.post("/user/avatar/upload", data={"username": username},
+                               files={"file": (filename, data, mime)}, timeout=timeout)
+
+    async def delete_avatar(self, username):
+        return await self.post("/user/avatar/delete", json={"username": username}, timeout=10)
+
+    async def delete_account(self, username, pw):
+        return await self.request("DELETE", "/user/delete", json={"username": username, "pw": pw}, timeout=10)
+
+    async def summary(self, username):
+        return await self.get_json("/user/summary", params={"username": username}, timeout=3)
+
+    async def profile_info(self, username):
+        return await self.get_json("/user/profile_info", params={"username": username}, timeout=3)
+
+    async def contacts(self, username):
+        return await self.get_list("/contacts/list", "contacts", params={"username": username}, timeout=3)
+
+    async def friends(self, user):
+        return await self.get_list("/friends/list", "friends", params={"user": user}, timeout=3)
+
+    async def friend_requests(self, user):
+        return await self.get_list("/friends/incoming", "requests", params={"user": user}, timeout=3)
+
+    async def blacklist(self, user):
+        return await self.get_list("/blacklist/list", "blocked", params={"user": user}, timeout=3)
+
+    async def history(self, u1, u2, offset=0, limit=50):
+        return await self.get_list("/messages/history", "messages",
+                                   params={"u1": u1, "u2": u2, "offset": offset, "limit": limit}, timeout=5)
+
+    async def load_new(self, u1, u2, last_id):
+        return await self.get_list("/messages/load", "messages",
+                                   params={"u1": u1, "u2": u2, "last_id": last_id}, timeout=5)
+
+    async def set_typing(self, user, target, status):
+        return await self.post("/messages/typing", json={"user": user, "target": target, "status": status}, timeout=2)
+
+    async def typing(self, user, me):
+        return await self.get_json("/messages/typing", params={"user": user, "me": me}, timeout=2)
+
+    async def clear_chat(self, me, target, for_all=False):
+        return await self.post("/messages/clear", json={"me": me, "target": target, "for_all": for_all}, timeout=5)
+
+    async def delete_message(self, mid, for_all, user):
+        return await self.post("/messages/delete_one", json={"id": mid, "for_all": for_all, "user": user}, timeout=5)
+
+    async def edit_message(self, mid, new_text, user):
+        return await self.post("/messages/edit", json={"id": mid, "new_text": new_text, "user": user}, timeout=5)
+
+    async def mark_read(self, user, peer, up_to):
+        return await self.post("/messages/read", json={"user": user, "peer": peer, "up_to": up_to}, timeout=5)
+
+    async def fetch_bytes(self, url, timeout=10, headers=None) -> bytes:
+        """Локальный файл, файл сервера или стороннего сайта (через дисковый кэш); b"" при ошибке."""
+        if not url:
+            return b""
+        target = str(url)
+        try:
+            if os.path.exists(target):
+                return await self._disk(_read_file, target)
+            if not target.startswith(("/", "http")):
+                return b""
+            return await self.fetch_cached(target, timeout, headers)
+        except Exception:
+            return b""
+
+    async def fetch_cached(self, url, timeout=5, headers=None) -> bytes:
+        """Свежая копия из дискового кэша отдается без сети, устаревшая перепроверяется
+        по If-None-Match. Диск читается в пуле планировщика, чтобы не держать цикл."""
+        if not url:
+            return b""
+        url = api.url(url)
+        entry = await self._disk(disk_cache.lookup, url)
+        if entry and entry.fresh:
+            body = await self._disk(disk_cache.read, entry)
+            if body is not None:
+                return body
+            entry = None
+        headers = dict(headers or {})
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        try:
+            # Загрузок одновременно не больше MEDIA_SLOTS; видимые проходят вперед
+            r = await self.request("GET", url, headers=headers, timeout=timeout, media=True)
+        except Exception:
+            # Сеть недоступна — устаревшая копия лучше, чем ничего
+            return (await self._disk(disk_cache.read, entry) or b"") if entry else b""
+        if r.status_code == 304 and entry:
+            await self._disk(disk_cache.revalidated, url, r.headers)
+            return await self._disk(disk_cache.read, entry) or b""
+        if r.status_code != 200:
+            return b""
+        try:
+            await self._disk(disk_cache.store, url, r.content, r.headers)
+        except OSError:
+            pass
+        return r.content
+
+    async def decode(self, data, size=None, mode=Qt.KeepAspectRatioByExpanding) -> decoder.Decoded:
+        """Декодирование в пуле планировщика; size — (w, h) в физических пикселях."""
+        return await asyncio.get_running_loop().run_in_executor(scheduler.decode, decoder.decode, data, size, mode)
+
+    async def fetch_decoded(self, url, size=None, mode=Qt.KeepAspectRatioByExpanding,
+                            timeout=10, headers=None) -> decoder.Decoded:
+        data = await self.fetch_bytes(url, timeout, headers)
+        return await self.decode(data, size, mode)
+
+    async def fetch_image(self, url, size=None, mode=Qt.KeepAspectRatioByExpanding, timeout=10, headers=None):
+        """QImage (для анимации — первый кадр) или None."""
+        data = await self.fetch_bytes(url, timeout, headers)
+        if not data:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(scheduler.decode, decoder.decode_image, data, size, mode)
+
+    async def fetch_thumbnail(self, url, size, mode=Qt.KeepAspectRatio, timeout=10) -> decoder.Decoded:
+        """Миниатюра size из дискового кэша миниатюр; при промахе декодируется из оригинала
+        и сохраняется, чтобы в следующий раз не трогать оригинал вовсе. GIF — оригиналом."""
+        key = f"thumb:{api.url(str(url))}@{size[0]}x{size[1]}"
+        if os.path.exists(str(url)):
+            # Локальный файл мог измениться — версия по времени изменения
+            key += f"#{int(os.path.getmtime(str(url)))}"
+        body = await self._disk(disk_cache.get, key)
+        if body:
+            r = await self.decode(body)
+            if r.image is not None:
+                return r
+        r = await self.fetch_decoded(url, size, mode, timeout)
+        if r.image is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                data = await loop.run_in_executor(scheduler.decode, decoder.encode_thumbnail, r.image)
+                await self._disk(disk_cache.put, key, data, THUMB_TTL)
+            except OSError:
+                pass
+        return r
+
+net = AsyncNet()
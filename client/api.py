@@ -0,0 +1,346 @@
+import collections
+import concurrent.futures
+import random
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+
+# Единый HTTP-клиент приложения: один пул соединений с keep-alive к серверу
+# (рукопожатие TLS с самоподписанным сертификатом — раз на соединение, а не на запрос),
+# адрес сервера в одном месте и точки расширения для авторизации, кэша и метрик.
+# Картинки кэшируются на диске (client/diskcache.py).
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+DEFAULT_URL = "https://localhost:8001"
+DEFAULT_PORT = 8001
+# (соединение, чтение) по умолчанию; методы ниже задают свои
+DEFAULT_TIMEOUT = (3.05, 10)
+# Потоков, одновременно ходящих в сеть, немного (пул API client.scheduler)
+POOL_SIZE = 16
+
+def normalize_url(raw: str) -> str:
+    """"host" -> "https://host:8001"; схема и порт сохраняются, если указаны."""
+    url = (raw or "").strip() or "localhost"
+    if not url.startswith("http"):
+        url = f"https://{url}"
+    url = url.rstrip("/")
+    if url.count(":") < 2:
+        url = f"{url}:{DEFAULT_PORT}"
+    return url
+
+def retry_delay(headers, attempt, base=0.5, cap=10.0) -> float:
+    """Пауза перед повтором: не раньше Retry-After, экспоненциальный рост с "полным" джиттером."""
+    try:
+        ra = float(headers.get("Retry-After", ""))
+    except ValueError:
+        ra = 0.0
+    exp = random.uniform(0, min(cap, base * (2 ** attempt)))
+    return min(cap, max(ra, 0.0) * random.uniform(1.0, 1.5) + exp)
+
+def retry_budget(timeout):
+    """Сколько всего можно проспать между повторами: не дольше таймаута чтения самого вызова.
+    None — таймаута нет, ограничивает только число повторов."""
+    if isinstance(timeout, tuple):
+        timeout = timeout[-1]
+    try:
+        return None if timeout is None else float(timeout)
+    except (TypeError, ValueError):
+        return None
+
+class BackoffAdapter(HTTPAdapter):
+    """Повторяет запрос при 429/503, выдерживая Retry-After сервера со случайным разбросом,
+    чтобы клиенты, отброшенные одновременно, не вернулись одной волной.
+    POST повторяется при 429 (сервер отклонил его до выполнения), а с заголовком
+    Idempotency-Key — и при 503: повтор с тем же ключом не создаст дубль.
+    Паузы вместе не длиннее таймаута вызова: если сервер просит ждать дольше,
+    вызывающему сразу отдается его 429/503."""
+    RETRY_STATUS = (429, 503)
+
+    def __init__(self, retries=2, base=0.5, cap=10.0, **kw):
+        super().__init__(**kw)
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+
+    def send(self, request, **kw):
+        r = super().send(request, **kw)
+        attempt = 0
+        budget = retry_budget(kw.get("timeout"))
+        while r.status_code in self.RETRY_STATUS and attempt < self.retries:
+            if request.method not in ("GET", "HEAD") and r.status_code != 429 \
+                    and "Idempotency-Key" not in request.headers:
+                break
+            delay = retry_delay(r.headers, attempt, self.base, self.cap)
+            if budget is not None:
+                if delay > budget:
+                    break
+                budget -= delay
+            time.sleep(delay)
+            attempt += 1
+            r.close()
+            r = super().send(request, **kw)
+        return r
+
+class ApiStats:
+    """Счетчики по пути запроса: число, ошибки, суммарное время, сэкономленные
+    (присоединенные к уже идущему) запросы. Подключается как хук."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = collections.defaultdict(lambda: [0, 0, 0.0, 0])
+
+    def __call__(self, method, path, response, elapsed):
+        with self._lock:
+            e = self._data[f"{method} {path}"]
+            e[0] += 1
+            if response is None or response.status_code >= 400:
+                e[1] += 1
+            e[2] += elapsed
+
+    def coalesced(self, method, path):
+        with self._lock:
+            self._data[f"{method} {path}"][3] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: {"count": n, "errors": err, "avg_ms": round(t / n * 1000, 1) if n else 0.0,
+                        "coalesced": c}
+                    for k, (n, err, t, c) in self._data.items()}
+
+def _freeze(v):
+    if isinstance(v, dict):
+        return tuple(sorted((str(k), _freeze(x)) for k, x in v.items()))
+    if isinstance(v, (list, tuple)):
+        return tuple(_freeze(x) for x in v)
+    return v
+
+def flight_key(method, url, kw):
+    """Ключ совмещения: метод + адрес + параметры (+ заголовки: условный запрос
+    с другим If-None-Match — другой запрос). None — запрос не совмещается."""
+    if method != "GET" or not set(kw) <= {"params", "headers"}:
+        return None
+    return (method, url, _freeze(kw.get("params")), _freeze(kw.get("headers")))
+
+class SingleFlight:
+    """Одинаковые GET, идущие одновременно, выполняются одним запросом:
+    первый вызов идет в сеть, остальные ждут его результат (или его исключение)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # ключ -> Future
+
+    def do(self, key, fn):
+        """(результат, совмещен ли вызов с уже идущим)."""
+        with self._lock:
+            f = self._calls.get(key)
+            leader = f is None
+            if leader:
+                f = self._calls[key] = concurrent.futures.Future()
+        if not leader:
+            return f.result(), True
+        try:
+            res = fn()
+        except BaseException as e:
+            f.set_exception(e)
+            raise
+        else:
+            f.set_result(res)
+            return res, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._calls)
+
+class ApiClient:
+    def __init__(self, base_url=DEFAULT_URL, pool_size=POOL_SIZE):
+        self.base_url = normalize_url(base_url)
+        self.session = self._make_session(pool_size, verify=False)
+        # Сторонние сайты (RSS и т.п.): свой пул, сертификаты проверяются
+        self.external = self._make_session(pool_size, verify=True)
+        self.stats = ApiStats()
+        self.inflight = SingleFlight()
+        self._request_hooks = []
+        self._response_hooks = [self.stats]
+
+    @staticmethod
+    def _make_session(pool_size, verify):
+        s = requests.Session()
+        s.verify = verify
+        adapter = BackoffAdapter(pool_connections=4, pool_maxsize=pool_size)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        return s
+
+    # --- настройка ---
+    def set_base_url(self, raw: str) -> str:
+        url = normalize_url(raw)
+        if url != self.base_url:
+            # Соединения к старому адресу больше не нужны
+            self.session.close()
+            self.session = self._make_session(POOL_SIZE, verify=False)
+            self.base_url = url
+        return self.base_url
+
+    def on_request(self, hook):
+        """hook(method, path, kwargs) — может дополнить заголовки/параметры (авторизация)."""
+        self._request_hooks.append(hook)
+
+    def on_response(self, hook):
+        """hook(method, path, response | None, elapsed_s) — метрики, журнал, кэш."""
+        self._response_hooks.append(hook)
+
+    def url(self, path: str) -> str:
+        """Абсолютный адрес; относительные ссылки сервера ("/user/content/...") дополняются."""
+        if not path:
+            return ""
+        if path.startswith("http"):
+            return path
+        return f"{self.base_url}{path if path.startswith('/') else '/' + path}"
+
+    # --- транспорт ---
+    def request(self, method, path, timeout=DEFAULT_TIMEOUT, **kw) -> requests.Response:
+        for hook in self._request_hooks:
+            hook(method, path, kw)
+        key = flight_key(method, self.url(path), kw)
+        if key is None:
+            return self._send(method, path, timeout, kw)
+        # Ответ без stream=True уже прочитан целиком, его можно отдать нескольким потокам
+        r, shared = self.inflight.do(key, lambda: self._send(method, path, timeout, kw))
+        if shared:
+            self.stats.coalesced(method, path.split("?", 1)[0])
+        return r
+
+    def _send(self, method, path, timeout, kw) -> requests.Response:
+        t0 = time.perf_counter()
+        r = None
+        try:
+            r = self.session.request(method, self.url(path), timeout=timeout, **kw)
+            return r
+        finally:
+            elapsed = time.perf_counter() - t0
+            for hook in self._response_hooks:
+                try:
+                    hook(method, path.split("?", 1)[0], r, elapsed)
+                except Exception:
+                    pass
+
+    def get(self, path, **kw):
+        return self.request("GET", path, **kw)
+
+    def post(self, path, **kw):
+        return self.request("POST", path, **kw)
+
+    def put(self, path, **kw):
+        return self.request("PUT", path, **kw)
+
+    def delete(self, path, **kw):
+        return self.request("DELETE", path, **kw)
+
+    def get_json(self, path, default=None, **kw):
+        """JSON ответа 200 или default при любой ошибке (сеть, статус, разбор)."""
+        try:
+            r = self.get(path, **kw)
+            if r.status_code == 200:
+                return r.json()
+        except Exception:
+            pass
+        return default
+
+    def get_list(self, path, key, **kw):
+        """Список из ответа {key: [...]}; None — запрос не удался (в отличие от пустого списка)."""
+        j = self.get_json(path, **kw)
+        return None if j is None else j.get(key, [])
+
+    def fetch_bytes(self, url, timeout=10) -> bytes:
+        """Файл с сервера или стороннего сайта; b"" при ошибке."""
+        try:
+            if url.startswith("http") and not url.startswith(self.base_url):
+                r = self.external.get(url, timeout=timeout)
+            else:
+                r = self.get(url, timeout=timeout)
+            return r.content if r.status_code == 200 else b""
+        except Exception:
+            return b""
+
+    # --- конечные точки ---
+    def ping(self):
+        return self.get("/openapi.json", timeout=2)
+
+    def login(self, login, pw):
+        return self.post("/login", json={"login": login, "pw": pw}, timeout=(3.05, 5))
+
+    def register(self, data):
+        return self.post("/register", json=data, timeout=(3.05, 5))
+
+    def profile_info(self, username):
+        return self.get_json("/user/profile_info", params={"username": username}, timeout=3)
+
+    def summary(self, username):
+        return self.get_json("/user/summary", params={"username": username}, timeout=3)
+
+    def profiles(self, names):
+        j = self.get_json("/users/profiles", params={"names": ",".join(names)}, timeout=5)
+        return None if j is None else j.get("profiles", {})
+
+    def update_profile(self, username, status_msg, bio):
+        return self.post("/user/profile_update", json={"username": username, "status_msg": status_msg, "bio": bio}, timeout=5)
+
+    def upload_avatar(self, username, filename, data, mime, timeout=(3.05, 30)):
+        return self.post("/user/avatar/upload", data={"username": username},
+                         files={"file": (filename, data, mime)}, timeout=timeout)
+
+    def delete_avatar(self, username):
+        return self.post("/user/avatar/delete", json={"username": username}, timeout=10)
+
+    def delete_account(self, username, pw):
+        return self.delete("/user/delete", json={"username": username, "pw": pw}, timeout=10)
+
+    def contacts(self, username):
+        return self.get_list("/contacts/list", "contacts", params={"username": username}, timeout=3)
+
+    def friends(self, user):
+        return self.get_list("/friends/list", "friends", params={"user": user}, timeout=3)
+
+    def friend_requests(self, user):
+        return self.get_list("/friends/incoming", "requests", params={"user": user}, timeout=3)
+
+    def blacklist(self, user):
+        return self.get_list("/blacklist/list", "blocked", params={"user": user}, timeout=3)
+
+    def history(self, u1, u2, offset=0, limit=50):
+        return self.get_list("/messages/history", "messages",
+                             params={"u1": u1, "u2": u2, "offset": offset, "limit": limit}, timeout=5)
+
+    def load_new(self, u1, u2, last_id):
+        return self.get_list("/messages/load", "messages",
+                             params={"u1": u1, "u2": u2, "last_id": last_id}, timeout=5)
+
+    def send_message(self, sender, payload, client_key):
+        # Ключ идемпотентности дублируется заголовком — по нему адаптер решает, можно ли повторить POST
+        return self.post("/messages/send", json=payload, params={"sender": sender},
+                         headers={"Idempotency-Key": client_key}, timeout=10)
+
+    def mark_read(self, user, peer, up_to):
+        return self.post("/messages/read", json={"user": user, "peer": peer, "up_to": up_to}, timeout=5)
+
+    def set_typing(self, user, target, status):
+        return self.post("/messages/typing", json={"user": user, "target": target, "status": status}, timeout=2)
+
+    def typing(self, user, me):
+        return self.get_json("/messages/typing", params={"user": user, "me": me}, timeout=2)
+
+    def clear_chat(self, me, target, for_all=False):
+        return self.post("/messages/clear", json={"me": me, "target": target, "for_all": for_all}, timeout=5)
+
+    def delete_message(self, mid, for_all, user):
+        return self.post("/messages/delete_one", json={"id": mid, "for_all": for_all, "user": user}, timeout=5)
+
+    def edit_message(self, mid, new_text, user):
+        return self.post("/messages/edit", json={"id": mid, "new_text": new_text, "user": user}, timeout=5)
+
+api = ApiClient()
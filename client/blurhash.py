@@ -0,0 +1,105 @@
+import math
+from typing import List, Sequence, Tuple
+
+# BlurHash (https://blurha.sh): 20-30 символов в метаданных вложения,
+# из которых получатель рисует размытую заглушку до загрузки картинки.
+# Чистый Python: кодируется из уже уменьшенной копии (32 px), декодируется в крошечную
+# картинку, которую растягивает отрисовка.
+
+_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+_INDEX = {c: i for i, c in enumerate(_CHARS)}
+
+def _enc83(value: int, length: int) -> str:
+    return "".join(_CHARS[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+def _dec83(s: str) -> int:
+    v = 0
+    for c in s:
+        v = v * 83 + _INDEX[c]
+    return v
+
+def _to_linear(v: int) -> float:
+    v = v / 255.0
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+def _to_srgb(v: float) -> int:
+    v = max(0.0, min(1.0, v))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def _sign_pow(v: float, exp: float) -> float:
+    return math.copysign(abs(v) ** exp, v)
+
+def encode(pixels: Sequence[Tuple[int, int, int]], width: int, height: int, cx: int = 4, cy: int = 3) -> str:
+    """pixels — width*height троек RGB построчно."""
+    lin = [(_to_linear(r), _to_linear(g), _to_linear(b)) for r, g, b in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(cx)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(cy)]
+    factors = []
+    for j in range(cy):
+        for i in range(cx):
+            norm = (1.0 if i == 0 and j == 0 else 2.0) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                fy = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * fy
+                    pr, pg, pb = lin[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            factors.append((r * norm, g * norm, b * norm))
+
+    dc, ac = factors[0], factors[1:]
+    out = _enc83((cx - 1) + (cy - 1) * 9, 1)
+    if ac:
+        actual = max(abs(c) for f in ac for c in f)
+        quant = int(max(0, min(82, math.floor(actual * 166 - 0.5))))
+        max_val = (quant + 1) / 166
+        out += _enc83(quant, 1)
+    else:
+        max_val = 1.0
+        out += _enc83(0, 1)
+    out += _enc83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for f in ac:
+        q = [int(max(0, min(18, math.floor(_sign_pow(c / max_val, 0.5) * 9 + 9.5)))) for c in f]
+        out += _enc83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return out
+
+def is_valid(h: str) -> bool:
+    if not h or len(h) < 6 or any(c not in _INDEX for c in h):
+        return False
+    flag = _dec83(h[0])
+    return len(h) == 4 + 2 * ((flag // 9 + 1) * (flag % 9 + 1))
+
+def decode(h: str, width: int, height: int, punch: float = 1.0) -> List[Tuple[int, int, int]]:
+    """width*height троек RGB построчно; ValueError — строка не BlurHash."""
+    if not is_valid(h):
+        raise ValueError("invalid blurhash")
+    flag = _dec83(h[0])
+    ny, nx = flag // 9 + 1, flag % 9 + 1
+    max_val = (_dec83(h[1]) + 1) / 166 * punch
+    dc = _dec83(h[2:6])
+    colors = [(_to_linear(dc >> 16), _to_linear((dc >> 8) & 255), _to_linear(dc & 255))]
+    for k in range(1, nx * ny):
+        v = _dec83(h[4 + k * 2:6 + k * 2])
+        colors.append(tuple(_sign_pow((q - 9) / 9.0, 2.0) * max_val for q in (v // 361, (v // 19) % 19, v % 19)))
+    cos_x = [[math.cos(math.pi * x * i / width) for i in range(nx)] for x in range(width)]
+    cos_y = [[math.cos(math.pi * y * j / height) for j in range(ny)] for y in range(height)]
+    out = []
+    for y in range(height):
+        cy = cos_y[y]
+        for x in range(width):
+            cx = cos_x[x]
+            r = g = b = 0.0
+            for j in range(ny):
+                for i in range(nx):
+                    basis = cx[i] * cy[j]
+                    c = colors[j * nx + i]
+                    r += c[0] * basis
+                    g += c[1] * basis
+                    b += c[2] * basis
+            out.append((_to_srgb(r), _to_srgb(g), _to_srgb(b)))
+    return out
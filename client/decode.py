@@ -0,0 +1,99 @@
+from typing import NamedTuple, Optional
+
+from PySide6.QtCore import Qt, QBuffer, QByteArray, QIODevice, QSize
+from PySide6.QtGui import QImage, QImageReader
+
+from client import blurhash
+
+# Декодирование картинок вне GUI-потока и сразу в нужном размере.
+# QImageReader.setScaledSize уменьшает при чтении (JPEG — прямо в декодере),
+# поэтому аватар 40 px из фотографии 4000x3000 не проходит через 48 МБ пикселей.
+# Здесь только QImage: QPixmap создается в GUI-потоке (QPixmap.fromImage), как требует Qt.
+# Потоки — пул декодирования client.scheduler.
+
+# Сторона уменьшенной копии для BlurHash и размер декодированной заглушки
+BLURHASH_SAMPLE = 32
+PLACEHOLDER_SIZE = 16
+
+class Decoded(NamedTuple):
+    image: Optional[QImage]  # статичная картинка (None — не распознана или анимация)
+    raw: bytes               # исходные байты анимации для QMovie, иначе b""
+
+def is_animated(data: bytes) -> bool:
+    return data[:6].startswith(b'GIF') or b'WEBPVP8' in data[:20]
+
+def decode_image(data: bytes, size=None, mode=Qt.KeepAspectRatioByExpanding) -> Optional[QImage]:
+    """size — (w, h) в физических пикселях; картинка уменьшается до заполнения (по умолчанию)
+    или вписывания (Qt.KeepAspectRatio), но не увеличивается."""
+    if not data:
+        return None
+    buf = QBuffer()
+    buf.setData(QByteArray(data))
+    buf.open(QIODevice.ReadOnly)
+    reader = QImageReader(buf)
+    reader.setAutoTransform(True)
+    if size is not None:
+        src = reader.size()
+        if src.isValid():
+            target = src.scaled(QSize(*size), mode)
+            if target.width() < src.width() and not target.isEmpty():
+                reader.setScaledSize(target)
+    img = reader.read()
+    buf.close()
+    return None if img.isNull() else img
+
+def decode(data: bytes, size=None, mode=Qt.KeepAspectRatioByExpanding) -> Decoded:
+    if not data:
+        return Decoded(None, b"")
+    if is_animated(data):
+        return Decoded(None, data)
+    return Decoded(decode_image(data, size, mode), b"")
+
+def encode_thumbnail(img: QImage) -> bytes:
+    """Готовая миниатюра для дискового кэша: JPEG, с прозрачностью — PNG."""
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    if img.hasAlphaChannel():
+        img.save(buf, "PNG")
+    else:
+        img.save(buf, "JPEG", 85)
+    return bytes(buf.data())
+
+def blurhash_of(path: str) -> Optional[str]:
+    """BlurHash локального файла; читается сразу уменьшенная копия."""
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    src = reader.size()
+    if not src.isValid():
+        return None
+    target = src.scaled(QSize(BLURHASH_SAMPLE, BLURHASH_SAMPLE), Qt.KeepAspectRatio)
+    if target.isEmpty():
+        return None
+    reader.setScaledSize(target)
+    img = reader.read()
+    if img.isNull():
+        return None
+    img = img.convertToFormat(QImage.Format_RGB32)
+    w, h = img.width(), img.height()
+    px = []
+    for y in range(h):
+        for x in range(w):
+            p = img.pixel(x, y)
+            px.append(((p >> 16) & 255, (p >> 8) & 255, p & 255))
+    return blurhash.encode(px, w, h)
+
+def placeholder_image(h: str, width: int = 0, height: int = 0) -> Optional[QImage]:
+    """Размытая заглушка из BlurHash; крошечная — растягивает ее отрисовка.
+    width/height — пропорции картинки, если известны."""
+    if not blurhash.is_valid(h):
+        return None
+    w = hgt = PLACEHOLDER_SIZE
+    if width > 0 and height > 0:
+        if width >= height:
+            hgt = max(1, round(PLACEHOLDER_SIZE * height / width))
+        else:
+            w = max(1, round(PLACEHOLDER_SIZE * width / height))
+    img = QImage(w, hgt, QImage.Format_RGB32)
+    for i, (r, g, b) in enumerate(blurhash.decode(h, w, hgt)):
+        img.setPixel(i % w, i // w, 0xFF000000 | (r << 16) | (g << 8) | b)
+    return img
@@ -0,0 +1,258 @@
+import hashlib
+import mmap
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple, Optional
+
+from PySide6.QtCore import QStandardPaths
+
+# Дисковый HTTP-кэш картинок (аватары, лента, вложения): переживает перезапуск клиента.
+#   * индекс — sqlite (адрес -> хэш содержимого, ETag, срок свежести, время доступа);
+#   * тела — файлы objects/<2>/<sha256>: одинаковые картинки по разным адресам хранятся один раз;
+#   * свежая запись отдается без сети, устаревшая перепроверяется условным запросом;
+#   * объем ограничен, вытеснение LRU — в фоновом потоке, не на пути запроса.
+
+MAX_BYTES = 256 * 1024 * 1024
+# Больше — видео и архивы, им в кэше картинок не место
+MAX_ENTRY = 16 * 1024 * 1024
+# Без Cache-Control/Expires/Last-Modified — сутки (эвристическая свежесть)
+HEURISTIC_TTL = 24 * 3600
+COMPACT_INTERVAL = 300
+# Вытеснение до 90% лимита, чтобы не запускать его на каждую запись у границы
+LOW_WATER = 0.9
+
+def default_dir() -> str:
+    base = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation) or os.path.expanduser("~/.cache")
+    return os.path.join(base, "QuantDesktop", "http")
+
+def parse_cache_control(value: str) -> dict:
+    out = {}
+    for part in (value or "").split(","):
+        k, _, v = part.strip().partition("=")
+        if k:
+            out[k.lower()] = v.strip('"')
+    return out
+
+def _http_date(value) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+def expires_at(headers, now: float) -> Optional[float]:
+    """Срок свежести ответа (unix time) или None — ответ хранить нельзя."""
+    cc = parse_cache_control(headers.get("Cache-Control"))
+    if "no-store" in cc:
+        return None
+    if "no-cache" in cc:
+        return now  # хранить можно, но перед выдачей — перепроверка
+    if "max-age" in cc:
+        try:
+            return now + max(0, int(cc["max-age"]))
+        except ValueError:
+            return now
+    exp = _http_date(headers.get("Expires"))
+    if exp is not None:
+        date = _http_date(headers.get("Date")) or now
+        return now + max(0.0, exp - date)
+    lm = _http_date(headers.get("Last-Modified"))
+    if lm is not None:
+        # RFC 9111, 4.2.2: десятая часть возраста ресурса
+        return now + min(HEURISTIC_TTL * 7, max(0.0, (now - lm) / 10))
+    return now + HEURISTIC_TTL
+
+class CacheEntry(NamedTuple):
+    url: str
+    digest: str
+    etag: Optional[str]
+    expires: float
+    size: int
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires > time.time()
+
+class DiskCache:
+    def __init__(self, root: Optional[str] = None, max_bytes: int = MAX_BYTES):
+        self.root = root or default_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._touched = {}   # адрес -> время доступа; в индекс пишется пачкой при уплотнении
+        self._orphans = set()  # хэши, на которые, возможно, больше никто не ссылается
+        self._wake = threading.Event()
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self._db = self._open()
+        self.total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        threading.Thread(target=self._compactor, name="disk_cache", daemon=True).start()
+
+    def _open(self) -> sqlite3.Connection:
+        path = os.path.join(self.root, "index.sqlite")
+        try:
+            return self._init_db(path)
+        except sqlite3.DatabaseError:
+            # Поврежденный индекс: кэш — не данные, начинаем заново вместе с телами
+            shutil.rmtree(os.path.join(self.root, "objects"), ignore_errors=True)
+            os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            return self._init_db(path)
+
+    @staticmethod
+    def _init_db(path) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY, digest TEXT NOT NULL, etag TEXT,
+                expires REAL NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+        return db
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    # --- чтение ---
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._db.execute("SELECT url, digest, etag, expires, size FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is not None:
+                self._touched[url] = time.time()
+        return CacheEntry(*row) if row else None
+
+    def read(self, entry: CacheEntry) -> Optional[bytes]:
+        """Тело записи; None — файл пропал (запись удаляется)."""
+        try:
+            with open(self._path(entry.digest), "rb") as f:
+                if entry.size == 0:
+                    return b""
+                # mmap: страницы подтягиваются ОС прямо из файлового кэша, без промежуточного буфера read()
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mm[:]
+        except (OSError, ValueError):
+            self.remove(entry.url)
+            return None
+
+    def get(self, url: str) -> Optional[bytes]:
+        """Тело свежей записи без обращения к сети."""
+        e = self.lookup(url)
+        return self.read(e) if e and e.fresh else None
+
+    # --- запись ---
+    def store(self, url: str, body: bytes, headers) -> bool:
+        if len(body) > MAX_ENTRY:
+            return False
+        now = time.time()
+        exp = expires_at(headers, now)
+        if exp is None:
+            self.remove(url)
+            return False
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)  # читатель не увидит недописанный файл
+        with self._lock:
+            old = self._db.execute("SELECT digest, size FROM entries WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (url, digest, etag, expires, size, atime) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, digest, headers.get("ETag"), exp, len(body), now))
+            self._touched.pop(url, None)
+            if old:
+                self.total -= old[1]
+                if old[0] != digest:
+                    self._orphans.add(old[0])
+            self.total += len(body)
+            over = self.total > self.max_bytes
+        if over:
+            self._wake.set()
+        return True
+
+    def put(self, key: str, body: bytes, ttl: float) -> bool:
+        """Запись, созданная самим клиентом (миниатюры): свежа ttl секунд, без перепроверки."""
+        return self.store(key, body, {"Cache-Control": f"max-age={int(ttl)}"})
+
+    def revalidated(self, url: str, headers):
+        """Ответ 304: запись снова свежа (новый срок, возможно новый ETag)."""
+        now = time.time()
+        exp = expires_at(headers, now)
+        with self._lock:
+            if exp is None:
+                self._remove_locked(url)
+                return
+            self._db.execute("UPDATE entries SET expires = ?, etag = COALESCE(?, etag), atime = ? WHERE url = ?",
+                             (exp, headers.get("ETag"), now, url))
+
+    def remove(self, url: str):
+        with self._lock:
+            self._remove_locked(url)
+
+    def _remove_locked(self, url):
+        row = self._db.execute("SELECT digest, size FROM entries WHERE url = ?", (url,)).fetchone()
+        if row:
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+            self.total -= row[1]
+            self._orphans.add(row[0])
+        self._touched.pop(url, None)
+
+    # --- уплотнение ---
+    def _compactor(self):
+        while True:
+            self._wake.wait(COMPACT_INTERVAL)
+            self._wake.clear()
+            try:
+                self.compact()
+            except Exception:
+                traceback.print_exc()
+
+    def compact(self):
+        with self._lock:
+            if self._touched:
+                self._db.executemany("UPDATE entries SET atime = ? WHERE url = ?",
+                                     [(t, u) for u, t in self._touched.items()])
+                self._touched.clear()
+            target = int(self.max_bytes * LOW_WATER)
+            while self.total > target:
+                rows = self._db.execute("SELECT url, digest, size FROM entries ORDER BY atime LIMIT 64").fetchall()
+                if not rows:
+                    break
+                # Пачка — только для выборки: вытесняется ровно столько, сколько нужно до target
+                evicted = []
+                for url, digest, size in rows:
+                    if self.total <= target:
+                        break
+                    evicted.append((url,))
+                    self.total -= size
+                    self._orphans.add(digest)
+                self._db.executemany("DELETE FROM entries WHERE url = ?", evicted)
+            orphans, self._orphans = self._orphans, set()
+            dead = [d for d in orphans
+                    if self._db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (d,)).fetchone() is None]
+        # Файлы удаляются вне блокировки; запись, успевшая сослаться на удаленный хэш,
+        # при чтении не найдет файл, будет удалена, и картинка скачается заново
+        for d in dead:
+            try:
+                os.remove(self._path(d))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            n = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": n, "bytes": self.total, "max_bytes": self.max_bytes}
+
+disk_cache = DiskCache()
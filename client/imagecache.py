@@ -0,0 +1,108 @@
+import hashlib
+from collections import OrderedDict
+
+from PySide6.QtCore import Qt, QSettings, QSize
+from PySide6.QtGui import QPixmap, QPixmapCache
+
+# Общий для всего клиента кэш декодированных картинок (аватары, лента, чаты, просмотр).
+# Пиксмапы лежат в QPixmapCache — один бюджет памяти с остальными пользователями
+# QPixmapCache (стили Qt); здесь — LRU с учетом веса в байтах и счетчики.
+# Работает только из GUI-потока, как и сам QPixmapCache.
+#
+# Ключ — адрес или хэш содержимого плюс размер, в котором картинка показывается:
+# аватар 40 px не держит в памяти оригинал 4K, а повторный показ по адресу
+# не требует ни скачивания, ни декодирования. Декодирует client/decode.py — вне GUI-потока.
+
+DEFAULT_BUDGET_MB = 96
+# Одна картинка не должна вытеснять больше четверти кэша
+MAX_ENTRY_SHARE = 4
+
+def content_key(data: bytes) -> str:
+    return "sha:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def image_key(source, size=None) -> str:
+    """source — адрес или сами байты; size — (w, h) или QSize в физических пикселях, None — оригинал."""
+    if isinstance(source, (bytes, bytearray)):
+        source = content_key(source)
+    if size is None:
+        return f"img:{source}"
+    if isinstance(size, QSize):
+        size = (size.width(), size.height())
+    return f"img:{source}@{size[0]}x{size[1]}"
+
+def pixmap_cost(pm: QPixmap) -> int:
+    return pm.width() * pm.height() * max(pm.depth(), 8) // 8
+
+def widget_px_size(w) -> tuple:
+    """Размер виджета в физических пикселях экрана."""
+    dpr = w.devicePixelRatioF()
+    return round(w.width() * dpr), round(w.height() * dpr)
+
+class ImageCache:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            inst = super().__new__(cls)
+            inst._lru = OrderedDict()  # ключ -> вес, байт
+            inst._bytes = 0
+            inst.hits = inst.misses = inst.evictions = 0
+            try:
+                mb = int(QSettings("QuantProject", "QuantDesktop").value("image_cache_mb", DEFAULT_BUDGET_MB))
+            except (TypeError, ValueError):
+                mb = DEFAULT_BUDGET_MB
+            inst.budget = 0
+            inst.set_budget(mb * 1024 * 1024)
+            cls._instance = inst
+        return cls._instance
+
+    def set_budget(self, nbytes: int):
+        self.budget = max(8 * 1024 * 1024, int(nbytes))
+        QPixmapCache.setCacheLimit(self.budget // 1024)
+        self._shrink()
+
+    def find(self, key: str):
+        if key in self._lru:
+            pm = QPixmapCache.find(key)
+            if pm is not None and not pm.isNull():
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return pm
+            # Вытеснен самим Qt: бюджет общий с другими пользователями QPixmapCache
+            self._bytes -= self._lru.pop(key)
+            self.evictions += 1
+        self.misses += 1
+        return None
+
+    def insert(self, key: str, pm: QPixmap) -> QPixmap:
+        if pm is None or pm.isNull():
+            return pm
+        cost = pixmap_cost(pm)
+        if cost > self.budget // MAX_ENTRY_SHARE or not QPixmapCache.insert(key, pm):
+            return pm
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._bytes -= old
+        self._lru[key] = cost
+        self._bytes += cost
+        self._shrink()
+        return pm
+
+    def _shrink(self):
+        while self._bytes > self.budget and self._lru:
+            k, c = self._lru.popitem(last=False)
+            QPixmapCache.remove(k)
+            self._bytes -= c
+            self.evictions += 1
+
+    def remove(self, key: str):
+        c = self._lru.pop(key, None)
+        if c is not None:
+            QPixmapCache.remove(key)
+            self._bytes -= c
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._lru), "bytes": self._bytes, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
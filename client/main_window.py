@@ -1,8 +1,8 @@
 from PySide6.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QStackedWidget
-from PySide6.QtCore import QTimer, QCoreApplication, QThreadPool
+from PySide6.QtCore import QTimer, QCoreApplication
 from client.widgets.auth_forms import AuthPage
 from client.widgets.lanchat_page import LanChatWidget, LanSetupWidget, LanWorker
-from client.widgets.messages_page.network import ThreadPoolManager
+from client.scheduler import scheduler
 from client.widgets.sidebar import Sidebar
 from client.widgets.content_area import ContentArea
 
@@ -72,11 +72,8 @@ class MainWindow(QMainWindow):
     def _destroy_session(self):
         """Единый метод тотальной зачистки интерфейса и потоков."""
         
-        # 1. Отменяем сетевые задачи чата
-        ThreadPoolManager().clear_all_tasks()
-        
-        # 2. Чистим глобальный пул Qt (Runnable)
-        QThreadPool.globalInstance().clear()
+        # 1-2. Отменяем все задачи сессии: очереди пулов планировщика и загрузки в цикле сети
+        scheduler.new_session()
         
         # 3. LAN
         if hasattr(self, 'lan_worker'):
@@ -0,0 +1,276 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import traceback
+import weakref
+
+# Планировщик фоновой работы клиента.
+#   * отдельные ограниченные пулы: API (блокирующие запросы), декодирование, диск;
+#     загрузки медиа — слоты в цикле client.aio. Медленная лента RSS не занимает
+#     потоки, нужные истории открытого чата, а декодирование не ждет за сетью;
+#   * приоритеты: видимое > предзагрузка > фон. Очередь каждого пула — куча по приоритету,
+#     фоновым задачам всегда оставлен хотя бы один свободный поток;
+#   * каждая задача несет токен отмены: сессия -> виджет/чат -> отдельная загрузка.
+#     Отмена снимает задачи из очередей и обрывает загрузки в цикле сети;
+#     уже выполняющийся блокирующий запрос дорабатывает, но его результат никому не нужен.
+
+VISIBLE, PREFETCH, BACKGROUND = 0, 1, 2
+
+# Приоритет текущей корутины; задачи, порожденные ею (диск, декодирование, загрузка), его наследуют
+current_priority = contextvars.ContextVar("current_priority", default=VISIBLE)
+
+API_WORKERS = 4
+DISK_WORKERS = 2
+DECODE_WORKERS = max(2, min(4, (os.cpu_count() or 2) - 1))
+# Одновременных загрузок медиа; остальные ждут в очереди по приоритету
+MEDIA_SLOTS = 8
+
+class CancelToken:
+    """Отмена группы задач. Дочерний токен отменяется вместе с родителем."""
+    def __init__(self, parent=None):
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._children = weakref.WeakSet()
+        self.cancelled = False
+        if parent is not None:
+            parent._adopt(self)
+
+    def _adopt(self, child):
+        with self._lock:
+            if not self.cancelled:
+                self._children.add(child)
+                return
+        child.cancel()
+
+    def child(self) -> "CancelToken":
+        return CancelToken(self)
+
+    def add(self, fut):
+        """Привязывает concurrent.futures.Future; у отмененного токена он отменяется сразу."""
+        with self._lock:
+            cancelled = self.cancelled
+            if not cancelled:
+                self._futures.add(fut)
+        if cancelled:
+            fut.cancel()
+            return
+        # Вне блокировки: у завершенного Future колбэк вызывается немедленно
+        fut.add_done_callback(self._discard)
+
+    def _discard(self, fut):
+        with self._lock:
+            self._futures.discard(fut)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            futs, self._futures = list(self._futures), set()
+            children = list(self._children)
+            self._children = weakref.WeakSet()
+        for f in futs:
+            f.cancel()
+        for c in children:
+            c.cancel()
+
+class PriorityPool(concurrent.futures.Executor):
+    """Ограниченный пул потоков с очередью по приоритету.
+    Потоки создаются по мере надобности и живут до конца процесса."""
+    def __init__(self, name, workers, background_slots=None):
+        self.name = name
+        self.workers = workers
+        # Фону — не больше workers-1 потоков: видимой задаче всегда найдется место
+        self.background_slots = background_slots or max(1, workers - 1)
+        self._cv = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._threads = []
+        self._idle = 0
+        self._busy_bg = 0
+        self._shutdown = False
+        self.submitted = self.completed = self.cancelled = 0
+
+    def run(self, fn, *args, priority=None, token=None, **kwargs) -> concurrent.futures.Future:
+        if priority is None:
+            priority = current_priority.get()
+        fut = concurrent.futures.Future()
+        with self._cv:
+            if self._shutdown:
+                raise RuntimeError(f"{self.name}: pool is shut down")
+            heapq.heappush(self._heap, (priority, next(self._seq), fut, fn, args, kwargs))
+            self.submitted += 1
+            # Новый поток — когда очередь длиннее числа простаивающих (как _adjust_thread_count
+            # в ThreadPoolExecutor); иначе пачка задач шла бы по одной через единственный свободный поток
+            if len(self._heap) > self._idle and len(self._threads) < self.workers:
+                t = threading.Thread(target=self._worker, name=f"{self.name}_{len(self._threads)}", daemon=True)
+                self._threads.append(t)
+                t.start()
+            self._cv.notify()
+        if token is not None:
+            token.add(fut)
+        return fut
+
+    def submit(self, fn, *args, **kwargs):
+        # Интерфейс Executor (loop.run_in_executor): приоритет — из контекста вызывающего
+        return self.run(fn, *args, priority=current_priority.get(), token=None, **kwargs)
+
+    def start(self, runnable, priority=VISIBLE, token=None):
+        """QRunnable вместо QThreadPool.globalInstance().start()."""
+        def run():
+            # Как в QThreadPool: исключение воркера печатается, а не теряется в Future
+            try:
+                runnable.run()
+            except Exception:
+                traceback.print_exc()
+        return self.run(run, priority=priority, token=token)
+
+    def _next(self):
+        # Вызывается под self._cv. Отмененные задачи выбрасываются из головы кучи
+        while self._heap:
+            item = self._heap[0]
+            if item[2].cancelled():
+                heapq.heappop(self._heap)
+                self.cancelled += 1
+                continue
+            # В голове кучи фон — значит, в очереди только фон
+            if item[0] >= BACKGROUND and self._busy_bg >= self.background_slots:
+                return None
+            return heapq.heappop(self._heap)
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while True:
+                    item = self._next()
+                    if item is not None:
+                        break
+                    if self._shutdown:
+                        return
+                    self._idle += 1
+                    self._cv.wait()
+                    self._idle -= 1
+                bg = item[0] >= BACKGROUND
+                if bg:
+                    self._busy_bg += 1
+            prio, _, fut, fn, args, kwargs = item
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        fut.set_exception(e)
+            finally:
+                with self._cv:
+                    self.completed += 1
+                    if bg:
+                        self._busy_bg -= 1
+                        self._cv.notify()
+            del item, fut, fn, args, kwargs
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._cv:
+            self._shutdown = True
+            if cancel_futures:
+                for item in self._heap:
+                    item[2].cancel()
+                self._heap.clear()
+            self._cv.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"workers": len(self._threads), "max_workers": self.workers, "queued": len(self._heap),
+                    "submitted": self.submitted, "completed": self.completed, "cancelled": self.cancelled}
+
+class PrioritySlots:
+    """Семафор для корутин с очередью по приоритету. Только из потока цикла."""
+    def __init__(self, slots):
+        self.slots = slots
+        self._free = slots
+        self._waiters = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority=None):
+        if priority is None:
+            priority = current_priority.get()
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот уже передан, а ждавший отменен — отдаем следующему
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def stats(self) -> dict:
+        return {"slots": self.slots, "free": self._free, "waiting": len(self._waiters)}
+
+class Scheduler:
+    def __init__(self):
+        self.api = PriorityPool("api", API_WORKERS)
+        self.decode = PriorityPool("img_decode", DECODE_WORKERS)
+        self.disk = PriorityPool("disk_io", DISK_WORKERS)
+        self.media = PrioritySlots(MEDIA_SLOTS)
+        self.session = CancelToken()
+        self._lock = threading.Lock()
+        self._owners = {}  # id(владельца) -> токен
+
+    def new_session(self):
+        """Выход из аккаунта: все задачи прежней сессии отменяются."""
+        with self._lock:
+            old, self.session = self.session, CancelToken()
+            self._owners.clear()
+        old.cancel()
+
+    def token_for(self, owner) -> CancelToken:
+        """Токен виджета (QObject): отменяется, когда виджет удален или закончилась сессия."""
+        key = id(owner)
+        with self._lock:
+            tok = self._owners.get(key)
+            if tok is not None and not tok.cancelled:
+                return tok
+            fresh = tok is None
+            tok = self._owners[key] = self.session.child()
+        if fresh:
+            # Подписка одна на владельца; при срабатывании берется текущий токен
+            owner.destroyed.connect(lambda *_, k=key: self._drop(k))
+        return tok
+
+    def _drop(self, key):
+        with self._lock:
+            tok = self._owners.pop(key, None)
+        if tok is not None:
+            tok.cancel()
+
+    def stats(self) -> dict:
+        return {"api": self.api.stats(), "decode": self.decode.stats(),
+                "disk": self.disk.stats(), "media": self.media.stats()}
+
+scheduler = Scheduler()
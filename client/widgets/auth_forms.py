@@ -1,5 +1,3 @@
-import requests
-import urllib3
 import logging
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
@@ -7,7 +5,7 @@ from PySide6.QtWidgets import (
     QCheckBox, QSizePolicy, QDialog, QGraphicsDropShadowEffect
 )
 from PySide6.QtCore import (
-    Signal, Qt, QThread, QObject, QSettings, QRect, QSize
+    Signal, Qt, QSettings, QRect, QSize
 )
 from PySide6.QtGui import (
     QAction, QPainter, QPainterPath, QColor, QPen, QLinearGradient, QBrush, QFontMetrics
@@ -18,75 +16,25 @@ from client.styles import (
     SVG_EYE_OPEN, SVG_EYE_CLOSED,
     BORDER_INPUT, BORDER_FOCUS, ACCENT_COLOR, TEXT_WHITE
 )
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-API_URL = "https://localhost:8001"
+from client.api import api, DEFAULT_PORT
+from client.aio import net
 
-def update_global_api_url(new_url):
-    global API_URL
-    new_url = new_url.strip()
-    if not new_url.startswith("http"):
-        new_url = f"https://{new_url}"
-    if new_url.count(":") < 2:
-        if new_url.endswith("/"): new_url = new_url[:-1]
-        new_url = f"{new_url}:8001"
-    if new_url.endswith("/"): new_url = new_url[:-1]
-    API_URL = new_url
+async def network_task(task_type, data=None):
+    """Проверка сервера, вход, регистрация в цикле сети; результат — словарь для обработчика формы."""
+    res = {"success": False, "msg": "", "code": 0}
     try:
-        import client.widgets.friends_page
-        client.widgets.friends_page.API_URL = new_url
-    except ImportError: pass
-    try:
-        import client.widgets.settings_page
-        client.widgets.settings_page.API_URL = new_url
-    except ImportError: pass
-    try:
-        import client.widgets.messages_page.network
-        client.widgets.messages_page.network.API_URL = new_url
-    except ImportError: pass
-    try:
-        import client.widgets.media_page
-        client.widgets.media_page.API_URL = new_url
-    except ImportError: pass
-    try:
-        import client.widgets.profile_page
-        client.widgets.profile_page.API_URL = new_url
-    except ImportError: pass
-    try:
-        import client.widgets.sidebar
-        client.widgets.sidebar.API_URL = new_url
-    except ImportError: pass
-    return API_URL
-
-class NetworkWorker(QObject):
-    finished = Signal(dict)
-    
-    def __init__(self, task_type, url, data=None):
-        super().__init__()
-        self.task_type = task_type
-        self.url = url
-        self.data = data
-
-    def run(self):
-        res = {"success": False, "msg": "", "code": 0}
-        try:
-            if self.task_type == "ping":
-                r = requests.get(f"{self.url}/openapi.json", verify=False, timeout=2)
-                res["code"] = r.status_code
-                if r.status_code == 200:
-                    res["success"] = True
-            elif self.task_type == "login":
-                r = requests.post(f"{self.url}/login", json=self.data, verify=False, timeout=4)
-                res["code"] = r.status_code
-                if r.status_code == 200:
-                    res["success"] = True
-            elif self.task_type == "register":
-                r = requests.post(f"{self.url}/register", json=self.data, verify=False, timeout=4)
-                res["code"] = r.status_code
-                if r.status_code == 200:
-                    res["success"] = True
-        except Exception as e:
-            res["msg"] = str(e)
-        self.finished.emit(res)
+        if task_type == "ping":
+            r = await net.ping()
+        elif task_type == "login":
+            r = await net.login(data["login"], data["pw"])
+        else:
+            r = await net.register(data)
+        res["code"] = r.status_code
+        if r.status_code == 200:
+            res["success"] = True
+    except Exception as e:
+        res["msg"] = str(e)
+    return res
 
 class InnerEdit(QLineEdit):
     focus_in = Signal()
@@ -236,7 +184,7 @@ QPushButton:disabled { background-color: #334155; color: #94a3b8; }
         l.addWidget(QLabel("IP-адрес сервера", styleSheet="font-size: 18px; font-weight: 700; color: white;"))
         l.addWidget(QLabel("Укажите адрес сервера для проверки соединения:"))
         self.inp_url = QLineEdit()
-        self.inp_url.setText(API_URL.replace("https://", "").replace(":8001", ""))
+        self.inp_url.setText(api.base_url.replace("https://", "").replace(f":{DEFAULT_PORT}", ""))
         l.addWidget(self.inp_url)
         self.status_bar = QLabel("")
         self.status_bar.setStyleSheet("font-size: 12px; margin-top: 5px;")
@@ -247,19 +195,11 @@ QPushButton:disabled { background-color: #334155; color: #94a3b8; }
         l.addWidget(self.btn_check)
 
     def start_check(self):
-        full_url = update_global_api_url(self.inp_url.text().strip() or "localhost")
+        full_url = api.set_base_url(self.inp_url.text())
         self.btn_check.setEnabled(False); self.btn_check.setText("Проверка...")
         self.status_bar.setText(f"Подключение к {full_url}...")
         self.status_bar.setStyleSheet("color: #fbbf24;")
-        self.thread = QThread()
-        self.worker = NetworkWorker("ping", full_url)
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self.on_check_finished)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+        net.call(network_task("ping"), self.on_check_finished, owner=self)
 
     def on_check_finished(self, res):
         self.btn_check.setEnabled(True); self.btn_check.setText("Проверить и Сохранить")
@@ -355,15 +295,7 @@ class LoginView(QWidget):
         p = self.inp_pass.text().strip()
         if not u or not p: return
         self.btn_enter.setEnabled(False); self.btn_enter.setText("Вход...")
-        self.thread = QThread()
-        self.worker = NetworkWorker("login", API_URL, {"login": u, "pw": p})
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self.on_fin)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+        net.call(network_task("login", {"login": u, "pw": p}), self.on_fin, owner=self)
 
     def on_fin(self, r):
         self.btn_enter.setEnabled(True); self.btn_enter.setText("Войти в систему")
@@ -406,17 +338,9 @@ class RegisterView(QWidget):
         if self.inp_p1.text() != self.inp_p2.text():
             QMessageBox.warning(self,"!","Пароли не совпадают"); return
         self.btn_r.setEnabled(False); self.btn_r.setText("...")
-        self.thread = QThread()
-        self.worker = NetworkWorker("register", API_URL, {
+        net.call(network_task("register", {
             "login": self.inp_l.text(), "email": self.inp_e.text(), "pw": self.inp_p1.text()
-        })
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run)
-        self.worker.finished.connect(self.fin)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+        }), self.fin, owner=self)
 
     def fin(self, r):
         self.btn_r.setEnabled(True); self.btn_r.setText("Зарегистрироваться")
@@ -2,6 +2,8 @@ import hashlib
 from PySide6.QtWidgets import QWidget, QDialog, QPushButton
 from PySide6.QtCore import Qt, QBuffer, Signal, QPoint, QRectF, QPointF
 from PySide6.QtGui import QPixmap, QPainter, QPainterPath, QColor, QPen, QMovie
+from client.aio import net
+from client.imagecache import ImageCache, image_key, widget_px_size
 
 # --- Кнопка закрытия ---
 class CloseBtn(QPushButton):
@@ -53,6 +55,7 @@ class CircularAvatar(QWidget):
         self.bg_col = "#6366f1"
 
         self._movie_frame_updated = False 
+        self._dec = None
         
     def mousePressEvent(self, e):
         if e.button() == Qt.LeftButton:
@@ -60,6 +63,7 @@ class CircularAvatar(QWidget):
         super().mousePressEvent(e)
 
     def set_letter(self, text):
+        self._cancel_decode()
         self.stop_movie()
         self.pixmap = None
         self.raw_data = None
@@ -70,6 +74,7 @@ class CircularAvatar(QWidget):
         self.update()
 
     def set_data(self, data):
+        self._cancel_decode()
         self.raw_data = data 
         
         if data is None: 
@@ -104,11 +109,26 @@ class CircularAvatar(QWidget):
 
     def load_static(self, data):
         self.stop_movie()
-        p = QPixmap()
-        p.loadFromData(data)
-        self.pixmap = p
+        # Общий кэш клиента: один и тот же аватар в списке друзей и в боковой панели декодируется один раз,
+        # в пуле и сразу в размере виджета
+        sz = widget_px_size(self)
+        k = image_key(data, sz)
+        self.pixmap = ImageCache().find(k)
+        if self.pixmap is None:
+            self._dec = net.call(net.decode(data, sz), lambda r, k=k: self._on_decoded(r, k), owner=self)
         self.update()
 
+    def _on_decoded(self, r, k):
+        self._dec = None
+        if r.image is not None:
+            self.pixmap = ImageCache().insert(k, QPixmap.fromImage(r.image))
+            self.update()
+
+    def _cancel_decode(self):
+        if self._dec:
+            self._dec.cancel()
+            self._dec = None
+
     def stop_movie(self):
         if self.movie:
             self.movie.stop()
@@ -1,7 +1,7 @@
 from datetime import time
+import asyncio
 import os
 import json
-import requests
 import feedparser
 import webbrowser
 import math
@@ -15,7 +15,7 @@ from PySide6.QtWidgets import (
     QGraphicsOpacityEffect, QApplication, QToolTip
 )
 from PySide6.QtCore import (
-    Qt, Signal, QThreadPool, QRunnable, QObject,
+    Qt, Signal,
     QTimer, QSize, QPropertyAnimation, QPoint, QEasingCurve,
     QRectF, QPointF
 )
@@ -23,6 +23,9 @@ from PySide6.QtGui import (
     QPixmap, QPainter, QPainterPath, QColor, QCursor,
     QPen, QPalette
 )
+from client.aio import net
+from client.scheduler import scheduler, BACKGROUND
+from client.imagecache import ImageCache, image_key, widget_px_size
 
 FILE_RSS = "rss_sources.json"
 FILE_BOOKMARKS = "bookmarks.json"
@@ -381,29 +384,11 @@ class ImageViewer(QDialog, DraggableDialogMixin):
     def mouseReleaseEvent(self, e):
         self._image_drag = False
 
-class ImgSig(QObject):
-    done = Signal(object, object)
+# Картинки ленты: общий асинхронный загрузчик с дисковым кэшем
+FEED_IMG_HEADERS = {'User-Agent': 'Mozilla/5.0'}
 
-class Loader(QRunnable):
-    def __init__(self, url):
-        super().__init__()
-        self.url = url
-        self.s = ImgSig()
-
-    def run(self):
-        try:
-            if not self.url:
-                self.s.done.emit(None, QPixmap())
-                return
-            r = requests.get(self.url, timeout=5, headers={'User-Agent': 'Mozilla/5.0'})
-            if r.status_code == 200:
-                pix = QPixmap()
-                pix.loadFromData(r.content)
-                self.s.done.emit(self.url, pix)
-            else:
-                self.s.done.emit(self.url, QPixmap())
-        except:
-            self.s.done.emit(self.url, QPixmap())
+def _pixmap(img):
+    return QPixmap.fromImage(img) if img is not None else QPixmap()
 
 class FeedCard(QFrame):
     def __init__(self, data, is_dark_mode=True, parent=None):
@@ -450,9 +435,14 @@ class FeedCard(QFrame):
         img_url = self.data.get('image')
         if img_url and isinstance(img_url, str):
             self.pic.setText("Загрузка...")
-            ld = Loader(img_url)
-            ld.s.done.connect(self.set_pic)
-            QThreadPool.globalInstance().start(ld)
+            # Карточке нужна только миниатюра: декодируется сразу в размере превью
+            sz = widget_px_size(self.pic)
+            cached = ImageCache().find(image_key(img_url, sz))
+            if cached is not None:
+                self.set_pic(img_url, cached)
+            else:
+                net.call(net.fetch_image(img_url, sz, timeout=5, headers=FEED_IMG_HEADERS),
+                         lambda img, u=img_url: self.set_pic(u, _pixmap(img)), owner=self)
         else:
             self.pic.setText("📷")
             self.pic.setStyleSheet(self.pic.styleSheet() + "font-size: 32px; color: #888;")
@@ -479,6 +469,7 @@ class FeedCard(QFrame):
 
     def set_pic(self, url, px):
         if not px or px.isNull(): return
+        ImageCache().insert(image_key(url, widget_px_size(self.pic)), px)
         self.original_pixmap = px
         final = QPixmap(self.pic.size())
         final.fill(Qt.transparent)
@@ -494,7 +485,6 @@ class FeedCard(QFrame):
         p.end()
         self.pic.setPixmap(final)
         self.pic.setText("")
-        self.data['pixmap_cache'] = px
 
     def mousePressEvent(self, e):
         child = self.childAt(e.pos())
@@ -613,16 +603,16 @@ class DetailDialog(QDialog):
         actions.addWidget(btn_browser)
         body_lay.addLayout(actions)
         cl.addWidget(w_body, 1)
-        full_pix = self.data.get('pixmap_cache')
+        full_pix = self.data.get('pixmap_cache') or ImageCache().find(image_key(self.data.get('image') or "", self._header_px()))
         if full_pix and not full_pix.isNull():
             self.set_header_image(full_pix)
         else:
             if self.data.get('image'):
                 self.img_lbl.setText("Загрузка...")
                 self.img_lbl.setFixedHeight(120)
-                l = Loader(self.data.get('image'))
-                l.s.done.connect(lambda u, p: self.set_header_image(p))
-                QThreadPool.globalInstance().start(l)
+                net.call(net.fetch_image(self.data.get('image'), self._header_px(), Qt.KeepAspectRatio,
+                                         timeout=5, headers=FEED_IMG_HEADERS),
+                         lambda img: self._on_header_image(_pixmap(img)), owner=self)
             else:
                 self.img_lbl.hide()
 
@@ -663,6 +653,16 @@ class DetailDialog(QDialog):
             self.btn_close.raise_()
         super().resizeEvent(event)
 
+    def _header_px(self):
+        # Шапка — по ширине окна (до 720 px), высота обрезается; запас по высоте для вертикальных картинок
+        w = round(720 * self.devicePixelRatioF())
+        return w, w * 4
+
+    def _on_header_image(self, px):
+        if px and not px.isNull():
+            ImageCache().insert(image_key(self.data.get('image'), self._header_px()), px)
+        self.set_header_image(px)
+
     def set_header_image(self, px):
         if not px or px.isNull(): return
         self.data['pixmap_cache'] = px
@@ -1010,91 +1010,83 @@ class ManageDialog(DraggableDialogMixin, QDialog):
     def save_all(self):
         self.modified = True; self.accept()
 
-class FeedWorker(QRunnable):
-    def __init__(self, feeds):  # Убрать parent
-        super().__init__()
-        self.feeds = feeds
-        self.sig = ImgSig()
-        self._is_running = True
-
-    def run(self):
-        out = []
-        seen_links = set()
+FEED_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+
+def parse_feed(name, content):
+    """Записи одной ленты (до 10). Разбор RSS и HTML — в пуле декодирования, не в цикле сети."""
+    out = []
+    seen_links = set()
+    d = feedparser.parse(content)
+    for e in d.entries[:10]:
+        link = e.get('link', '')
+        if not link or link in seen_links:
+            continue
+        seen_links.add(link)
+
+        dt = e.get('published_parsed') or e.get('updated_parsed')
+        if not dt:
+            dt = time.gmtime(0)
+
+        img = None
+        if 'media_content' in e:
+            try: 
+                img = e.media_content[0]['url']
+            except: 
+                pass
+        elif 'links' in e:
+            for l in e.links:
+                if l.get('type', '').startswith('image/'):
+                    img = l['href']
+                    break
         
-        if not self._is_running:
-            return
-            
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-
-        for s in self.feeds:
-            if not self._is_running:
-                break
-                
+        summary = e.get('summary', '') or e.get('description', '')
+        if not img:
             try:
-                resp = requests.get(s['url'], headers=headers, timeout=10)
-                if resp.status_code == 200:
-                    d = feedparser.parse(resp.content)
-                    
-                    for e in d.entries[:10]:
-                        if not self._is_running:
-                            break
-                            
-                        link = e.get('link', '')
-                        if not link or link in seen_links:
-                            continue
-                        seen_links.add(link)
-
-                        dt = e.get('published_parsed') or e.get('updated_parsed')
-                        if not dt:
-                            dt = time.gmtime(0)
-
-                        img = None
-                        if 'media_content' in e:
-                            try: 
-                                img = e.media_content[0]['url']
-                            except: 
-                                pass
-                        elif 'links' in e:
-                            for l in e.links:
-                                if l.get('type', '').startswith('image/'):
-                                    img = l['href']
-                                    break
-                        
-                        summary = e.get('summary', '') or e.get('description', '')
-                        if not img:
-                            try:
-                                so = BeautifulSoup(summary, 'html.parser')
-                                tag = so.find('img')
-                                if tag and tag.get('src'):
-                                    img = tag['src']
-                            except:
-                                pass
-                        
-                        try:
-                            clean_text = BeautifulSoup(summary, 'html.parser').get_text()[:150].strip()
-                        except:
-                            clean_text = ""
-
-                        out.append({
-                            'source': s['name'], 
-                            'title': e.get('title', 'Без названия'), 
-                            'link': link,
-                            'summary': summary, 
-                            'summary_clean': clean_text, 
-                            'image': img,
-                            'timestamp': dt
-                        })
-
-            except Exception as e:
-                print(f"[FeedWorker] Ошибка загрузки {s['url']}: {e}")
-
-        out.sort(key=lambda x: x['timestamp'], reverse=True)
+                so = BeautifulSoup(summary, 'html.parser')
+                tag = so.find('img')
+                if tag and tag.get('src'):
+                    img = tag['src']
+            except:
+                pass
         
-        if self._is_running:
-            self.sig.done.emit(out, None)
-
-    def stop(self):
-        self._is_running = False
+        try:
+            clean_text = BeautifulSoup(summary, 'html.parser').get_text()[:150].strip()
+        except:
+            clean_text = ""
+
+        out.append({
+            'source': name, 
+            'title': e.get('title', 'Без названия'), 
+            'link': link,
+            'summary': summary, 
+            'summary_clean': clean_text, 
+            'image': img,
+            'timestamp': dt
+        })
+    return out
+
+async def _load_source(s):
+    try:
+        r = await net.request("GET", s['url'], headers=FEED_HEADERS, timeout=10)
+        if r.status_code != 200:
+            return []
+        return await asyncio.get_running_loop().run_in_executor(scheduler.decode, parse_feed, s['name'], r.content)
+    except Exception as e:
+        print(f"[load_feeds] Ошибка загрузки {s['url']}: {e}")
+        return []
+
+async def load_feeds(feeds):
+    # Ленты качаются одновременно, а не по очереди; повторы ссылок — по порядку источников, как раньше
+    parts = await asyncio.gather(*(_load_source(s) for s in feeds))
+    out = []
+    seen_links = set()
+    for items in parts:
+        for it in items:
+            if it['link'] not in seen_links:
+                seen_links.add(it['link'])
+                out.append(it)
+    out.sort(key=lambda x: x['timestamp'], reverse=True)
+    return out
 
 class FeedPage(QWidget):
     def __init__(self):
@@ -1208,9 +1200,8 @@ class FeedPage(QWidget):
             return
         self.btn_upd.setText("Загрузка...")
         self.btn_upd.setEnabled(False)
-        w = FeedWorker(self.feeds)
-        w.sig.done.connect(self.on_data)
-        QThreadPool.globalInstance().start(w)
+        # Обход всех лент RSS долгий: фоном, чтобы не отнимать очередь у чата
+        net.call(load_feeds(list(self.feeds)), lambda data: self.on_data(data, None), owner=self, priority=BACKGROUND)
 
     def on_data(self, data, _):
         self.all_posts = data
@@ -1,6 +1,5 @@
 # client/widgets/friends_page.py
-import requests
-import urllib3
+import asyncio
 import hashlib
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLineEdit,
@@ -8,74 +7,15 @@ from PySide6.QtWidgets import (
     QGraphicsDropShadowEffect, QMessageBox,
     QGraphicsOpacityEffect, QSizePolicy
 )
-from PySide6.QtCore import Qt, Signal, QTimer, QRunnable, QThreadPool, QObject, QPropertyAnimation, QSize, QPointF
+from PySide6.QtCore import Qt, Signal, QTimer, QPropertyAnimation, QSize, QPointF
 from PySide6.QtGui import QColor, QPainter, QPainterPath, QPen, QBrush
 from client.widgets.avatar_view import CircularAvatar
+from client.aio import net
+from client.scheduler import PREFETCH
 
-urllib3.disable_warnings()
-API_URL = "https://localhost:8001"
-
-class WorkerSignals(QObject):
-    finished = Signal()
-    loaded = Signal(bytes)
-    incoming = Signal(list)
-    friends = Signal(list)
-    blocked = Signal(list)
-
-class AvatarLoader(QRunnable):
-    def __init__(self, url):
-        super().__init__()
-        self.signals = WorkerSignals()
-        self.url = url
-
-    def run(self):
-        if not self.url:
-            self.signals.loaded.emit(b"")
-            self.signals.finished.emit()
-            return
-        
-        try:
-            target = self.url
-            if target and not target.startswith("http"):
-                target = f"{API_URL}/{target}"
-            
-            r = requests.get(target, verify=False, timeout=5)
-            if r.status_code == 200:
-                self.signals.loaded.emit(r.content)
-            else:
-                self.signals.loaded.emit(b"")
-        except:
-            self.signals.loaded.emit(b"")
-        finally:
-            self.signals.finished.emit()
-
-class FriendsLoader(QRunnable):
-    def __init__(self, user):
-        super().__init__()
-        self.signals = WorkerSignals()
-        self.user = user
-
-    def run(self):
-        if not self.user:
-            self.signals.finished.emit()
-            return
-        
-        try:
-            r1 = requests.get(f"{API_URL}/friends/incoming", params={"user": self.user}, verify=False, timeout=3)
-            if r1.status_code == 200:
-                self.signals.incoming.emit(r1.json().get("requests", []))
-            
-            r2 = requests.get(f"{API_URL}/friends/list", params={"user": self.user}, verify=False, timeout=3)
-            if r2.status_code == 200:
-                self.signals.friends.emit(r2.json().get("friends", []))
-
-            r3 = requests.get(f"{API_URL}/blacklist/list", params={"user": self.user}, verify=False, timeout=3)
-            if r3.status_code == 200:
-                self.signals.blocked.emit(r3.json().get("blocked", []))
-        except:
-            pass
-        finally:
-            self.signals.finished.emit()
+async def load_lists(user):
+    # Три списка запрашиваются одновременно, а не друг за другом; None — запрос не удался
+    return await asyncio.gather(net.friend_requests(user), net.friends(user), net.blacklist(user))
 
 class ActionIconBtn(QPushButton):
     def __init__(self, mode, color_hex, size=36, parent=None):
@@ -228,9 +168,7 @@ class FriendCard(QFrame):
         self.avatar_widget.set_letter(self.username)
         
         if self.avatar_url:
-            self.loader = AvatarLoader(self.avatar_url)
-            self.loader.signals.loaded.connect(self.avatar_widget.set_data)
-            QThreadPool.globalInstance().start(self.loader)
+            net.call(net.fetch_cached(self.avatar_url), self.avatar_widget.set_data, owner=self.avatar_widget)
         
         info = QVBoxLayout()
         info.setSpacing(2)
@@ -424,15 +362,23 @@ class FriendsPage(QWidget):
             return
         
         self.is_loading = True
-        loader = FriendsLoader(self.username)
-        loader.signals.incoming.connect(self.upd_in)
-        loader.signals.friends.connect(self.upd_fr)
-        loader.signals.blocked.connect(self.upd_bl)
-        loader.signals.finished.connect(self.on_loader_finished)
-        QThreadPool.globalInstance().start(loader)
-
-    def on_loader_finished(self):
+        # Опрос каждые 5 с — не вперед истории открытого чата
+        # get_list ошибок не бросает, поэтому колбэк придет всегда, кроме отмены (виджет удален, выход)
+        net.call(load_lists(self.username), lambda r, u=self.username: self.on_lists_loaded(u, r),
+                 owner=self, priority=PREFETCH)
+
+    def on_lists_loaded(self, user, res):
+        # Ответ для прежнего пользователя (смена аккаунта во время запроса) не показывается
+        if user != self.username:
+            return
         self.is_loading = False
+        incoming, friends, blocked = res
+        if incoming is not None:
+            self.upd_in(incoming)
+        if friends is not None:
+            self.upd_fr(friends)
+        if blocked is not None:
+            self.upd_bl(blocked)
 
     # Модифицируйте колбэки обновления данных
     def upd_in(self, d):
@@ -547,14 +493,14 @@ class FriendsPage(QWidget):
             msg = f"{tgt} разблокирован"
 
         if ep:
-            self.api(ep, {"me": self.username, "target": tgt})
+            # Списки перечитываются, когда сервер принял изменение
+            self.api(ep, {"me": self.username, "target": tgt}, self.load_friends)
             self.toast.show_message(msg, "#ef4444" if destr else "#22c55e")
             self.current_friends = None
             self.render_all()
-            QTimer.singleShot(200, self.load_friends)
 
-    def api(self, ep, d):
-        QTimer.singleShot(0, lambda: requests.post(f"{API_URL}{ep}", json=d, verify=False))
+    def api(self, ep, d, then=None):
+        net.call(net.post(ep, json=d, timeout=5), (lambda r: then()) if then else None, owner=self)
 
     def stop_all_workers(self):
         if hasattr(self, 'timer'):
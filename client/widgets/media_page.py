@@ -1,5 +1,3 @@
-import requests
-import urllib3
 import os
 import math
 from PySide6.QtWidgets import (
@@ -8,13 +6,12 @@ from PySide6.QtWidgets import (
     QGridLayout, QSlider, QDialog, QComboBox, QMessageBox,
     QGraphicsDropShadowEffect, QMenu
 )
-from PySide6.QtCore import Qt, Signal, QUrl, QTimer, QThread, QPoint, QRectF
+from PySide6.QtCore import Qt, Signal, QUrl, QTimer, QPoint, QRectF
 from PySide6.QtGui import QColor, QPixmap, QPainter, QPainterPath, QPen, QBrush
 from PySide6.QtMultimedia import QMediaPlayer, QAudioOutput
+from client.aio import net
+from client.scheduler import scheduler
 
-urllib3.disable_warnings()
-
-API_URL = "https://localhost:8001"
 ACCENT_COLOR = "#6366f1"
 
 MENU_STYLE = """
@@ -36,37 +33,16 @@ QMenu::item:selected {
 }
 """
 
-class APIWorker(QThread):
-    finished = Signal(object)
-    
-    def __init__(self, endpoint, data=None, method="GET"):
-        super().__init__()
-        self.endpoint = endpoint
-        self.data = data
-        self.method = method
-    
-    def run(self):
-        try:
-            url = f"{API_URL}{self.endpoint}"
-            if self.method == "POST":
-                r = requests.post(url, json=self.data, verify=False, timeout=30)
-            elif self.method == "DELETE":
-                r = requests.delete(url, json=self.data, verify=False, timeout=10)
-            elif self.method == "PUT":
-                r = requests.put(url, json=self.data, verify=False, timeout=10)
-            else:
-                r = requests.get(url, params=self.data or {}, verify=False, timeout=10)
-            
-            if r.status_code == 200:
-                self.finished.emit(r.json())
-            else:
-                self.finished.emit(None)
-        except Exception:
-            self.finished.emit(None)
-    
-    def stop(self):
-        self.quit()
-        self.wait()
+async def media_api(endpoint, data=None, method="GET"):
+    """JSON ответа 200 или None; запрос идет в общем цикле сети, без отдельного потока."""
+    try:
+        if method == "GET":
+            r = await net.request("GET", endpoint, params=data or {}, timeout=10)
+        else:
+            r = await net.request(method, endpoint, json=data, timeout=30 if method == "POST" else 10)
+        return r.json() if r.status_code == 200 else None
+    except Exception:
+        return None
 
 class SeekSlider(QSlider):
     def mousePressEvent(self, e):
@@ -716,7 +692,9 @@ class MediaPage(QWidget):
         self.ccp = None
         self.current_play_path = None
         self.current_user = None
-        self.w_g = None # IMPORTANT: Init worker var
+        self.w_g = None # Future загрузки альбомов: второй запрос, пока идет первый, не нужен
+        # Чтения прежнего пользователя отменяются при смене пользователя
+        self.user_token = scheduler.token_for(self).child()
         
         self.setup_ui()
         
@@ -725,19 +703,18 @@ class MediaPage(QWidget):
         self.timer_p.start(100)
 
     def stop_all_workers(self):
-        # Остановить все активные потоки
-        if hasattr(self, 'w_g') and self.w_g and self.w_g.isRunning():
-            self.w_g.stop()
-            self.w_g.quit()
-            self.w_g.wait()
-            self.w_g.deleteLater()
-            self.w_g = None
-        
-        # Остановить другие возможные потоки
-        for attr_name in dir(self):
-            attr = getattr(self, attr_name)
-            if isinstance(attr, QThread) and attr.isRunning():
-                attr.quit()
+        # Загрузки списков прежнего пользователя больше не нужны; записи доживают до конца сессии
+        self.user_token.cancel()
+        self.user_token = scheduler.token_for(self).child()
+        self.w_g = None
+
+    def _load(self, endpoint, data, callback):
+        t = self.user_token
+        return net.call(media_api(endpoint, data), lambda r: None if t.cancelled else callback(r),
+                        owner=self, token=t)
+
+    def _write(self, endpoint, data, method, callback):
+        net.call(media_api(endpoint, data, method), callback, owner=self)
 
     def set_user(self, u):
         self.stop_all_workers()  # Останавливаем старые потоки
@@ -887,14 +864,11 @@ class MediaPage(QWidget):
         if not self.current_user:
             return
         
-        # Защита от дублирования потоков (Prevents crashing!)
-        if self.w_g and self.w_g.isRunning():
+        # Защита от дублирования запросов
+        if self.w_g is not None and not self.w_g.done():
             return
             
-        self.w_g = APIWorker("/media/groups", {"username": self.current_user})
-        self.w_g.setParent(self) # Can set explicitly
-        self.w_g.finished.connect(self.got_groups)
-        self.w_g.start()
+        self.w_g = self._load("/media/groups", {"username": self.current_user}, self.got_groups)
     
     def got_groups(self, r):
         if not r:
@@ -978,19 +952,13 @@ class MediaPage(QWidget):
     def edit_grp(self, d):
         dlg = GroupDialog(mode="edit", data=d, parent=self)
         if dlg.exec():
-            self.api = APIWorker("/media/group/update", {"id": d['id'], "title": dlg.inp_title.text(),
-                                                        "author": dlg.inp_author.text(), "genre": dlg.inp_genre.text(),
-                                                        "cover_path": dlg.cover_path}, "PUT")
-            self.api.setParent(self)
-            self.api.finished.connect(lambda x: self.refresh_groups())
-            self.api.start()
+            self._write("/media/group/update", {"id": d['id'], "title": dlg.inp_title.text(),
+                                                "author": dlg.inp_author.text(), "genre": dlg.inp_genre.text(),
+                                                "cover_path": dlg.cover_path}, "PUT", lambda x: self.refresh_groups())
     
     def delete_grp(self, d):
         if QMessageBox.question(self, "?", f"Удалить {d['title']}?", QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
-            self.api = APIWorker("/media/group/delete", {"id": d['id']}, "DELETE")
-            self.api.setParent(self)
-            self.api.finished.connect(lambda x: self.refresh_groups())
-            self.api.start()
+            self._write("/media/group/delete", {"id": d['id']}, "DELETE", lambda x: self.refresh_groups())
     
     def add_grp(self):
         d = GroupDialog(mode="add", parent=self)
@@ -1002,10 +970,7 @@ class MediaPage(QWidget):
                 "genre": d.inp_genre.text(), 
                 "cover_path": d.cover_path
             }
-            self.w_add_g = APIWorker("/media/group", payload, "POST")
-            self.w_add_g.setParent(self)
-            self.w_add_g.finished.connect(lambda x: self.refresh_groups())
-            self.w_add_g.start()
+            self._write("/media/group", payload, "POST", lambda x: self.refresh_groups())
     
     def opn_det(self, gid, title):
         self.active_group = gid
@@ -1031,10 +996,7 @@ class MediaPage(QWidget):
     def refresh_tracks(self):
         if not self.active_group:
             return
-        self.w_tr = APIWorker("/media/tracks", {"group_id": self.active_group})
-        self.w_tr.setParent(self)
-        self.w_tr.finished.connect(self.on_tracks_loaded)
-        self.w_tr.start()
+        self._load("/media/tracks", {"group_id": self.active_group}, self.on_tracks_loaded)
     
     def on_tracks_loaded(self, res):
         if not res:
@@ -1107,10 +1069,7 @@ class MediaPage(QWidget):
         if dlg.exec():
             dd = dlg.accept_data
             dd['id'] = d['id']
-            self.w_up = APIWorker("/media/track/update", dd, "PUT")
-            self.w_up.setParent(self)
-            self.w_up.finished.connect(lambda x: self.force_refresh())
-            self.w_up.start()
+            self._write("/media/track/update", dd, "PUT", lambda x: self.force_refresh())
     
     def delete_track(self, d):
         if QMessageBox.question(self, "?", f"Удалить трек {d['title']}?", QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
@@ -1121,19 +1080,13 @@ class MediaPage(QWidget):
                 self.player_ui.vinyl.set_playing(False)
                 self.player_ui.vinyl.set_progress(0, 0)
             
-            self.w_del = APIWorker("/media/track/delete", {"id": d['id']}, "DELETE")
-            self.w_del.setParent(self)
-            self.w_del.finished.connect(lambda x: self.force_refresh())
-            self.w_del.start()
+            self._write("/media/track/delete", {"id": d['id']}, "DELETE", lambda x: self.force_refresh())
     
     def add_trk(self):
         d = TrackDialog(mode="add", group_id=self.active_group, existing_tracks=self.current_album_tracks, parent=self)
         if d.exec():
             d.accept_data['parent_id'] = d.accept_data.get('parent_id')
-            self.w_add_t = APIWorker("/media/track", d.accept_data, "POST")
-            self.w_add_t.setParent(self)
-            self.w_add_t.finished.connect(lambda x: self.force_refresh())
-            self.w_add_t.start()
+            self._write("/media/track", d.accept_data, "POST", lambda x: self.force_refresh())
     
     def force_refresh(self):
         if self.active_group in self.tracks_cache:
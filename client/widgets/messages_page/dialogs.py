@@ -91,6 +91,17 @@ class HybridGalleryOverlay(QDialog):
         # Настройка фокуса для ESC
         self.setFocusPolicy(Qt.StrongFocus)
 
+    def set_pixmap(self, pixmap):
+        """Замена миниатюры оригиналом: видимый размер и зум сохраняются, картинка только становится четче."""
+        if pixmap is None or pixmap.isNull():
+            return
+        if not self.pixmap.isNull():
+            self.scale_factor *= self.pixmap.width() / pixmap.width()
+        else:
+            self.scale_factor = min(self.width() / pixmap.width(), self.height() / pixmap.height()) * 0.95
+        self.pixmap = pixmap
+        self.update()
+
     def resizeEvent(self, e):
         # Кнопка всегда справа-сверху
         self.btn_close.move(self.width() - 50, 20)
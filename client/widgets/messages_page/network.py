@@ -1,235 +1,179 @@
-import requests
-import functools
+import asyncio
 import threading
 import concurrent.futures
 import os
-import urllib3
-from PySide6.QtCore import QRunnable, Signal, QObject, QThreadPool
-from PySide6.QtGui import QImage
+import time
+import uuid
+from PySide6.QtCore import QRunnable, Signal, QObject
+from PySide6.QtGui import QImageIOHandler, QImageReader
+from client import decode as decoder
+from client.api import api
+from client.aio import net
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-API_URL = "https://localhost:8001"
 ATTACHMENT_SPLITTER = "<<<SPLIT>>>"
 
-# Создаем одну сессию на весь модуль, чтобы ускорить handshake (убирает лаги)
-session = requests.Session()
-session.verify = False
-
-class ThreadPoolManager:
-    _instance = None
-    _lock = threading.Lock()
-
-    def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super().__new__(cls)
-                cls._instance._executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="net_worker")
-                cls._instance._current_context_id = 0 
-            return cls._instance
-
-    def submit(self, task_func, *args, **kwargs):
-        context_id = self._current_context_id
-        def safe_wrapper():
-            if self._current_context_id != context_id: return
-            try: task_func(*args, **kwargs)
-            except: pass
-        return self._executor.submit(safe_wrapper)
-
-    def clear_all_tasks(self):
-        self._current_context_id += 1
-
 # --- Сигналы для SendWorker ---
 class SendWorkerSignals(QObject):
     finished = Signal()
     error = Signal(str)
+    sent = Signal(dict) # Сохраненное сообщение (пустой dict — сервер его не вернул)
 
 class SendWorker(QRunnable):
-    def __init__(self, sender, receiver, text, attachments):
+    def __init__(self, sender, receiver, text, attachments, client_key=None):
         super().__init__()
         self.sender = sender
         self.receiver = receiver
         self.text = text
         self.attachments = attachments
+        # Ключ идемпотентности: по нему же страница находит локальный пузырь
+        self.client_key = client_key or uuid.uuid4().hex
         self.signals = SendWorkerSignals()
         self.setAutoDelete(True) # Автоматическая очистка памяти
 
     def run(self):
         try:
-            parts = [self.text if self.text else ""]
-            if self.attachments:
-                for item in self.attachments:
-                    # Формируем строку вложения
-                    parts.append(f"cmd://{item['type']}::{item['path']}")
-            
-            combined = ATTACHMENT_SPLITTER.join(parts)
-            
+            text = self.text or ""
+            atts = [attachment_meta(a['path'], a['type']) for a in self.attachments or []]
+
             # Если всё пустое (на всякий случай)
-            if not combined.strip():
+            if not text.strip() and not atts:
                 self.signals.finished.emit()
                 return
 
-            # Используем глобальную сессию
-            r = session.post(
-                f"{API_URL}/messages/send", 
-                json={"to_user": self.receiver, "text": combined}, 
-                params={"sender": self.sender}, 
-                timeout=10
-            )
+            r = api.send_message(self.sender, {"to_user": self.receiver, "text": text, "attachments": atts,
+                                               "client_key": self.client_key}, self.client_key)
             r.raise_for_status()
+            self.signals.sent.emit(r.json().get("message") or {})
             
         except Exception as e:
             self.signals.error.emit(str(e))
         finally:
             self.signals.finished.emit()
 
-@functools.lru_cache(maxsize=128)
-def fetch_avatar_data(username):
-    try:
-        r = session.get(f"{API_URL}/user/profile_info", params={"username": username}, timeout=3)
-        if r.status_code == 200:
-            return r.json().get('avatar_url')
-    except: pass
-    return None
-
-def fetch_full_profile(username):
-    try:
-        r = session.get(f"{API_URL}/user/profile_info", params={"username": username}, timeout=3)
-        if r.status_code == 200:
-            res = r.json()
-            res['username'] = username
-            return res
-    except: pass
-    return None
-
-@functools.lru_cache(maxsize=64)
-def fetch_chat_data(username):
+def attachment_meta(path, ftype):
+    """Метаданные вложения для структурированного сообщения (размер, габариты, BlurHash)."""
+    meta = {'type': ftype, 'url': path, 'name': os.path.basename(path)}
     try:
-        r = session.get(f"{API_URL}/contacts/list", params={"username": username}, timeout=3)
-        if r.status_code == 200:
-            return tuple(r.json().get('contacts', []))
-    except: pass
-    return tuple()
-
-class HeaderResultSignaler(QObject):
-    updated = Signal(dict)
-
-class ChatLoaderSignals(QObject):
-    loaded = Signal(list)
-
-class ChatLoader(QRunnable):
-    def __init__(self, username):
-        super().__init__()
-        self.u = username
-        self.signals = ChatLoaderSignals()
-        self.setAutoDelete(True)
-
-    def run(self):
-        data = fetch_chat_data(self.u)
-        self.signals.loaded.emit(list(data) if data else [])
-
-class HistorySignals(QObject):
-    result_ready = Signal(list, int)
-    finished = Signal()
-
-class HistoryLoader(QRunnable):
-    def __init__(self, u1, u2, off=0, lim=50):
-        super().__init__()
-        self.u1 = u1
-        self.u2 = u2
-        self.off = off
-        self.lim = lim
-        self.signals = HistorySignals()
-        self.setAutoDelete(True)
-
-    def run(self):
-        msgs = []
+        if os.path.exists(path):
+            meta['size'] = os.path.getsize(path)
+            if ftype == 'image':
+                # QImageReader читает только заголовок, без декодирования
+                reader = QImageReader(path)
+                reader.setAutoTransform(True)
+                sz = reader.size()
+                if sz.isValid():
+                    w, h = sz.width(), sz.height()
+                    # size() — габариты до поворота по EXIF; снимок с телефона «стоя» показывается
+                    # повернутым, и рамка под него должна быть тех же пропорций
+                    if reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+                        w, h = h, w
+                    meta['width'], meta['height'] = w, h
+                # Заглушка для получателя, пока грузится миниатюра
+                bh = decoder.blurhash_of(path)
+                if bh:
+                    meta['blurhash'] = bh
+    except OSError:
+        pass
+    return meta
+
+class ProfileBatcher:
+    """Запросы профилей, пришедшие почти одновременно (в пределах window), уходят
+    одним /users/profiles. Ответы кэшируются на ttl секунд.
+    get() блокирует — вызывается из фоновых задач; из GUI-потока — request() и Future."""
+    MAX_BATCH = 100
+
+    def __init__(self, window=0.015, ttl=30.0):
+        self.window = window
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pending = {}  # имя -> Future
+        self._timer = None
+        self._cache = {}    # имя -> (годен до, профиль или None)
+
+    def request(self, username):
+        with self._lock:
+            hit = self._cache.get(username)
+            if hit and hit[0] > time.monotonic():
+                f = concurrent.futures.Future()
+                f.set_result(hit[1])
+                return f
+            f = self._pending.get(username)
+            if f is None:
+                f = self._pending[username] = concurrent.futures.Future()
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self._flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+            return f
+
+    def get(self, username, timeout=5):
         try:
-            r = session.get(f"{API_URL}/messages/history", params={"u1": self.u1, "u2": self.u2, "offset": self.off, "limit": self.lim}, timeout=5)
-            if r.status_code == 200:
-                msgs = r.json().get('messages', [])
-                if self.off == 0 and msgs:
-                    # Помечаем прочитанными
-                    tr = [m['id'] for m in msgs if m['sender_name'] != self.u1 and not m['is_read']]
-                    if tr:
-                        session.post(f"{API_URL}/messages/read", json={"ids": tr, "user": self.u1})
-        except: pass
-        self.signals.result_ready.emit(msgs, self.off)
-        self.signals.finished.emit()
-
-class ImgSignals(QObject):
-    loaded = Signal(object)
-
-class DataSignals(QObject):
-    loaded = Signal(bytes)
-
-class DataLoader(QRunnable):
-    def __init__(self, url):
-        super().__init__()
-        self.url = url
-        self.signals = DataSignals()
-        self.loaded = self.signals.loaded 
-        self.setAutoDelete(True)
-
-    def run(self):
-        if not self.url:
-            self.signals.loaded.emit(b"")
-            return
-        try:
-            target = str(self.url)
-            if os.path.exists(target):
-                with open(target, 'rb') as f:
-                    self.signals.loaded.emit(f.read())
-            else:
-                if target.startswith("/"):
-                    target = f"{API_URL}{target}"
-                
-                if target.startswith("http"):
-                    r = requests.get(target, verify=False, timeout=10) # Картинки иногда лучше через чистый requests для потокобезопасности QImage/Pixmap
-                    if r.status_code == 200:
-                        self.signals.loaded.emit(r.content)
-                    else:
-                        self.signals.loaded.emit(b"")
-                else:
-                    self.signals.loaded.emit(b"")
-        except:
-            self.signals.loaded.emit(b"")
-            
-    def start(self):
-        QThreadPool.globalInstance().start(self)
-
-class ChatImageLoader(QRunnable):
-    def __init__(self, url):
-        super().__init__()
-        self.url = url
-        self.signals = ImgSignals()
-        self.loaded = self.signals.loaded 
-        self.setAutoDelete(True)
-
-    def run(self):
-        if not self.url:
-            self.signals.loaded.emit(None)
-            return
+            return self.request(username).result(timeout)
+        except Exception:
+            return None
+
+    def invalidate(self, username):
+        with self._lock:
+            self._cache.pop(username, None)
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending, self._timer = self._pending, {}, None
+        names = list(batch)
+        for i in range(0, len(names), self.MAX_BATCH):
+            chunk = names[i:i + self.MAX_BATCH]
+            found = api.profiles(chunk)
+            ok = found is not None
+            found = found or {}
+            until = time.monotonic() + self.ttl
+            with self._lock:
+                for n in chunk:
+                    if ok:
+                        self._cache[n] = (until, found.get(n))
+            for n in chunk:
+                batch[n].set_result(found.get(n))
+
+profiles = ProfileBatcher()
+
+async def load_avatar_url(username):
+    # Пакетный запрос профилей идет своим таймером; корутина только ждет его Future.
+    # shield: Future общий для всех, кто ждет этот профиль, — таймаут или отмена его не отменяют
+    try:
+        p = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(profiles.request(username))), 5)
+    except Exception:
+        return None
+    return p.get('avatar_url') if p else None
+
+# --- Загрузки открытого чата: корутины для net.call ---
+async def load_header(username):
+    # Шапке нужно живое присутствие, которого нет в пакетном ответе;
+    # на сервере этот запрос обслуживается тем же кэшем профилей
+    res = await net.profile_info(username)
+    if res is None:
+        return {"username": username}
+    res['username'] = username
+    return res
+
+async def load_chats(username):
+    return await net.contacts(username) or []
+
+async def _mark_read(u1, u2, msgs, unread_only):
+    ids = [m['id'] for m in msgs if m['sender_name'] != u1 and not (unread_only and m['is_read'])]
+    if ids:
         try:
-            target = str(self.url)
-            if os.path.exists(target):
-                img = QImage()
-                img.load(target)
-                self.signals.loaded.emit(img if not img.isNull() else None)
-            else:
-                if target.startswith("/"): target = f"{API_URL}{target}"
-                if target.startswith("http"):
-                    r = requests.get(target, verify=False, timeout=10)
-                    if r.status_code == 200:
-                        img = QImage()
-                        img.loadFromData(r.content)
-                        self.signals.loaded.emit(img if not img.isNull() else None)
-                    else:
-                        self.signals.loaded.emit(None)
-                else:
-                    self.signals.loaded.emit(None)
-        except:
-            self.signals.loaded.emit(None)
-
-    def start(self):
-        QThreadPool.globalInstance().start(self)
\ No newline at end of file
+            await net.mark_read(u1, u2, max(ids))
+        except Exception:
+            pass
+
+async def load_history(u1, u2, off=0, lim=50):
+    msgs = await net.history(u1, u2, off, lim) or []
+    if off == 0 and msgs:
+        # Помечаем прочитанными
+        await _mark_read(u1, u2, msgs, True)
+    return msgs
+
+async def load_new(u1, u2, last_id):
+    msgs = await net.load_new(u1, u2, last_id) or []
+    if msgs:
+        await _mark_read(u1, u2, msgs, False)
+    return msgs
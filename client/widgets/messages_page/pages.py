@@ -1,6 +1,6 @@
 import datetime
 import time
-import requests
+import uuid
 from dateutil import parser as date_parser
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel,
@@ -8,87 +8,22 @@ from PySide6.QtWidgets import (
     QLineEdit, QMenu, QMessageBox, QFileDialog,
     QStackedWidget, QInputDialog, QApplication
 )
-from PySide6.QtCore import Qt, QSize, QTimer, QPoint, QThreadPool, QObject, Signal
+from PySide6.QtCore import Qt, QSize, QTimer, QPoint, QRect
 from PySide6.QtGui import QAction, QPalette
-from . import network
+from client.aio import net
+from client.scheduler import scheduler, VISIBLE, PREFETCH, BACKGROUND
 from .network import (
-    ThreadPoolManager, fetch_avatar_data, fetch_full_profile,
-    fetch_chat_data, SendWorker, HeaderResultSignaler,
-    ChatLoader, HistoryLoader, ATTACHMENT_SPLITTER
+    load_avatar_url, SendWorker,
+    load_header, load_chats, load_history, load_new, ATTACHMENT_SPLITTER
 )
 from .widgets import (
     ModernAvatar, SidebarToggle, RichLoadingSpinner, ActionMorphButton,
     ChatListItem, MessageRow, MessageTextEdit, AttachmentPreviewWidget,
-    ChatHeaderButton, DateHeaderWidget
+    ChatHeaderButton, DateHeaderWidget, AspectRatioLabel, legacy_preview
 )
 from client.widgets.profile_page import ProfileViewDialog
 from .dialogs import EmojiPicker
 
-class QuickWorker(network.QRunnable):
-    def __init__(self, func, *args, **kwargs):
-        super().__init__()
-        self.func = func
-        self.args = args
-        self.kwargs = kwargs
-        self.setAutoDelete(True)
-
-    def run(self):
-        try:
-            self.func(*self.args, **self.kwargs)
-        except:
-            pass
-
-class PollResultSignaler(QObject):
-    msgs_loaded = Signal(list)
-
-class PollWorker(network.QRunnable):
-    def __init__(self, u1, u2, last_id, signal):
-        super().__init__()
-        self.u1 = u1
-        self.u2 = u2
-        self.last = last_id
-        self.signal = signal
-        self.setAutoDelete(True)
-
-    def run(self):
-        try:
-            # Используем глобальную сессию
-            r = network.session.get(f"{network.API_URL}/messages/load", 
-                                  params={"u1": self.u1, "u2": self.u2, "last_id": self.last}, 
-                                  timeout=4)
-            if r.status_code == 200:
-                msgs = r.json().get('messages', [])
-                if msgs:
-                    # Помечаем прочитанными асинхронно
-                    ids = [m['id'] for m in msgs if m['sender_name'] != self.u1]
-                    if ids:
-                        network.session.post(f"{network.API_URL}/messages/read", json={"ids": ids, "user": self.u1})
-                    self.signal.emit(msgs)
-        except:
-            pass
-
-class HeaderWorker(network.QRunnable):
-    def __init__(self, user, signaler):
-        super().__init__()
-        self.user = user
-        self.signaler = signaler
-        self.setAutoDelete(True)
-
-    def run(self):
-        data = fetch_full_profile(self.user)
-        self.signaler.updated.emit(data if data else {"username": self.user})
-
-class LocalAvatarLoader(network.QRunnable):
-    def __init__(self, u, callback_slot):
-        super().__init__()
-        self.u = u
-        self.cb = callback_slot
-        self.setAutoDelete(True)
-
-    def run(self):
-        d = fetch_avatar_data(self.u)
-        QTimer.singleShot(0, lambda: self.cb(d))
-
 class MessagesPage(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -106,7 +41,16 @@ class MessagesPage(QWidget):
         self.pinned_chats = set()
         
         self._is_alive = True
-        self.pending_bubbles_queue = [] # Для удаления локальных копий сообщений
+        self.pending_bubbles = {} # client_key -> локальная копия сообщения до ответа сервера
+        self.sent_shown = set() # id отправленных, чей пузырь уже заменен ответом на отправку; строку добавит опрос
+        # Работа открытого чата (история, опрос, шапка, картинки) отменяется при смене чата
+        self.chat_token = scheduler.token_for(self).child()
+
+        # Картинки пузырей грузятся по видимости: пересчет после прокрутки, не на каждый пиксель
+        self.visibility_timer = QTimer(self)
+        self.visibility_timer.setSingleShot(True)
+        self.visibility_timer.setInterval(60)
+        self.visibility_timer.timeout.connect(self.schedule_visible_images)
 
         self.chat_list_timer = QTimer(self)
         self.chat_list_timer.timeout.connect(self.refresh_chat_list_safe)
@@ -121,12 +65,6 @@ class MessagesPage(QWidget):
         self.typing_hide_timer.setSingleShot(True)
         self.typing_hide_timer.timeout.connect(self.hide_typing_label)
 
-        self.header_signaler = HeaderResultSignaler()
-        self.header_signaler.updated.connect(self._update_header_ui)
-        
-        self.poll_signaler = PollResultSignaler()
-        self.poll_signaler.msgs_loaded.connect(self._append_new)
-
         self.setup_ui()
         self.setup_attach_menu()
         self.setup_emoji_menu()
@@ -149,16 +87,33 @@ class MessagesPage(QWidget):
             if hasattr(self, 'msg_poll_timer'): self.msg_poll_timer.stop()
             if hasattr(self, 'typing_poll_timer'): self.typing_poll_timer.stop()
             if hasattr(self, 'typing_hide_timer'): self.typing_hide_timer.stop()
+            if hasattr(self, 'visibility_timer'): self.visibility_timer.stop()
             if hasattr(self, 'spinner'): self.spinner.stop()
         except:
             pass
 
-    def start_worker(self, worker):
+    def start_worker(self, worker, priority=VISIBLE, chat=False):
+        """chat=True — задача открытого чата: снимается с очереди при переходе в другой чат.
+        Записи (отправка, удаление, правка) к чату не привязываются и доживают до конца сессии."""
+        if self._is_alive:
+            token = self.chat_token if chat else scheduler.token_for(self)
+            scheduler.api.start(worker, priority, token)
+
+    def _chat_call(self, coro, callback, priority=VISIBLE):
+        """Загрузка открытого чата в цикле сети. Смена чата отменяет ее, а ответ,
+        успевший прийти до отмены, в новый чат не попадает."""
         if self._is_alive:
-            QThreadPool.globalInstance().start(worker)
+            t = self.chat_token
+            net.call(coro, lambda r: None if t.cancelled else callback(r), owner=self, priority=priority, token=t)
+
+    def _renew_chat_token(self):
+        # Все, что еще в очереди или в загрузке для прежнего чата, больше не нужно
+        self.chat_token.cancel()
+        self.chat_token = scheduler.token_for(self).child()
 
     def set_current_user(self, u):
         self.stop_all_workers()
+        self._renew_chat_token()
         self.current_user = u
         self.list_w.clear()
         self.active_chat_user = None
@@ -174,7 +129,7 @@ class MessagesPage(QWidget):
         def cb(d):
             if self._is_alive: 
                 self.my_avatar_data = d
-        self.start_worker(LocalAvatarLoader(self.current_user, cb))
+        net.call(load_avatar_url(self.current_user), cb, owner=self, priority=PREFETCH)
 
     # --- UI UPDATE & THEME ---
 
@@ -297,6 +252,8 @@ class MessagesPage(QWidget):
         self.scroll.setWidgetResizable(True)
         self.scroll.setStyleSheet("QScrollArea{border:none; background:transparent;} QScrollBar:vertical{width:8px; background:transparent;} QScrollBar::handle:vertical{background:#475569; border-radius:4px; min-height:20px;}")
         self.scroll.verticalScrollBar().valueChanged.connect(self.check_pagination)
+        self.scroll.verticalScrollBar().valueChanged.connect(lambda *_: self.visibility_timer.start())
+        self.scroll.verticalScrollBar().rangeChanged.connect(lambda *_: self.visibility_timer.start())
         self.area_w = QWidget()
         self.area_w.setStyleSheet("background:transparent;")
         self.alay = QVBoxLayout(self.area_w)
@@ -353,17 +310,11 @@ class MessagesPage(QWidget):
 
     def _send_typing_status(self, s):
         if self.active_chat_user:
-            def t_req(u, t, st):
-                network.session.post(f"{network.API_URL}/messages/typing", json={"user": u, "target": t, "status": st}, timeout=2)
-            self.start_worker(QuickWorker(t_req, self.current_user, self.active_chat_user, s))
+            self._chat_call(net.set_typing(self.current_user, self.active_chat_user, s), lambda r: None, BACKGROUND)
 
     def check_typing_status(self):
-        def chk_req(me, tgt, sig):
-            r = network.session.get(f"{network.API_URL}/messages/typing", params={"user": tgt, "me": me}, timeout=2)
-            if r.json().get("is_typing"):
-                QTimer.singleShot(0, sig)
-        
-        self.start_worker(QuickWorker(chk_req, self.current_user, self.active_chat_user, self.show_typing_label))
+        self._chat_call(net.typing(self.active_chat_user, self.current_user),
+                        lambda j: self.show_typing_label() if (j or {}).get("is_typing") else None, BACKGROUND)
 
     def show_typing_label(self):
         if not self._is_alive: return
@@ -485,9 +436,8 @@ class MessagesPage(QWidget):
 
     def refresh_chat_list_safe(self):
         if not self.current_user: return
-        loader = ChatLoader(self.current_user)
-        loader.signals.loaded.connect(self._fill_chats)
-        self.start_worker(loader)
+        if self._is_alive:
+            net.call(load_chats(self.current_user), self._fill_chats, owner=self, priority=PREFETCH)
 
     def _fill_chats(self, chats):
         # Добавлена защита от обновления мертвых виджетов
@@ -513,7 +463,7 @@ class MessagesPage(QWidget):
                 it = existing[u]
                 w = self.list_w.itemWidget(it)
                 if isinstance(w, ChatListItem):
-                    if w.data.get('last_message') != c.get('last_message') or w.data.get('timestamp') != c.get('timestamp') or w.data.get('avatar_url') != c.get('avatar_url'):
+                    if w.data.get('last_preview') != c.get('last_preview') or w.data.get('last_message') != c.get('last_message') or w.data.get('timestamp') != c.get('timestamp') or w.data.get('avatar_url') != c.get('avatar_url') or w.data.get('unread') != c.get('unread'):
                         nw = ChatListItem(c, self.is_list_collapsed)
                         nw.set_theme(self.is_dark)
                         nw.context_action.connect(self.handle_list_action)
@@ -544,6 +494,7 @@ class MessagesPage(QWidget):
                 # Обновляем данные словаря
                 new_data = d.copy()
                 new_data['last_message'] = text
+                new_data['last_preview'] = text
                 new_data['timestamp'] = ts
                 
                 # Создаем новый виджет строки чата
@@ -572,18 +523,16 @@ class MessagesPage(QWidget):
             else: self.pinned_chats.add(u)
             self.refresh_chat_list_safe()
         elif act == "clear_history":
-            def clr(m, t):
-                network.session.post(f"{network.API_URL}/messages/clear", json={"me": m, "target": t, "for_all": False}, verify=False)
-            self.start_worker(QuickWorker(clr, self.current_user, u))
+            net.call(net.clear_chat(self.current_user, u), owner=self)
             self.open_new_chat(u)
         elif act == "delete_chat":
-            def d_ch(m, t):
-                network.session.post(f"{network.API_URL}/messages/clear", json={"me": m, "target": t, "for_all": False}, verify=False)
-            self.start_worker(QuickWorker(d_ch, self.current_user, u))
+            net.call(net.clear_chat(self.current_user, u), owner=self)
             QTimer.singleShot(500, self.refresh_chat_list_safe)
 
     def open_new_chat(self, partner, full=None):
-        self.pending_bubbles_queue.clear()
+        self._renew_chat_token()
+        self.pending_bubbles.clear()
+        self.sent_shown.clear()
         self.msg_poll_timer.stop()
         self.welcome_screen_mode(False)
         self.active_chat_user = partner
@@ -594,7 +543,7 @@ class MessagesPage(QWidget):
         self._apply_header_data(full if full else {"username": partner})
         self.spinner.start()
         self.content_stack.setCurrentIndex(1)
-        self.start_worker(HeaderWorker(partner, self.header_signaler))
+        self._chat_call(load_header(partner), self._update_header_ui)
         QTimer.singleShot(100, self._load_initial_history)
         self.typing_poll_timer.start(2500)
 
@@ -614,9 +563,8 @@ class MessagesPage(QWidget):
 
     def _load_initial_history(self):
         self.is_loading_history = True
-        loader = HistoryLoader(self.current_user, self.active_chat_user, 0, 50)
-        loader.signals.result_ready.connect(self._handle_history_loaded)
-        self.start_worker(loader)
+        self._chat_call(load_history(self.current_user, self.active_chat_user, 0, 50),
+                        lambda msgs: self._handle_history_loaded(msgs, 0))
         QTimer.singleShot(8000, self._force_stop_loading)
 
     def _force_stop_loading(self):
@@ -629,9 +577,9 @@ class MessagesPage(QWidget):
     def check_pagination(self, v):
         if v < 50 and not self.is_loading_history and self.loaded_count >= 50:
             self.is_loading_history = True
-            w = HistoryLoader(self.current_user, self.active_chat_user, self.loaded_count, 30)
-            w.signals.result_ready.connect(self._handle_history_loaded)
-            self.start_worker(w)
+            off = self.loaded_count
+            self._chat_call(load_history(self.current_user, self.active_chat_user, off, 30),
+                            lambda msgs: self._handle_history_loaded(msgs, off))
 
     def _handle_history_loaded(self, msgs, off):
         self.content_stack.setCurrentIndex(0)
@@ -656,6 +604,8 @@ class MessagesPage(QWidget):
         if not self._is_alive: return
         if full:
             self.clear_chat_area()
+            # Пузыри перерисовываются из данных: заменённых ответом на отправку больше нет
+            self.sent_shown.clear()
             ld = None
             for m in self.messages_list_data:
                 try:
@@ -682,12 +632,16 @@ class MessagesPage(QWidget):
         r.action_edit.connect(lambda: self.on_msg_edit_req(m))
         idx = self.alay.count() - 1 if index == -1 else index
         self.alay.insertWidget(idx, r)
+        self.visibility_timer.start()
         return r
 
     def _parse_message_content(self, m):
+        # Сервер отдает готовые text/attachments, разбор строки нужен только для старых ответов
+        if 'text' in m:
+            return m.get('text') or "", list(m.get('attachments') or [])
         rc = m.get('content', '')
         ft = ""
-        fa = m.get('attachments') or []
+        fa = list(m.get('attachments') or [])
         if ATTACHMENT_SPLITTER in rc:
             p = rc.split(ATTACHMENT_SPLITTER)
             ft = p[0]
@@ -713,8 +667,7 @@ class MessagesPage(QWidget):
         # Безопасная проверка: не запускать опрос, если окно закрыто или нет чата
         if not self.active_chat_user or not self._is_alive: return
         last = self.messages_list_data[-1]['id'] if self.messages_list_data else 0
-        worker = PollWorker(self.current_user, self.active_chat_user, last, self.poll_signaler.msgs_loaded)
-        self.start_worker(worker)
+        self._chat_call(load_new(self.current_user, self.active_chat_user, last), self._append_new)
 
     def _append_new(self, msgs):
         if not msgs or not self._is_alive: return
@@ -724,27 +677,72 @@ class MessagesPage(QWidget):
         self.messages_list_data.extend(uniq)
         self.loaded_count += len(uniq)
         last = uniq[-1]
-        raw = last.get('content', '')
-        if ATTACHMENT_SPLITTER in raw: ptxt = raw.split(ATTACHMENT_SPLITTER)[0]
-        else: ptxt = raw
-        if "cmd://image" in raw and not ptxt: ptxt = "🖼️ Изображение"
-        elif "cmd://file" in raw and not ptxt: ptxt = "📄 Документ"
+        ptxt = last.get('preview')
+        if ptxt is None:
+            ptxt = legacy_preview(last.get('content', ''))
         
         # Обновление превью с задержкой (опционально можно и тут обновить)
         self._update_list_preview(self.active_chat_user, ptxt, last.get('created_at'))
         
-        # Логика дедупликации (удаление временных сообщений)
+        # Опрос мог опередить ответ на отправку: локальная копия заменяется по ключу
         for m in uniq: 
-            if m.get('sender_name') == self.current_user and self.pending_bubbles_queue:
-                try:
-                    w = self.pending_bubbles_queue.pop(0)
-                    w.deleteLater()
-                except:
-                    pass
-            self._add_bubble_to_ui(m)
+            if m['id'] in self.sent_shown:
+                # Пузырь уже на месте (ответ на отправку пришел раньше опроса)
+                self.sent_shown.discard(m['id'])
+                continue
+            w = None
+            if m.get('sender_name') == self.current_user and self.pending_bubbles:
+                key = m.get('client_key')
+                if key:
+                    w = self.pending_bubbles.pop(key, None)
+                else:
+                    # Сервер без ключей — снимаем самую раннюю копию
+                    w = self.pending_bubbles.pop(next(iter(self.pending_bubbles)))
+            if w is not None:
+                self._replace_bubble(w, m)
+            else:
+                self._add_bubble_to_ui(m)
             
         self.scroll_to_bottom()
 
+    def _replace_bubble(self, w, m):
+        # Настоящее сообщение встает на место локальной копии, порядок не меняется
+        idx = self.alay.indexOf(w)
+        if idx < 0:
+            return self._add_bubble_to_ui(m)
+        self.alay.removeWidget(w)
+        w.deleteLater()
+        return self._add_bubble_to_ui(m, idx)
+
+    def _on_message_sent(self, m):
+        if not self._is_alive:
+            return
+        if not m:
+            # Старый сервер не возвращает сообщение — забираем его опросом
+            QTimer.singleShot(500, self.poll_new_messages)
+            return
+        # Нет копии — чат сменился или опрос уже заменил ее
+        w = self.pending_bubbles.pop(m.get('client_key'), None)
+        if w is None:
+            return
+        self._replace_bubble(w, m)
+        # В messages_list_data строку добавит опрос: ее id — курсор опроса, и входящие
+        # с меньшим id, еще не забранные опросом, иначе были бы пропущены
+        if all(x['id'] != m['id'] for x in self.messages_list_data):
+            self.sent_shown.add(m['id'])
+
+    def _on_send_failed(self, key, err):
+        if not self._is_alive:
+            return
+        w = self.pending_bubbles.pop(key, None)
+        if w is None:
+            return
+        # Копия остается на экране с пометкой: текст не теряется молча
+        lbl = w.bub.s_lbl
+        if lbl is not None:
+            lbl.setText("⚠")
+            lbl.setToolTip(f"Не отправлено: {err}")
+
     def send_text(self):
         t = self.inp.toPlainText().strip()
         has = len(self.pending_attachments) > 0
@@ -760,11 +758,11 @@ class MessagesPage(QWidget):
         
         # Визуальное отображение (оптимистичное UI)
         ts_now = datetime.datetime.now().isoformat()
-        loc = {'id': -1, 'content': t, 'sender_name': self.current_user, 'avatar_url': self.my_avatar_data, 'created_at': ts_now, 'is_read': False, 'attachments': atts_ui}
+        key = uuid.uuid4().hex
+        loc = {'id': -1, 'text': t, 'sender_name': self.current_user, 'avatar_url': self.my_avatar_data, 'created_at': ts_now, 'is_read': False, 'attachments': atts_ui}
         
-        # Добавляем временное сообщение и запоминаем для последующего удаления дубля
-        w_tmp = self._add_bubble_to_ui(loc)
-        self.pending_bubbles_queue.append(w_tmp)
+        # Локальная копия живет до ответа сервера с тем же ключом
+        self.pending_bubbles[key] = self._add_bubble_to_ui(loc)
         
         self.scroll_to_bottom()
         
@@ -773,13 +771,9 @@ class MessagesPage(QWidget):
         self._update_list_preview(self.active_chat_user, f"Вы: {prev}", ts_now)
         
         # Запуск фоновой задачи
-        def on_send_finish():
-            # Запускаем опрос сообщений через 500мс, но безопасно
-            if self._is_alive:
-                QTimer.singleShot(500, self.poll_new_messages)
-
-        worker = SendWorker(self.current_user, self.active_chat_user, t, atts_net)
-        worker.signals.finished.connect(on_send_finish)
+        worker = SendWorker(self.current_user, self.active_chat_user, t, atts_net, client_key=key)
+        worker.signals.sent.connect(self._on_message_sent)
+        worker.signals.error.connect(lambda e, k=key: self._on_send_failed(k, e))
         self.start_worker(worker)
 
     def on_msg_delete_req(self, m):
@@ -793,20 +787,35 @@ class MessagesPage(QWidget):
         btn = mb.clickedButton()
         if btn in (b_me, b_all):
             for_all = (btn == b_all)
-            def del_act(mid, all_f, usr):
-                network.session.post(f"{network.API_URL}/messages/delete_one", json={"id": mid, "for_all": all_f, "user": usr}, verify=False)
-            self.start_worker(QuickWorker(del_act, m['id'], for_all, self.current_user))
+            net.call(net.delete_message(m['id'], for_all, self.current_user), owner=self)
             QTimer.singleShot(200, self._load_initial_history)
 
     def on_msg_edit_req(self, m):
         t, _ = self._parse_message_content(m)
         nt, ok = QInputDialog.getMultiLineText(self, "Edit", "Text:", t)
         if ok and nt.strip():
-            def ed_act(mid, txt, usr):
-                network.session.post(f"{network.API_URL}/messages/edit", json={"id": mid, "new_text": txt, "user": usr}, verify=False)
-            self.start_worker(QuickWorker(ed_act, m['id'], nt, self.current_user))
+            net.call(net.edit_message(m['id'], nt, self.current_user), owner=self)
             QTimer.singleShot(200, self._load_initial_history)
 
+    def schedule_visible_images(self):
+        """Картинки в окне чата грузятся первыми, в пределах экрана от него — предзагрузкой,
+        дальше — не грузятся (начатая загрузка отменяется и повторится при возврате)."""
+        if not self._is_alive:
+            return
+        vp = self.scroll.viewport()
+        view = vp.rect()
+        near = view.adjusted(0, -view.height(), 0, view.height())
+        for al in self.area_w.findChildren(AspectRatioLabel):
+            if not al.pending:
+                continue
+            r = QRect(al.mapTo(vp, QPoint(0, 0)), al.size())
+            if r.intersects(view):
+                al.request(VISIBLE, self.chat_token)
+            elif r.intersects(near):
+                al.request(PREFETCH, self.chat_token)
+            else:
+                al.release()
+
     def scroll_to_bottom(self):
         self.scroll.verticalScrollBar().setValue(self.scroll.verticalScrollBar().maximum())
 
@@ -17,8 +17,10 @@ from PySide6.QtGui import (
     QDesktopServices, QPixmap, QConicalGradient, QImage
 )
 from client.widgets.messages_page.dialogs import HybridGalleryOverlay
-from .cache import ImageCache
-from .network import ChatImageLoader, DataLoader
+from client.imagecache import ImageCache, image_key, widget_px_size
+from client import decode as decoder
+from client.aio import net
+from client.scheduler import scheduler
 
 MAX_ATTACHMENTS = 10
 ATTACHMENT_SPLITTER = "<<<SPLIT>>>"
@@ -36,6 +38,24 @@ def open_local_or_remote_file(path_str):
             
     QDesktopServices.openUrl(url)
 
+def legacy_preview(msg):
+    """Превью для ответов старого сервера, где content еще склеен через <<<SPLIT>>>."""
+    if ATTACHMENT_SPLITTER in msg:
+        p = msg.split(ATTACHMENT_SPLITTER)
+        t = p[0].strip()
+        if t: 
+            return t
+        if any('cmd://image' in x for x in p): 
+            return "🖼️ Изображение"
+        if any('cmd://file' in x for x in p): 
+            return "📄 Документ"
+        return "Вложение"
+    if "cmd://image" in msg: 
+        return "🖼️ Изображение"
+    if "cmd://file" in msg: 
+        return "📄 Документ"
+    return msg
+
 class DateHeaderWidget(QWidget):
     def __init__(self, date_text, parent=None):
         super().__init__(parent)
@@ -83,9 +103,7 @@ class AttachmentChip(QFrame):
             self.lp.setStyleSheet("background:transparent; border-radius:8px;")
             self.sl.addWidget(self.lp)
             if path:
-                self.l = ChatImageLoader(path)
-                self.l.loaded.connect(self.set_img)
-                self.l.start()
+                net.call(net.fetch_image(path, size=widget_px_size(self)), self.set_img, owner=self)
             bc=QWidget()
             bc.setStyleSheet("background:transparent;")
             cl=QVBoxLayout(bc)
@@ -135,49 +153,130 @@ class AttachmentChip(QFrame):
 class AspectRatioLabel(QLabel):
     """
     Авто-скейл изображения. 
-    Обновлен: умеет принимать raw bytes (set_full_data) и создавать QMovie для GIF,
+    Обновлен: грузит по адресу (load) или принимает raw bytes (set_full_data), создает QMovie для GIF,
     отображая полностью в рамках 380x500 (Aspect Ratio).
     """
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setScaledContents(False) # Сами рисуем
+        self.ic = ImageCache()
         self.movie = None
         self.pixmap_cached = None
+        self.placeholder = None # размытая заглушка до прихода миниатюры
         self.buf = None
-
-    def set_full_data(self, data):
-        # Очищаем старое
+        self.pending = None # (адрес, ключ кэша): миниатюра не загружена, загрузку заказывает страница (request)
+        self._load = None # (приоритет, токен) идущей загрузки
+
+    @staticmethod
+    def _fit_box(sz):
+        # Max Box
+        w, h = 380, 500
+        return sz if sz.width() <= w and sz.height() <= h else sz.scaled(w, h, Qt.KeepAspectRatio)
+
+    def _box(self):
+        # Рамка 380x500 в физических пикселях: больше картинка в пузыре не показывается
+        dpr = self.devicePixelRatioF()
+        return round(380 * dpr), round(500 * dpr)
+
+    def load(self, url, meta=None):
+        """Картинка по адресу в три этапа: заглушка из BlurHash метаданных (сразу),
+        миниатюра под размер пузыря (дисковый кэш миниатюр или из оригинала),
+        оригинал — только в просмотрщике. Миниатюра грузится не сразу, а по request():
+        пузыри далеко за пределами экрана сеть не занимают."""
+        meta = meta or {}
+        if meta.get('width') and meta.get('height'):
+            # Размер известен заранее — лента не прыгает, когда приходит картинка
+            self.setFixedSize(self._fit_box(QSize(int(meta['width']), int(meta['height']))))
+        k = image_key(url, self._box())
+        pm = self.ic.find(k)
+        if pm is not None:
+            self._set_pixmap(pm)
+            return
+        bh = meta.get('blurhash')
+        if bh:
+            pk = f"bh:{bh}"
+            self.placeholder = self.ic.find(pk)
+            if self.placeholder is None:
+                img = decoder.placeholder_image(bh, int(meta.get('width') or 0), int(meta.get('height') or 0))
+                if img is not None:
+                    self.placeholder = self.ic.insert(pk, QPixmap.fromImage(img))
+        self.pending = (url, k)
+
+    def request(self, priority, token=None):
+        """Загрузка миниатюры с приоритетом client.scheduler; token — родительский (чата).
+        Повторный вызов с тем же или более низким приоритетом ничего не меняет."""
+        if self.pending is None:
+            return
+        if self._load is not None:
+            if self._load[0] <= priority and not self._load[1].cancelled:
+                return
+            # Повышение приоритета: перезапуск; сам запрос не рвется (single-flight в client.aio)
+            self._load[1].cancel()
+        tok = (token or scheduler.token_for(self)).child()
+        self._load = (priority, tok)
+        url, k = self.pending
+        net.call(net.fetch_thumbnail(url, self._box()),
+                 lambda r, k=k: self._on_thumbnail(r, k), owner=self, priority=priority, token=tok)
+
+    def release(self):
+        """Пузырь ушел далеко за экран: загрузка отменяется, pending остается до возврата."""
+        if self._load is not None:
+            self._load[1].cancel()
+            self._load = None
+
+    def _on_thumbnail(self, r, key):
+        self.pending = None
+        self._load = None
+        self.set_decoded(r, key)
+
+    def _reset(self):
         if self.movie:
             self.movie.stop()
             self.movie = None
         self.pixmap_cached = None
 
+    def set_decoded(self, r, key=None):
+        self._reset()
+        if r.raw:
+            self._start_movie(r.raw)
+        elif r.image is None:
+            self.placeholder = None
+            self.setText("Error")
+        else:
+            pm = QPixmap.fromImage(r.image)
+            self._set_pixmap(self.ic.insert(key, pm) if key else pm)
+
+    def set_full_data(self, data):
+        # Байты уже на руках: декодирование все равно уходит из GUI-потока
+        self._reset()
         if not data:
             self.setText("Error")
             return
-        
-        is_gif = (data[:6].startswith(b'GIF') or b'WEBPVP8' in data[:20])
-        
-        if is_gif:
-            self.buf = QBuffer()
-            self.buf.setData(data)
-            self.buf.open(QIODevice.ReadOnly)
-            self.movie = QMovie(self.buf, b"GIF")
-            self.movie.start()
-            # Для определения размеров можно подождать, но проще взять frame 0
-            self.movie.frameChanged.connect(self.repaint)
-            self.setMinimumSize(50, 50)
-            self.resize(300, 200) # Init
-        else:
-            pm = QPixmap()
-            pm.loadFromData(data)
-            if pm.isNull():
-                self.setText("Error")
-            else:
-                self.pixmap_cached = pm
-                # Init scale
-                self.resize_to_fit()
-                
+        k = image_key(data, self._box())
+        pm = self.ic.find(k)
+        if pm is not None:
+            self._set_pixmap(pm)
+            return
+        net.call(net.decode(data, self._box(), Qt.KeepAspectRatio),
+                 lambda r, k=k: self.set_decoded(r, k), owner=self)
+
+    def _start_movie(self, data):
+        self.buf = QBuffer()
+        self.buf.setData(data)
+        self.buf.open(QIODevice.ReadOnly)
+        self.movie = QMovie(self.buf, b"GIF")
+        self.movie.start()
+        # Для определения размеров можно подождать, но проще взять frame 0
+        self.movie.frameChanged.connect(self.repaint)
+        self.setMinimumSize(50, 50)
+        self.resize(300, 200) # Init
+
+    def _set_pixmap(self, pm):
+        self.pixmap_cached = pm
+        # Init scale
+        self.resize_to_fit()
+        self.update()
+
     def resize_to_fit(self):
         pm = None
         if self.movie and self.movie.currentPixmap():
@@ -186,13 +285,7 @@ class AspectRatioLabel(QLabel):
              pm = self.pixmap_cached
         
         if pm and not pm.isNull():
-             # Max Box
-             w, h = 380, 500
-             if pm.width() <= w and pm.height() <= h:
-                 sc_size = pm.size()
-             else:
-                 sc_size = pm.scaled(w, h, Qt.KeepAspectRatio, Qt.SmoothTransformation).size()
-             self.setFixedSize(sc_size)
+             self.setFixedSize(self._fit_box(pm.size()))
 
     def paintEvent(self, e):
         # Отрисовка с сохранением пропорций и масштабированием под виджет
@@ -204,6 +297,12 @@ class AspectRatioLabel(QLabel):
                  self.resize_to_fit()
         elif self.pixmap_cached:
              target = self.pixmap_cached
+        elif self.placeholder:
+             # Заглушка крошечная: растягивается на весь виджет, размытие — ее суть
+             p = QPainter(self)
+             p.setRenderHint(QPainter.SmoothPixmapTransform)
+             p.drawPixmap(self.rect(), self.placeholder)
+             return
              
         if target and not target.isNull():
              p = QPainter(self)
@@ -268,7 +367,7 @@ class AttachmentPreviewWidget(QFrame):
 
 class ModernAvatar(QWidget):
     """
-    Теперь умеет качать сырые данные (DataLoader) для отображения GIF.
+    Картинка декодируется в пуле сразу в размере виджета; GIF играет через QMovie.
     """
     def __init__(self, size=40, text="?", status_color=None, parent=None):
         super().__init__(parent)
@@ -283,8 +382,11 @@ class ModernAvatar(QWidget):
 
     def set_data(self, t, d=None):
         self.tx=t.upper() if t else "?"
-        # Сброс
+        # Сброс; незавершенная загрузка прежнего аватара не должна его перезаписать
         self.pm=None
+        if self.ld:
+            self.ld.cancel()
+            self.ld=None
         if self.mv: 
             self.mv.stop()
             self.mv=None
@@ -293,12 +395,13 @@ class ModernAvatar(QWidget):
             self.update()
             return
 
-        # Логика загрузки
+        # Логика загрузки: по адресу сначала кэш уже уменьшенной копии — без сети и декодирования
         if isinstance(d,str) and (d.startswith("http") or d.startswith("/")):
-            # Используем DataLoader для bytes
-            self.ld = DataLoader(d)
-            self.ld.loaded.connect(self._Lb)
-            self.ld.start()
+            k=image_key(d, widget_px_size(self))
+            self.pm=self.ic.find(k)
+            if self.pm is None:
+                self.ld = net.call(net.fetch_decoded(d, widget_px_size(self)),
+                                   lambda r, k=k: self._set_decoded(r, k), owner=self)
         elif isinstance(d,bytes): 
             self._Lb(d)
         elif isinstance(d,str) and d.startswith("data:"): 
@@ -308,23 +411,31 @@ class ModernAvatar(QWidget):
     def _Lb(self, d):
         if not d: 
             return
-        # Определение GIF
-        anim = (d[:6].startswith(b'GIF') or b'WEBPVP8' in d[:20])
-        k=f"av_{hash(d)&0xFFFFFFFF}"
-        
-        if anim: 
+        sz=widget_px_size(self)
+        k=image_key(d, sz)
+        self.pm=self.ic.find(k)
+        if self.pm is None:
+            # Декодирование (и определение GIF) — в пуле, уже в размере виджета
+            self.ld = net.call(net.decode(d, sz), lambda r, k=k: self._set_decoded(r, k), owner=self)
+        self.update()
+
+    def _set_decoded(self, r, k):
+        self.ld=None
+        if r.raw: 
+            # QMovie у каждого виджета свой: общий проигрыватель нельзя остановить, не задев других
             self.bf=QBuffer()
-            self.bf.setData(d)
+            self.bf.setData(r.raw)
             self.bf.open(QIODevice.ReadOnly)
-            self.mv=self.ic.get_movie(k, self.bf)
-        
-        if self.mv and self.mv.isValid(): 
-            self.mv.frameChanged.connect(self.repaint)
-            self.mv.start()
-        else: 
-            # Не анимация или кэш пиксмапа
-            self.pm=self.ic.get_pixmap(k, d)
-        
+            self.mv=QMovie(self.bf, QByteArray())
+            self.mv.setCacheMode(QMovie.CacheAll)
+            if self.mv.isValid(): 
+                self.mv.frameChanged.connect(self.repaint)
+                self.mv.start()
+            else:
+                self.mv=None
+        elif r.image is not None: 
+            # В кэше — копия под размер виджета
+            self.pm=self.ic.insert(k, QPixmap.fromImage(r.image))
         self.update()
 
     def _L64(self, s):
@@ -599,27 +710,26 @@ class ChatListItem(QWidget):
                 pass
         self.date_lbl.setStyleSheet("color:#94a3b8; font-size:11px; background:transparent; border:none;")
         top.addWidget(self.date_lbl)
-        msg = str(data.get('last_message') or "Нет сообщений")
-        if ATTACHMENT_SPLITTER in msg:
-            p = msg.split(ATTACHMENT_SPLITTER)
-            t = p[0].strip()
-            if t: 
-                msg = t
-            elif any('cmd://image' in x for x in p): 
-                msg = "🖼️ Изображение"
-            elif any('cmd://file' in x for x in p): 
-                msg = "📄 Документ"
-            else: 
-                msg = "Вложение"
-        elif "cmd://image" in msg: 
-            msg = "🖼️ Изображение"
-        elif "cmd://file" in msg: 
-            msg = "📄 Документ"
+        if 'last_preview' in data:
+            # Превью уже посчитано сервером при записи
+            msg = str(data.get('last_preview') or "Нет сообщений")
+        else:
+            msg = legacy_preview(str(data.get('last_message') or "Нет сообщений"))
         elided = QFontMetrics(QFont("Segoe UI", 13)).elidedText(msg.replace('\n',' '), Qt.ElideRight, 180)
         self.m_lbl = QLabel(elided)
         self.m_lbl.setStyleSheet("color:#94a3b8; font-size:13px; background:transparent; border:none;")
+        bottom = QHBoxLayout()
+        bottom.addWidget(self.m_lbl)
+        bottom.addStretch()
+        unread = data.get('unread') or 0
+        if unread:
+            self.unread_lbl = QLabel(str(unread) if unread < 100 else "99+")
+            self.unread_lbl.setAlignment(Qt.AlignCenter)
+            self.unread_lbl.setMinimumWidth(20)
+            self.unread_lbl.setStyleSheet("background:#6366f1; color:white; font-size:11px; font-weight:700; border-radius:10px; padding:2px 6px;")
+            bottom.addWidget(self.unread_lbl)
         self.info_layout.addLayout(top)
-        self.info_layout.addWidget(self.m_lbl)
+        self.info_layout.addLayout(bottom)
         self.layout.addWidget(self.info_widget)
         self.set_collapsed(is_collapsed)
 
@@ -678,12 +788,10 @@ class ChatBubble(QFrame):
                 al = AspectRatioLabel()
                 al.setStyleSheet("background:rgba(0,0,0,0.1); border-radius:8px;")
                 al.setCursor(Qt.PointingHandCursor)
-                # Используем DataLoader чтобы работали GIFы и в Bubble
-                ld = DataLoader(url)
-                ld.loaded.connect(al.set_full_data)
-                ld.start()
-                # Кликом передаем картинку (вьювер пока на Pixmap, анимация во вьювере может быть добавлена по аналогии)
-                al.mousePressEvent = lambda e, u=url: self._open_viewer(u)
+                # Заглушка -> миниатюра в размере пузыря; GIF — сырыми байтами для QMovie
+                al.load(url, a)
+                # Оригинал грузится только по клику (вьювер пока на Pixmap, анимация во вьювере может быть добавлена по аналогии)
+                al.mousePressEvent = lambda e, u=url, al=al: self._open_viewer(u, al)
                 self.layout.addWidget(al)
             else:
                 f = QFrame()
@@ -709,13 +817,21 @@ class ChatBubble(QFrame):
         self.layout.addLayout(meta)
         self.update_bubble_theme(True)
 
-    def _open_viewer(self, u):
-        # Viewer пока прост, оставим ChatImageLoader для него, 
-        # но передаем QPixmap. В идеале Overlay тоже надо научить играть GIF
-        l = ChatImageLoader(u)
-        l.loaded.connect(lambda p: HybridGalleryOverlay(QPixmap.fromImage(p), self.window()).exec() if p else None)
-        self._tmp = l
-        l.start()
+    def _open_viewer(self, u, al=None):
+        # Viewer пока прост: передаем QPixmap. В идеале Overlay тоже надо научить играть GIF
+        ic = ImageCache()
+        pm = ic.find(image_key(u))
+        if pm is not None:
+            HybridGalleryOverlay(pm, self.window()).exec()
+            return
+        thumb = al.pixmap_cached if al is not None else None
+        if thumb is None or thumb.isNull():
+            net.call(net.fetch_image(u), lambda p: HybridGalleryOverlay(ic.insert(image_key(u), QPixmap.fromImage(p)), self.window()).exec() if p else None, owner=self)
+            return
+        # Сразу открываем миниатюру, оригинал подменит ее по готовности
+        ov = HybridGalleryOverlay(thumb, self.window())
+        net.call(net.fetch_image(u), lambda p: ov.set_pixmap(ic.insert(image_key(u), QPixmap.fromImage(p))) if p else None, owner=ov)
+        ov.exec()
 
     def update_bubble_theme(self, is_dark):
         own = self.is_own
@@ -1,47 +1,22 @@
 import hashlib
-import requests
-import urllib3
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame, QDialog, QPushButton, QGraphicsDropShadowEffect
-from PySide6.QtCore import Qt, QRunnable, QThreadPool, Signal, QObject
+from PySide6.QtCore import Qt
 from PySide6.QtGui import QColor
 from client.widgets.avatar_view import CircularAvatar, AvatarViewer
-
-urllib3.disable_warnings()
-API_URL = "https://localhost:8001"
-
-class PSignals(QObject):
-    res = Signal(dict, bytes)
-
-class PLoader(QRunnable):
-    def __init__(self, u):
-        super().__init__()
-        self.u = u
-        self.signals = PSignals()
-
-    def run(self):
-        d = {"friends": "0", "status": "", "bio": ""}
-        ab = None
-        try:
-            r1 = requests.get(f"{API_URL}/friends/list", params={"user": self.u}, verify=False, timeout=3)
-            if r1.status_code == 200:
-                d["friends"] = str(len(r1.json().get("friends", [])))
-            
-            r2 = requests.get(f"{API_URL}/user/profile_info", params={"username": self.u}, verify=False, timeout=3)
-            if r2.status_code == 200:
-                j = r2.json()
-                d["status"] = j.get("status_msg", "")
-                d["bio"] = j.get("bio", "")
-                u = j.get("avatar_url")
-                if u:
-                    if u.startswith("/"):
-                        u = f"{API_URL}{u}"
-                    ir = requests.get(u, verify=False, timeout=5)
-                    if ir.status_code == 200:
-                        ab = ir.content
-        except:
-            pass
-        
-        self.signals.res.emit(d, ab or b'')
+from client.aio import net
+
+async def _load_profile(u):
+    d = {"friends": "0", "status": "", "bio": ""}
+    # Счетчик друзей, статус и ссылки на аватар приходят одной сводкой; запросы идут через net —
+    # одна таблица совмещения с боковой панелью, открытый профиль и панель не качают аватар дважды
+    j = await net.summary(u)
+    if not j:
+        return d, b''
+    d["friends"] = str(j.get("friends", 0))
+    d["status"] = j.get("status_msg", "")
+    d["bio"] = j.get("bio", "")
+    url = j.get("avatar_url")
+    return d, (await net.fetch_cached(url, timeout=5) if url else b'')
 
 class BaseProfileView(QWidget):
     def __init__(self, username=None, parent=None):
@@ -155,9 +130,7 @@ class BaseProfileView(QWidget):
 
     def refresh(self):
         if hasattr(self, 'usr') and self._is_alive:
-            l = PLoader(self.usr)
-            l.signals.res.connect(self.done)
-            QThreadPool.globalInstance().start(l)
+            net.call(_load_profile(self.usr), lambda r: self.done(*r), owner=self)
 
     def done(self, d, b):
         # ЗАЩИТА
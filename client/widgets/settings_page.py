@@ -1,5 +1,4 @@
-import requests
-import urllib3
+import asyncio
 import os
 import io
 from PySide6.QtWidgets import (
@@ -8,8 +7,11 @@ from PySide6.QtWidgets import (
     QGraphicsDropShadowEffect, QFileDialog, QGraphicsView,
     QGraphicsScene, QGraphicsPixmapItem, QSlider, QGraphicsObject
 )
-from PySide6.QtCore import Qt, Signal, QThread, QPoint, QBuffer, QIODevice, QByteArray, QRectF
+from PySide6.QtCore import Qt, Signal, QPoint, QBuffer, QIODevice, QByteArray, QRectF
 from PySide6.QtGui import QColor, QPixmap, QPainter, QPainterPath, QPen, QMovie
+from client.aio import net
+from client.scheduler import scheduler
+from client.widgets.messages_page.network import profiles
 
 try:
     from PIL import Image, ImageSequence
@@ -17,108 +19,74 @@ try:
 except ImportError:
     HAS_PIL = False
 
-urllib3.disable_warnings()
-API_URL = "https://localhost:8001"
-
-class UpWorker(QThread):
-    done = Signal(bool, str)
-
-    def __init__(self, u, path=None, data=None, rem=False, crop_data=None):
-        super().__init__()
-        self.u = u
-        self.path = path
-        self.data = data
-        self.rem = rem
-        self.crop_data = crop_data
-
-    def run(self):
-        try:
-            timeout = 120
-            if self.rem:
-                r = requests.post(f"{API_URL}/user/avatar/delete", json={"username": self.u}, verify=False, timeout=10)
-            elif self.path and self.crop_data and self.path.lower().endswith('.gif') and HAS_PIL:
-                try:
-                    x, y, w, h = self.crop_data
-                    with Image.open(self.path) as im:
-                        frames = []
-                        duration = im.info.get('duration', 100)
-                        for frame in ImageSequence.Iterator(im):
-                            cropped = frame.crop((x, y, x + w, y + h))
-                            cropped = cropped.resize((500, 500), Image.LANCZOS)
-                            frames.append(cropped)
-                        b_io = io.BytesIO()
-                        if frames:
-                            frames[0].save(
-                                b_io,
-                                format="GIF",
-                                save_all=True,
-                                append_images=frames[1:],
-                                loop=0,
-                                duration=duration,
-                                disposal=2
-                            )
-                        final_bytes = b_io.getvalue()
-                        r = requests.post(
-                            f"{API_URL}/user/avatar/upload",
-                            data={'username': self.u},
-                            files={'file': ("avatar.gif", final_bytes, 'image/gif')},
-                            verify=False,
-                            timeout=timeout
-                        )
-                except Exception as ex:
-                    self.done.emit(False, str(ex))
-                    return
-            elif self.path:
-                with open(self.path, 'rb') as f:
-                    r = requests.post(f"{API_URL}/user/avatar/upload", data={'username': self.u},
-                                      files={'file': (os.path.basename(self.path), f.read(), 'image/*')},
-                                      verify=False, timeout=timeout)
-            else:
-                r = requests.post(f"{API_URL}/user/avatar/upload", data={'username': self.u},
-                                  files={'file': ("avatar.png", self.data, 'image/png')}, verify=False, timeout=30)
-
-            if r.status_code == 200:
-                self.done.emit(True, "OK")
-            else:
-                self.done.emit(False, str(r.status_code))
-        except Exception as e:
-            self.done.emit(False, str(e))
-
-class AuthW(QThread):
-    res = Signal(bool, str)
-
-    def __init__(self, l, p):
-        super().__init__()
-        self.l = l
-        self.p = p
-
-    def run(self):
-        try:
-            r = requests.post(f"{API_URL}/login", json={"login": self.l, "pw": self.p}, verify=False, timeout=5)
-            if r.status_code == 200:
-                self.res.emit(True, self.l)
-            else:
-                self.res.emit(False, "Ошибка входа")
-        except:
-            self.res.emit(False, "Ошибка сети")
-
-class DelW(QThread):
-    res = Signal(bool, str)
-
-    def __init__(self, u, p):
-        super().__init__()
-        self.u = u
-        self.p = p
-
-    def run(self):
-        try:
-            r = requests.delete(f"{API_URL}/user/delete", json={"username": self.u, "pw": self.p}, verify=False, timeout=10)
-            if r.status_code == 200:
-                self.res.emit(True, "OK")
-            else:
-                self.res.emit(False, "Неверный пароль")
-        except:
-            self.res.emit(False, "Ошибка сети")
+def _avatar_file(path=None, data=None, crop_data=None):
+    """(имя, байты, mime) для загрузки. Чтение файла и нарезка GIF — в пуле декодирования."""
+    if path and crop_data and path.lower().endswith('.gif') and HAS_PIL:
+        x, y, w, h = crop_data
+        with Image.open(path) as im:
+            frames = []
+            duration = im.info.get('duration', 100)
+            for frame in ImageSequence.Iterator(im):
+                cropped = frame.crop((x, y, x + w, y + h))
+                cropped = cropped.resize((500, 500), Image.LANCZOS)
+                frames.append(cropped)
+            b_io = io.BytesIO()
+            if frames:
+                frames[0].save(
+                    b_io,
+                    format="GIF",
+                    save_all=True,
+                    append_images=frames[1:],
+                    loop=0,
+                    duration=duration,
+                    disposal=2
+                )
+            return "avatar.gif", b_io.getvalue(), 'image/gif'
+    if path:
+        with open(path, 'rb') as f:
+            return os.path.basename(path), f.read(), 'image/*'
+    return "avatar.png", data, 'image/png'
+
+async def save_avatar(u, path=None, data=None, rem=False, crop_data=None):
+    """(успех, сообщение). Сеть — в цикле client.aio, без отдельного потока на загрузку."""
+    try:
+        if rem:
+            r = await net.delete_avatar(u)
+        else:
+            loop = asyncio.get_running_loop()
+            name, body, mime = await loop.run_in_executor(scheduler.decode, _avatar_file, path, data, crop_data)
+            r = await net.upload_avatar(u, name, body, mime)
+        if r.status_code == 200:
+            # Кэш пакетных профилей иначе отдавал бы старый avatar_url до конца TTL
+            profiles.invalidate(u)
+            return True, "OK"
+        return False, str(r.status_code)
+    except Exception as e:
+        return False, str(e)
+
+async def save_profile(u, status_msg, bio):
+    try:
+        r = await net.update_profile(u, status_msg, bio)
+    except Exception:
+        return False, "Нет соединения"
+    if r.status_code != 200:
+        return False, "Ошибка сервера"
+    profiles.invalidate(u)
+    return True, "OK"
+
+async def check_login(login, pw):
+    try:
+        r = await net.login(login, pw)
+    except Exception:
+        return False, "Ошибка сети"
+    return (True, login) if r.status_code == 200 else (False, "Ошибка входа")
+
+async def delete_account(u, pw):
+    try:
+        r = await net.delete_account(u, pw)
+    except Exception:
+        return False, "Ошибка сети"
+    return (True, "OK") if r.status_code == 200 else (False, "Неверный пароль")
 
 class GifItem(QGraphicsObject):
     def __init__(self, path):
@@ -409,7 +377,6 @@ class AvDialog(BDialog):
         self.inf.setStyleSheet("color:#94a3b8; font-size:12px; margin-top:5px;")
         self.cl.addWidget(self.inf)
 
-        self.worker = None
         self.fp = None
         self.min_scale = 1.0
         self.max_scale = 5.0
@@ -468,27 +435,24 @@ class AvDialog(BDialog):
 
         if is_gif_file and not self.ck.isChecked():
             crop_params = self.cr.get_crop_data()
-            self.worker = UpWorker(self.u, path=self.fp, crop_data=crop_params)
+            job = save_avatar(self.u, path=self.fp, crop_data=crop_params)
         elif self.ck.isChecked():
-            self.worker = UpWorker(self.u, path=self.fp)
+            job = save_avatar(self.u, path=self.fp)
         else:
             i = self.cr.get_snapshot()
             b = QByteArray()
             q = QBuffer(b)
             q.open(QIODevice.WriteOnly)
             i.save(q, "PNG")
-            self.worker = UpWorker(self.u, data=b.data())
+            job = save_avatar(self.u, data=b.data())
 
-        self.worker.done.connect(self.fin)
-        self.worker.start()
+        net.call(job, lambda r: self.fin(*r), owner=self)
 
     def rem(self):
         self.inf.setText("Удаление...")
         self.inf.setStyleSheet("color:#ef4444")
         self.sb.setEnabled(False)
-        self.worker = UpWorker(self.u, rem=True)
-        self.worker.done.connect(self.fin)
-        self.worker.start()
+        net.call(save_avatar(self.u, rem=True), lambda r: self.fin(*r), owner=self)
 
     def fin(self, ok, msg):
         self.sb.setEnabled(True)
@@ -529,17 +493,13 @@ class EdDialog(BDialog):
     def sv(self):
         self.st.setText("Сохранение...")
         self.st.setStyleSheet("color:#6366f1")
-        try:
-            r = requests.post(f"{API_URL}/user/profile_update",
-                              json={"username": self.u, "status_msg": self.is_.text(), "bio": self.ib.text()},
-                              verify=False)
-            if r.status_code == 200:
-                self.accept()
-            else:
-                self.st.setText("Ошибка сервера")
-                self.st.setStyleSheet("color:#ef4444")
-        except:
-            self.st.setText("Нет соединения")
+        net.call(save_profile(self.u, self.is_.text(), self.ib.text()), lambda r: self.fin(*r), owner=self)
+
+    def fin(self, ok, msg):
+        if ok:
+            self.accept()
+        else:
+            self.st.setText(msg)
             self.st.setStyleSheet("color:#ef4444")
 
 class SwDialog(BDialog):
@@ -565,7 +525,6 @@ class SwDialog(BDialog):
         self.bn.clicked.connect(self.go)
         self.cl.addWidget(self.bn)
         self.cl.addStretch()
-        self.w = None
         self.pending_login = None 
 
     def go(self):
@@ -573,17 +532,10 @@ class SwDialog(BDialog):
         self.inf.setStyleSheet("color:#6366f1")
         self.bn.setEnabled(False) # Блок кнопки
         
-        # Создаем поток авторизации БЕЗ родителя (self), чтобы GC не убил его вместе с диалогом
-        self.w = AuthW(self.ul.text(), self.pw.text())
-        self.w.res.connect(self.fin)
-        self.w.start()
+        # Ответ, пришедший после закрытия диалога, никуда не доставляется (владелец — диалог)
+        net.call(check_login(self.ul.text(), self.pw.text()), lambda r: self.fin(*r), owner=self)
 
     def fin(self, o, m):
-        # Безопасно завершаем поток
-        if self.w:
-            self.w.quit()
-            self.w.wait()
-        
         self.bn.setEnabled(True)
         if o:
             self.pending_login = m
@@ -591,15 +543,6 @@ class SwDialog(BDialog):
         else:
             self.inf.setText(m)
             self.inf.setStyleSheet("color:#ef4444")
-            self.w = None # Сброс ссылки
-
-    def closeEvent(self, e):
-        # Гарантированная остановка потока
-        if self.w and self.w.isRunning():
-            self.w.res.disconnect() # Отцепляем сигнал, чтобы не крашнуло при ответе в мертвый диалог
-            self.w.quit()
-            self.w.wait() # Ждем завершения
-        super().closeEvent(e)
 
 class DelDialog(BDialog):
     cf = Signal(str)
@@ -624,14 +567,11 @@ class DelDialog(BDialog):
         bn.clicked.connect(self.go)
         self.cl.addWidget(bn)
         self.cl.addStretch()
-        self.w = None
 
     def go(self):
         self.inf.setText("Обработка...")
         self.inf.setStyleSheet("color:#6366f1")
-        self.w = DelW(self.u, self.pw.text())
-        self.w.res.connect(self.fin)
-        self.w.start()
+        net.call(delete_account(self.u, self.pw.text()), lambda r: self.fin(*r), owner=self)
 
     def fin(self, ok, msg):
         if ok:
@@ -790,14 +730,13 @@ class SettingsPage(QWidget):
 
     def c_pr(self):
         if self.u:
-            try:
-                r = requests.get(f"{API_URL}/user/profile_info", params={"username": self.u}, verify=False)
-                if r.status_code == 200:
-                    j = r.json()
-                    if EdDialog(self.u, j.get("status_msg", ""), j.get("bio", ""), self).exec():
-                        self.profile_changed.emit()
-            except:
-                pass
+            # Текущие статус и био — без блокировки окна на время запроса
+            net.call(net.profile_info(self.u), self._edit_profile, owner=self)
+
+    def _edit_profile(self, j):
+        if j is not None:
+            if EdDialog(self.u, j.get("status_msg", ""), j.get("bio", ""), self).exec():
+                self.profile_changed.emit()
 
     def c_sw(self):
         # Передаем self.window() как родителя, чтобы диалог был модальным для всего окна, 
@@ -1,35 +1,13 @@
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel
-from PySide6.QtCore import Qt, QRunnable, QThreadPool, Signal, QObject
-import requests
-import urllib3
+from PySide6.QtCore import Qt
 from client.widgets.avatar_view import CircularAvatar, AvatarViewer
-urllib3.disable_warnings()
-API_URL = "https://localhost:8001"
+from client.aio import net
 
-class FetcherSignals(QObject):
-    done = Signal(bytes)
-
-class Fetcher(QRunnable):
-    def __init__(self, api, u):
-        super().__init__()
-        self.api = api
-        self.u = u
-        self.signals = FetcherSignals()
-        self.setAutoDelete(True) # Важно: автоудаление
-        
-    def run(self):
-        try:
-            # Делаем короткий таймаут
-            r = requests.get(f"{self.api}/user/profile_info", params={"username": self.u}, verify=False, timeout=3)
-            if r.status_code == 200:
-                u = r.json().get('avatar_url')
-                if u:
-                    if u.startswith("/"):
-                        u = f"{self.api}{u}"
-                    res = requests.get(u, verify=False, timeout=3)
-                    self.signals.done.emit(res.content)
-        except:
-            pass
+async def _load_avatar(u):
+    # Один запрос сводки; аватар скачивается, только если изменился
+    d = await net.summary(u)
+    url = d.get('avatar_url') if d else None
+    return await net.fetch_cached(url, timeout=3) if url else b""
 
 class Sidebar(QWidget):
     def __init__(self):
@@ -83,13 +61,11 @@ class Sidebar(QWidget):
 
     def reload_avatar(self):
         self.av.set_letter(self.u_name)
-        f = Fetcher(API_URL, self.u_name)
-        f.signals.done.connect(self.on_avatar_loaded) # Подключаем не напрямую
-        QThreadPool.globalInstance().start(f)
+        net.call(_load_avatar(self.u_name), self.on_avatar_loaded, owner=self)
 
     def on_avatar_loaded(self, data):
         # ЗАЩИТА: Если виджет уже удален или помечен как мертвый, не трогаем UI
-        if not self._is_alive: 
+        if not data or not self._is_alive: 
             return
         try:
             self.av.set_data(data)